@@ -366,6 +366,108 @@ def findBiggestAt(alias):
     else:
         return 0
 
+def copyTokens(tokens):
+    return [copyTokens(t) if isinstance(t, list) else t for t in tokens]
+
+def tokenizerSettings():
+    nested = conf.supybot.commands.nested
+    return (nested(), nested.brackets(), nested.pipeSyntax(),
+            conf.supybot.commands.quotes())
+
+class AkaTemplate(object):
+    """The body of an aka, analysed once instead of on each call."""
+    __slots__ = ('original', 'biggestDollar', 'biggestAt', 'wildcard',
+                 'lock', 'method', '_tokens', '_settings')
+    def __init__(self, original, lock):
+        self.original = original
+        self.biggestDollar = findBiggestDollar(original)
+        self.biggestAt = findBiggestAt(original)
+        self.wildcard = '$*' in original
+        self.lock = lock
+        self.method = None
+        self._tokens = None
+        self._settings = None
+
+    def tokenize(self):
+        """Returns a copy of the tokens of the body, which the caller may
+        modify."""
+        settings = tokenizerSettings()
+        if self._tokens is None or settings != self._settings:
+            self._tokens = callbacks.tokenize(self.original)
+            self._settings = settings
+        return copyTokens(self._tokens)
+
+class AkaCache(object):
+    """Keeps the names of the akas of each channel, and the templates of
+    the akas which were called, in memory.  Akas must only be changed
+    through the methods of this class, so it can be kept up to date."""
+    def __init__(self, db):
+        self.db = db
+        self.names = ircutils.IrcDict() # channel -> set of names
+        self.templates = ircutils.IrcDict() # channel -> {name: template}
+
+    @staticmethod
+    def canonicalName(name):
+        name = callbacks.canonicalName(name, preserve_spaces=True)
+        if minisix.PY2 and isinstance(name, str):
+            name = name.decode('utf8')
+        return name
+
+    def get_names(self, channel):
+        try:
+            return self.names[channel]
+        except KeyError:
+            names = set(self.canonicalName(name)
+                        for (name,) in self.db.get_aka_list(channel))
+            self.names[channel] = names
+            return names
+
+    def has_aka(self, channel, name):
+        return self.canonicalName(name) in self.get_names(channel)
+
+    def get_template(self, channel, name):
+        """Returns the template of the given aka, or None if the channel
+        has no such aka."""
+        name = self.canonicalName(name)
+        templates = self.templates.setdefault(channel, {})
+        try:
+            return templates[name]
+        except KeyError:
+            if name not in self.get_names(channel):
+                return None
+            original = self.db.get_alias(channel, name)
+            if not original:
+                return None
+            lock = tuple(self.db.get_aka_lock(channel, name))
+            template = AkaTemplate(original, lock)
+            templates[name] = template
+            return template
+
+    def _invalidate(self, channel, name):
+        self.templates.get(channel, {}).pop(name, None)
+
+    def add_aka(self, channel, name, alias):
+        self.db.add_aka(channel, name, alias)
+        name = self.canonicalName(name)
+        if channel in self.names:
+            self.names[channel].add(name)
+        self._invalidate(channel, name)
+
+    def remove_aka(self, channel, name):
+        self.db.remove_aka(channel, name)
+        name = self.canonicalName(name)
+        if channel in self.names:
+            self.names[channel].discard(name)
+        self._invalidate(channel, name)
+
+    def lock_aka(self, channel, name, by):
+        self.db.lock_aka(channel, name, by)
+        self._invalidate(channel, self.canonicalName(name))
+
+    def unlock_aka(self, channel, name, by):
+        self.db.unlock_aka(channel, name, by)
+        self._invalidate(channel, self.canonicalName(name))
+
 if 'sqlite3' in conf.supybot.databases() and 'sqlite3' in available_db:
     AkaDB = SQLiteAkaDB
 elif 'sqlalchemy' in conf.supybot.databases() and 'sqlalchemy' in available_db:
@@ -381,6 +483,7 @@ class Aka(callbacks.Plugin):
     of the bot.conf, which doesn't have risk of corrupting the bot.conf file
     (this often happens when there are Unicode issues). Aka also
     introduces multi-worded akas."""
+    dynamicCommands = True
 
     def __init__(self, irc):
         self.__parent = super(Aka, self)
@@ -388,6 +491,19 @@ class Aka(callbacks.Plugin):
         # "sqlalchemy" is only for backward compatibility
         filename = conf.supybot.directories.data.dirize('Aka.sqlalchemy.db')
         self._db = AkaDB(filename)
+        self._cache = AkaCache(self._db)
+        # Channels whose akas are in callbacks.commandIndex.
+        self._indexedChannels = ircutils.IrcSet()
+
+    def refreshCommandIndex(self):
+        # Akas are looked up in the databases of the current channel and in
+        # the global one; add their names to the index the first time.
+        current = dynamic.channel or 'global'
+        for db in ('global', current):
+            if db not in self._indexedChannels:
+                self._indexedChannels.add(db)
+                for name in self._cache.get_names(db):
+                    callbacks.commandIndex.add(self, name)
 
     def isCommandMethod(self, name):
         args = name.split(' ')
@@ -401,8 +517,8 @@ class Aka(callbacks.Plugin):
         if minisix.PY2 and isinstance(name, str):
             name = name.decode('utf8')
         channel = dynamic.channel or 'global'
-        return self._db.has_aka(channel, name) or \
-                self._db.has_aka('global', name) or \
+        return self._cache.has_aka(channel, name) or \
+                self._cache.has_aka('global', name) or \
                 self.__parent.isCommandMethod(name)
     isCommand = isCommandMethod
 
@@ -437,14 +553,20 @@ class Aka(callbacks.Plugin):
                 pass
         name = callbacks.formatCommand(command)
         channel = dynamic.channel or 'global'
-        original = self._db.get_alias(channel, name)
-        if not original:
-            original = self._db.get_alias('global', name)
-        biggestDollar = findBiggestDollar(original)
-        biggestAt = findBiggestAt(original)
-        wildcard = '$*' in original
+        template = self._cache.get_template(channel, name)
+        if template is None:
+            template = self._cache.get_template('global', name)
+        if template.method is None:
+            template.method = self._makeAkaMethod(name, template)
+        return template.method
+
+    def _makeAkaMethod(self, name, template):
+        original = template.original
+        biggestDollar = template.biggestDollar
+        biggestAt = template.biggestAt
+        wildcard = template.wildcard
         def f(irc, msg, args):
-            tokens = callbacks.tokenize(original)
+            tokens = template.tokenize()
             if biggestDollar or biggestAt:
                 args = getArgs(args, required=biggestDollar, optional=biggestAt,
                                 wildcard=wildcard)
@@ -498,11 +620,7 @@ class Aka(callbacks.Plugin):
             flexargs = _(' at least')
         else:
             flexargs = ''
-        try:
-            lock = self._db.get_aka_lock(channel, name)
-        except AkaError:
-            lock = self._db.get_aka_lock('global', name)
-        (locked, locked_by, locked_at) = lock
+        (locked, locked_by, locked_at) = template.lock
         if locked:
             lock = ' ' + _('Locked by %s at %s') % (locked_by, locked_at)
         else:
@@ -516,7 +634,7 @@ class Aka(callbacks.Plugin):
         if self.__parent.isCommandMethod(name):
             raise AkaError(_('You can\'t overwrite commands in '
                     'this plugin.'))
-        if self._db.has_aka(channel, name):
+        if self._cache.has_aka(channel, name):
             raise AkaError(_('This Aka already exists.'))
         if len(name.split(' ')) > self.registryValue('maximumWordsInName'):
             raise AkaError(_('This Aka has too many spaces in its name.'))
@@ -525,14 +643,18 @@ class Aka(callbacks.Plugin):
         wildcard = '$*' in alias
         if biggestAt and wildcard:
             raise AkaError(_('Can\'t mix $* and optional args (@1, etc.)'))
-        self._db.add_aka(channel, name, alias)
+        self._cache.add_aka(channel, name, alias)
+        if channel in self._indexedChannels:
+            callbacks.commandIndex.add(self, name)
 
     def _remove_aka(self, channel, name, evenIfLocked=False):
         if not evenIfLocked:
             (locked, by, at) = self._db.get_aka_lock(channel, name)
             if locked:
                 raise AkaError(_('This Aka is locked.'))
-        self._db.remove_aka(channel, name)
+        self._cache.remove_aka(channel, name)
+        if channel in self._indexedChannels:
+            callbacks.commandIndex.remove(self, name)
 
     def add(self, irc, msg, args, optlist, name, alias):
         """[--channel <#channel>] <name> <command>
@@ -649,7 +771,7 @@ class Aka(callbacks.Plugin):
                 channel = arg
         self._checkManageCapabilities(irc, msg, channel)
         try:
-            self._db.lock_aka(channel, name, user.name)
+            self._cache.lock_aka(channel, name, user.name)
         except AkaError as e:
             irc.error(str(e))
         else:
@@ -672,7 +794,7 @@ class Aka(callbacks.Plugin):
                 channel = arg
         self._checkManageCapabilities(irc, msg, channel)
         try:
-            self._db.unlock_aka(channel, name, user.name)
+            self._cache.unlock_aka(channel, name, user.name)
         except AkaError as e:
             irc.error(str(e))
         else:
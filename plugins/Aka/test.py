@@ -130,6 +130,20 @@ class AkaChannelTestCase(ChannelPluginTestCase):
         self.assertNotRegexp('aka list', 'foobar')
         self.assertError('foobar')
 
+    def testCache(self):
+        self.assertNotError('aka add foo "echo bar $1"')
+        self.assertResponse('foo baz', 'bar baz')
+        self.assertResponse('foo qux', 'bar qux')
+        self.assertNotError('aka set foo "echo qux $1"')
+        self.assertResponse('foo baz', 'qux baz')
+        self.assertNotError('aka add --channel %s foo "echo chan"' %
+                            self.channel)
+        self.assertResponse('foo', 'chan')
+        self.assertNotError('aka remove --channel %s foo' % self.channel)
+        self.assertResponse('foo baz', 'qux baz')
+        self.assertNotError('aka remove foo')
+        self.assertError('foo baz')
+
     def testOptionalArgs(self):
         self.assertNotError('aka add myrepr "repr @1"')
         self.assertResponse('myrepr foo', '"foo"')
@@ -237,6 +237,7 @@ def makeNewAlias(name, alias):
 class Alias(callbacks.Plugin):
     """This plugin allows users to define aliases to commands and combinations
     of commands (via nesting)."""
+    dynamicCommands = True
     def __init__(self, irc):
         self.__parent = super(Alias, self)
         self.__parent.__init__(irc)
@@ -374,6 +375,8 @@ class Alias(callbacks.Plugin):
                 raise AliasError(format('Alias %q is locked.', name))
         f = makeNewAlias(name, alias)
         f = types.MethodType(f, self)
+        # Aliases read from the registry are not commands until added.
+        new = name not in self.aliases or self.aliases[name][2] is None
         if name in self.aliases:
             # We gotta remove it so its value gets updated.
             self.aliasRegistryRemove(name)
@@ -387,6 +390,8 @@ class Alias(callbacks.Plugin):
         conf.registerGlobalValue(aliasGroup.get(confname), 'locked',
                                  registry.Boolean(lock, ''))
         self.aliases[name] = [alias, lock, f]
+        if new:
+            callbacks.commandIndex.add(self, name)
 
     def removeAlias(self, name, evenIfLocked=False):
         name = callbacks.canonicalName(name)
@@ -394,6 +399,7 @@ class Alias(callbacks.Plugin):
             if evenIfLocked or not self.aliases[name][1]:
                 del self.aliases[name]
                 self.aliasRegistryRemove(name)
+                callbacks.commandIndex.remove(self, name)
             else:
                 raise AliasError('That alias is locked.')
         else:
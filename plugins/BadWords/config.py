@@ -59,9 +59,7 @@ conf.registerChannelValue(BadWords,'requireWordBoundaries',
     words to be independent words, or whether it will censor them within other
     words.  For instance, if 'darn' is a bad word, then if this is true, 'darn'
     will be censored, but 'darnit' will not.  You probably want this to be
-    false. After changing this setting, the BadWords regexp needs to be
-    regenerated by adding/removing a word to the list, or reloading the
-    plugin.""")))
+    false.""")))
 
 class String256(registry.String):
     def __call__(self):
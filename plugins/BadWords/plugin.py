@@ -28,8 +28,8 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
-import re
 import time
+import collections
 
 import supybot.conf as conf
 import supybot.utils as utils
@@ -41,6 +41,156 @@ import supybot.callbacks as callbacks
 from supybot.i18n import PluginInternationalization, internationalizeDocstring
 _ = PluginInternationalization('BadWords')
 
+def fold(s):
+    """Returns s in lowercase, without changing its length so positions in
+    the result are positions in s."""
+    t = s.lower()
+    if len(t) != len(s):
+        t = ''.join([c if len(c.lower()) != 1 else c.lower() for c in s])
+    return t
+
+def isWordCharacter(c):
+    return c.isalnum() or c == '_'
+
+class WordMatcher(object):
+    """Finds words in strings, regardless of case, with an Aho-Corasick
+    automaton: each string is read once, however many words there are.
+
+    Words are added to and removed from its trie directly; its failure links
+    are computed again on the next search that follows."""
+    def __init__(self, words=()):
+        self.clear()
+        self.update(words)
+
+    def clear(self):
+        self.words = set()
+        # Node 0 is the root of the trie.  self.goto[node] maps characters
+        # to children, and self.lengths[node] is the length of the word
+        # ending at node, or 0.
+        self.goto = [{}]
+        self.lengths = [0]
+        self.nodes = {}
+        self.fail = None
+        self.dictLinks = None
+        self.deadNodes = 0
+
+    def add(self, word):
+        word = fold(word)
+        if not word or word in self.words:
+            return
+        self.words.add(word)
+        node = 0
+        for c in word:
+            child = self.goto[node].get(c)
+            if child is None:
+                child = len(self.goto)
+                self.goto[node][c] = child
+                self.goto.append({})
+                self.lengths.append(0)
+            node = child
+        self.lengths[node] = len(word)
+        self.nodes[word] = node
+        self.fail = None
+
+    def remove(self, word):
+        word = fold(word)
+        if word not in self.words:
+            return
+        self.words.remove(word)
+        self.lengths[self.nodes.pop(word)] = 0
+        self.deadNodes += len(word)
+        self.fail = None
+
+    def update(self, words):
+        """Adds and removes words so that the matcher finds exactly these
+        words."""
+        words = set(map(fold, words))
+        for word in self.words - words:
+            self.remove(word)
+        for word in words - self.words:
+            self.add(word)
+
+    def _build(self):
+        if self.deadNodes > len(self.goto) // 2:
+            # Most of the trie is made of removed words; make it again.
+            words = self.words
+            self.clear()
+            for word in words:
+                self.add(word)
+        goto = self.goto
+        lengths = self.lengths
+        fail = [0] * len(goto)
+        dictLinks = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for (c, child) in goto[node].items():
+                f = fail[node]
+                while f and c not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(c, 0)
+                if f == child:
+                    f = 0
+                fail[child] = f
+                dictLinks[child] = f if lengths[f] else dictLinks[f]
+                queue.append(child)
+        (self.fail, self.dictLinks) = (fail, dictLinks)
+
+    def finditer(self, s, requireWordBoundaries=False):
+        """Returns the (start, end) positions of the words in s.  At each
+        position, the longest word is picked, and words do not overlap.  If
+        requireWordBoundaries is true, only words that are not part of
+        bigger words (as per the \\b regexp anchor) are found."""
+        if not self.words:
+            return []
+        if self.fail is None:
+            self._build()
+        (goto, lengths) = (self.goto, self.lengths)
+        (fail, dictLinks) = (self.fail, self.dictLinks)
+        def atBoundary(i):
+            return (i < len(s) and isWordCharacter(s[i])) != \
+                    (i > 0 and isWordCharacter(s[i-1]))
+        matches = []
+        node = 0
+        for (i, c) in enumerate(fold(s)):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            found = node if lengths[node] else dictLinks[node]
+            while found:
+                (start, end) = (i + 1 - lengths[found], i + 1)
+                if not requireWordBoundaries or \
+                        (atBoundary(start) and atBoundary(end)):
+                    matches.append((start, end))
+                found = dictLinks[found]
+        if len(matches) > 1:
+            matches.sort(key=lambda m: (m[0], -m[1]))
+            L = []
+            end = 0
+            for match in matches:
+                if match[0] >= end:
+                    L.append(match)
+                    end = match[1]
+            matches = L
+        return matches
+
+    def search(self, s, requireWordBoundaries=False):
+        """Returns whether s contains any of the words."""
+        return bool(self.finditer(s, requireWordBoundaries))
+
+    def sub(self, f, s, requireWordBoundaries=False):
+        """Replaces each word in s with the result of f called on it."""
+        L = []
+        last = 0
+        for (start, end) in self.finditer(s, requireWordBoundaries):
+            L.append(s[last:start])
+            L.append(f(s[start:end]))
+            last = end
+        if not L:
+            return s
+        L.append(s[last:])
+        return ''.join(L)
+
 class BadWords(callbacks.Privmsg):
     """Maintains a list of words that the bot is not allowed to say.
     Can also be used to kick people that say these words, if the bot
@@ -53,6 +203,7 @@ class BadWords(callbacks.Privmsg):
         self.filtering = True
         self.lastModified = 0
         self.words = conf.supybot.plugins.BadWords.words
+        self.matcher = WordMatcher()
 
     def callCommand(self, name, irc, msg, *args, **kwargs):
         if ircdb.checkCapability(msg.prefix, 'admin'):
@@ -60,12 +211,12 @@ class BadWords(callbacks.Privmsg):
         else:
             irc.errorNoCapability('admin')
 
-    def sub(self, m):
+    def sub(self, word):
         replaceMethod = self.registryValue('replaceMethod')
         if replaceMethod == 'simple':
             return self.registryValue('simpleReplacement')
         elif replaceMethod == 'nastyCharacters':
-            return self.registryValue('nastyChars')[:len(m.group(1))]
+            return self.registryValue('nastyChars')[:len(word)]
 
     def inFilter(self, irc, msg):
         self.filtering = True
@@ -73,10 +224,12 @@ class BadWords(callbacks.Privmsg):
         # messages don't get to doPrivmsg if the user is ignored.
         if msg.command == 'PRIVMSG' and self.words():
             channel = msg.args[0]
-            self.updateRegexp(channel)
+            self.updateMatcher()
             s = ircutils.stripFormatting(msg.args[1])
             if ircutils.isChannel(channel) and self.registryValue('kick', channel):
-                if self.regexp.search(s):
+                boundaries = self.registryValue('requireWordBoundaries',
+                                                channel)
+                if self.matcher.search(s, boundaries):
                     c = irc.state.channels[channel]
                     cap = ircdb.makeChannelCapability(channel, 'op')
                     if c.isHalfopPlus(irc.nick):
@@ -93,29 +246,24 @@ class BadWords(callbacks.Privmsg):
                                          msg.nick, channel)
         return msg
 
-    def updateRegexp(self, channel):
+    def updateMatcher(self):
         if self.lastModified < self.words.lastModified:
-            self.makeRegexp(self.words(), channel)
+            self.matcher.update(self.words())
             self.lastModified = time.time()
 
     def outFilter(self, irc, msg):
         if self.filtering and msg.command == 'PRIVMSG' and self.words():
             channel = msg.args[0]
-            self.updateRegexp(channel)
+            self.updateMatcher()
             s = msg.args[1]
             if self.registryValue('stripFormatting'):
                 s = ircutils.stripFormatting(s)
-            t = self.regexp.sub(self.sub, s)
+            boundaries = self.registryValue('requireWordBoundaries', channel)
+            t = self.matcher.sub(self.sub, s, boundaries)
             if t != s:
                 msg = ircmsgs.privmsg(msg.args[0], t, msg=msg)
         return msg
 
-    def makeRegexp(self, iterable, channel):
-        s = '(%s)' % '|'.join(map(re.escape, iterable))
-        if self.registryValue('requireWordBoundaries', channel):
-            s = r'\b%s\b' % s
-        self.regexp = re.compile(s, re.I)
-
     @internationalizeDocstring
     def list(self, irc, msg, args):
         """takes no arguments
@@ -70,5 +70,23 @@ class BadWordsTestCase(PluginTestCase):
         self.assertNotError('badwords add ass')
         self.assertResponse('badwords list', 'ass and shit')
 
+class BadWordsChannelTestCase(ChannelPluginTestCase):
+    plugins = ('BadWords', 'Utilities')
+    def tearDown(self):
+        conf.supybot.plugins.BadWords.words.setValue([])
+        super(BadWordsChannelTestCase, self).tearDown()
+
+    def testRequireWordBoundaries(self):
+        self.assertNotError('badwords add ass assassin')
+        self.assertResponse('echo classic ASS', 'cl!@#ic !@#')
+        self.assertResponse('echo assassins', '!@#&!@#&s')
+        with conf.supybot.plugins.BadWords.requireWordBoundaries \
+                .context(True):
+            self.assertResponse('echo classic ASS', 'classic !@#')
+            self.assertResponse('echo assassins', 'assassins')
+            self.assertResponse('echo assassin, ass_', '!@#&!@#&, ass_')
+        self.assertNotError('badwords remove assassin')
+        self.assertResponse('echo assassins', '!@#!@#ins')
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
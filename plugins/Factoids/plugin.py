@@ -50,6 +50,31 @@ import sqlite3
 import re
 from supybot.utils.seq import dameraulevenshtein
 
+# Keys are padded, so their first and last letters are in trigrams of
+# their own.
+TRIGRAM_PAD = '\x00\x00'
+
+def trigrams(s, pad=False):
+    s = s.lower()
+    if pad:
+        s = TRIGRAM_PAD + s + TRIGRAM_PAD
+    return set(s[i:i+3] for i in range(len(s)-2))
+
+def trigramCriterion(pattern):
+    """Returns an SQL criterion (and its arguments) selecting the keys
+    which have all the trigrams of the literal parts of the given LIKE
+    pattern, or (None, []) if the pattern has no such trigram."""
+    wanted = set()
+    for literal in re.split('[%_]', pattern):
+        wanted.update(trigrams(literal))
+    if not wanted:
+        return (None, [])
+    criterion = """keys.id IN (SELECT key_id FROM key_trigrams
+                                WHERE trigram IN (%s)
+                                GROUP BY key_id HAVING COUNT(*) = ?)""" % \
+                ', '.join('?' * len(wanted))
+    return (criterion, list(wanted) + [len(wanted)])
+
 def getFactoid(irc, msg, args, state):
     assert not state.channel
     callConverter('channel', irc, msg, args, state)
@@ -223,6 +248,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             db = sqlite3.connect(filename)
             if minisix.PY2:
                 db.text_factory = str
+            self._makeTrigramIndex(db)
             return db
         db = sqlite3.connect(filename)
         if minisix.PY2:
@@ -246,8 +272,37 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                           usage_count INTEGER
                           )""")
         db.commit()
+        self._makeTrigramIndex(db)
         return db
 
+    def _makeTrigramIndex(self, db):
+        """Creates the index of the trigrams of the keys, used to search
+        them, if the database does not have it yet."""
+        cursor = db.cursor()
+        cursor.execute("""SELECT name FROM sqlite_master
+                          WHERE type='table' AND name='key_trigrams'""")
+        if cursor.fetchall():
+            return
+        cursor.execute("""CREATE TABLE key_trigrams (
+                          trigram TEXT,
+                          key_id INTEGER,
+                          UNIQUE (trigram, key_id) ON CONFLICT IGNORE
+                          )""")
+        cursor.execute("""CREATE INDEX key_trigrams_key_id
+                          ON key_trigrams (key_id)""")
+        cursor.execute("""SELECT id, key FROM keys""")
+        for (keyid, key) in cursor.fetchall():
+            self._indexKey(cursor, keyid, key)
+        db.commit()
+
+    def _indexKey(self, cursor, keyid, key):
+        cursor.executemany("""INSERT INTO key_trigrams VALUES (?, ?)""",
+                           [(t, keyid) for t in trigrams(key, pad=True)])
+
+    def _unindexKey(self, cursor, keyid):
+        cursor.execute("""DELETE FROM key_trigrams WHERE key_id=?""",
+                       (keyid,))
+
     def getCommandHelp(self, command, simpleSyntax=None):
         method = self.getCommandMethod(command)
         if method.__func__.__name__ == 'learn':
@@ -290,6 +345,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         
         if len(keyid) == 0:
             cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""", (key,))
+            self._indexKey(cursor, cursor.lastrowid, key)
             db.commit()
         if len(factid) == 0:
             if ircdb.users.hasUser(msg.prefix):
@@ -340,6 +396,8 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
         Assume first letter is correct, to reduce processing time.        
         First, try a simple wildcard search.
         If that fails, use the Damerau-Levenshtein edit-distance metric.
+
+        Both searches only look at the keys selected by the trigram index.
         """
         # if you made a typo in a two-character key, boo on you.
         if len(key) < 3:
@@ -347,16 +405,38 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             
         db = self.getDb(channel)
         cursor = db.cursor()
-        cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", ('%' + key + '%',))
+        pattern = '%' + key + '%'
+        (criterion, params) = trigramCriterion(pattern)
+        if criterion is None:
+            criterion = '1'
+        cursor.execute("""SELECT key FROM keys WHERE %s AND key LIKE ?""" %
+                       criterion, params + [pattern])
         wildcardkeys = cursor.fetchall()
         if len(wildcardkeys) > 0:
             return [line[0] for line in wildcardkeys]
         
-        cursor.execute("""SELECT key FROM keys WHERE key LIKE ?""", (key[0] + '%',))
-        flkeys = cursor.fetchall()
+        # Each edit changes at most 4 trigrams (a transposition does), so a
+        # key at distance 3 or less shares all of the padded trigrams of
+        # the given key but 12; and it shares the first one, as they have
+        # the same first letter.
+        keyTrigrams = trigrams(key, pad=True)
+        first = (TRIGRAM_PAD + key)[:3].lower()
+        minimum = len(keyTrigrams) - 12
+        if minimum > 1:
+            cursor.execute("""SELECT key FROM keys WHERE id IN
+                              (SELECT key_id FROM key_trigrams
+                               WHERE trigram IN (%s) GROUP BY key_id
+                               HAVING COUNT(*) >= ? AND MAX(trigram = ?))""" %
+                           ', '.join('?' * len(keyTrigrams)),
+                           list(keyTrigrams) + [minimum, first])
+        else:
+            cursor.execute("""SELECT key FROM keys WHERE id IN
+                              (SELECT key_id FROM key_trigrams
+                               WHERE trigram = ?)""", (first,))
+        flkeys = [line[0] for line in cursor.fetchall()
+                  if abs(len(line[0]) - len(key)) <= 3]
         if len(flkeys) == 0:
             return []
-        flkeys = [line[0] for line in flkeys]
         dl_metrics = [dameraulevenshtein(key, sourcekey) for sourcekey in flkeys]
         dict_metrics = dict(list(zip(flkeys, dl_metrics)))
         if min(dl_metrics) <= 2:
@@ -496,6 +576,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             if len(newkey_info) == 0:
                 cursor.execute("""INSERT INTO keys VALUES (NULL, ?)""",
                             (newkey,))
+                self._indexKey(cursor, cursor.lastrowid, newkey)
                 db.commit()
                 cursor.execute("""SELECT id FROM keys WHERE key=?""", (newkey,))
                 newkey_info = cursor.fetchall()
@@ -632,6 +713,7 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
             remaining_key_relations = cursor.fetchall()
             if len(remaining_key_relations) == 0:
                 cursor.execute("""DELETE FROM keys where id=?""", (keyid,))
+                self._unindexKey(cursor, keyid)
 
             cursor.execute("""SELECT id FROM relations
                             WHERE relations.fact_id=?""", (factid,))
@@ -823,8 +905,14 @@ class Factoids(callbacks.Plugin, plugins.ChannelDBHandler):
                 db.create_function(predicateName, 1, p)
                 predicateName += 'p'
         for glob in globs:
+            pattern = self._sqlTrans(glob)
+            if target == 'keys.key':
+                (criterion, params) = trigramCriterion(pattern)
+                if criterion is not None:
+                    criteria.append(criterion)
+                    formats.extend(params)
             criteria.append('TARGET LIKE ?')
-            formats.append(self._sqlTrans(glob))
+            formats.append(pattern)
         cursor = db.cursor()
         sql = """SELECT keys.key FROM %s WHERE %s""" % \
               (', '.join(tables), ' AND '.join(criteria))
@@ -171,6 +171,25 @@ class FactoidsTestCase(ChannelPluginTestCase):
         self.assertRegexp('moe', 'mooz.*moped')
         self.assertError('nosuchthing')
     
+    def testTrigramIndex(self):
+        self.assertNotError('learn supercalifragilistic is a word')
+        self.assertNotError('learn supercollider is a machine')
+        self.assertRegexp('whatis supercalifargilistic',
+                          'supercalifragilistic')
+        self.assertNotRegexp('whatis supercalifargilistic', 'supercollider')
+        self.assertRegexp('whatis calif', 'supercalifragilistic')
+        self.assertRegexp('factoids search *COLL*', 'machine')
+        cb = self.irc.getCallback('Factoids')
+        db = cb.getDb(self.channel)
+        db.execute('DROP TABLE key_trigrams')
+        cb._makeTrigramIndex(db)
+        self.assertRegexp('whatis supercolider', 'supercollider')
+        self.assertNotError('forget supercalifragilistic')
+        self.assertNotError('forget supercollider')
+        self.assertError('whatis supercalifragilistc')
+        self.assertEqual(
+            db.execute('SELECT COUNT(*) FROM key_trigrams').fetchone()[0], 0)
+
     def testWhatis(self):
         self.assertNotError('learn foo is bar')
         self.assertRegexp('whatis foo', 'bar')
@@ -42,6 +42,8 @@ import re
 import os
 import sys
 import time
+import sre_parse
+import sre_constants
 
 try:
     from supybot.i18n import PluginInternationalization
@@ -70,6 +72,57 @@ import supybot.world as world
 import supybot.log as log
 
 
+def requiredLiteral(regexp):
+    """Returns the longest literal string any match of the compiled
+    <regexp> has to contain, or '' if there is no such string (or if it
+    cannot be found cheaply)."""
+    if regexp.flags & re.IGNORECASE:
+        return ''
+    try:
+        parsed = sre_parse.parse(regexp.pattern, regexp.flags)
+        best = current = ''
+        for (opcode, argument) in parsed:
+            if opcode == sre_constants.LITERAL:
+                current += chr(argument)
+                if len(current) > len(best):
+                    best = current
+            else:
+                current = ''
+    except (ValueError, sre_constants.error):
+        return ''
+    return best
+
+class TriggerIndex(object):
+    """Compiled, in-memory copy of the triggers table of a database.
+
+    Every regexp is compiled once, and paired with a literal string that
+    must appear in a message for the regexp to have a chance to match, so
+    most triggers are skipped with a substring test instead of running the
+    regexp engine."""
+    def __init__(self, rows):
+        self.triggers = []
+        for (regexp, action) in rows:
+            try:
+                compiled = re.compile(regexp)
+            except Exception as e:
+                log.warning('MessageParser: ignoring invalid regexp %r: %s',
+                            regexp, e)
+                continue
+            self.triggers.append((regexp, compiled, requiredLiteral(compiled),
+                                  action))
+
+    def __len__(self):
+        return len(self.triggers)
+
+    def candidates(self, text):
+        """Yields the (regexp, compiled regexp, action) triples of the
+        triggers that may match <text>, in database order."""
+        for (regexp, compiled, literal, action) in self.triggers:
+            if literal and literal not in text:
+                continue
+            yield (regexp, compiled, action)
+
+
 class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     """This plugin can set regexp triggers to activate the bot.
     Use 'add' command to add regexp trigger, 'remove' to remove."""
@@ -77,6 +130,8 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
     def __init__(self, irc):
         callbacks.Plugin.__init__(self, irc)
         plugins.ChannelDBHandler.__init__(self)
+        self._triggerIndexes = {}
+        self._triggerIndexesLock = threading.Lock()
 
     def makeDb(self, filename):
         """Create the database and connect to it."""
@@ -115,6 +170,25 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
         db.isolation_level = None
         return db
 
+    def _getTriggerIndex(self, channel):
+        """Returns the TriggerIndex of the database of <channel>, building
+        it from the database if it is not cached yet."""
+        filename = self.makeFilename(channel)
+        with self._triggerIndexesLock:
+            index = self._triggerIndexes.get(filename)
+            if index is None:
+                cursor = self.getDb(channel).cursor()
+                cursor.execute("SELECT regexp, action FROM triggers")
+                index = TriggerIndex(cursor.fetchall())
+                self._triggerIndexes[filename] = index
+        return index
+
+    def _invalidateTriggerIndex(self, channel):
+        """Must be called whenever the regexps or actions of the database
+        of <channel> change."""
+        with self._triggerIndexesLock:
+            self._triggerIndexes.pop(self.makeFilename(channel), None)
+
     def _updateRank(self, channel, regexp):
         subfolder = None if channel == 'global' else channel
         if self.registryValue('keepRankInfo', subfolder):
@@ -160,17 +234,16 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
             actions = []
             results = []
             for channel in set(map(plugins.getChannel, (channel, 'global'))):
-                db = self.getDb(channel)
-                cursor = db.cursor()
-                cursor.execute("SELECT regexp, action FROM triggers")
+                index = self._getTriggerIndex(channel)
                 # Fetch results and prepend channel name or 'global'. This
                 # prevents duplicating the following lines.
-                results.extend([(channel,)+x for x in cursor.fetchall()])
+                results.extend([(channel,)+x
+                                for x in index.candidates(msg.args[1])])
             if len(results) == 0:
                 return
             max_triggers = self.registryValue('maxTriggers', channel)
-            for (channel, regexp, action) in results:
-                for match in re.finditer(regexp, msg.args[1]):
+            for (channel, regexp, compiled, action) in results:
+                for match in compiled.finditer(msg.args[1]):
                     if match is not None:
                         thisaction = action
                         self._updateRank(channel, regexp)
@@ -229,6 +302,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
                               (NULL, ?, ?, ?, ?, ?, ?)""",
                             (regexp, name, int(time.time()), usage_count, action, locked,))
             db.commit()
+            self._invalidateTriggerIndex(channel)
             irc.replySuccess()
         else:
             irc.error(_('That trigger is locked.'))
@@ -268,6 +342,7 @@ class MessageParser(callbacks.Plugin, plugins.ChannelDBHandler):
 
         cursor.execute("""DELETE FROM triggers WHERE id=?""", (id,))
         db.commit()
+        self._invalidateTriggerIndex(channel)
         irc.replySuccess()
     remove = wrap(remove, ['channelOrGlobal',
                             getopts({'id': '',}),
@@ -30,8 +30,37 @@
 
 from supybot.test import *
 
+import re
 import sqlite3
 
+from . import plugin as MessageParser
+
+
+class TriggerIndexTestCase(SupyTestCase):
+    def testRequiredLiteral(self):
+        f = lambda s: MessageParser.requiredLiteral(re.compile(s))
+        self.assertEqual(f('stuff'), 'stuff')
+        self.assertEqual(f('this (.+) a(.*)'), 'this ')
+        self.assertEqual(f('^foo.*barbaz$'), 'barbaz')
+        self.assertEqual(f('a?b'), 'b')
+        self.assertEqual(f('foo|bar'), '')
+        self.assertEqual(f('(?i)stuff'), '')
+        self.assertEqual(f('.*'), '')
+
+    def testCandidates(self):
+        index = MessageParser.TriggerIndex([('stuff', 'echo 1'),
+                                            ('(?i)STUFF', 'echo 2'),
+                                            ('foo|bar', 'echo 3'),
+                                            ('aoeu', 'echo 4')])
+        self.assertEqual(len(index), 4)
+        self.assertEqual([action for (_, _, action)
+                          in index.candidates('some stuff')],
+                         ['echo 1', 'echo 2', 'echo 3'])
+        self.assertEqual([action for (_, _, action)
+                          in index.candidates('aoeu')],
+                         ['echo 2', 'echo 3', 'echo 4'])
+
+
 
 class MessageParserTestCase(ChannelPluginTestCase):
     plugins = ('MessageParser','Utilities','User') 
@@ -107,6 +136,19 @@ class MessageParserTestCase(ChannelPluginTestCase):
         m = self.getMsg(' ')
         self.failUnless(str(m).startswith('PRIVMSG #test :i saw some stuff'))
     
+    def testTriggerIndexInvalidation(self):
+        self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
+        self.feedMsg('this message has some stuff in it')
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG #test :i saw some stuff'))
+        self.assertNotError('messageparser add "stuff" "echo i saw no stuff"')
+        self.feedMsg('this message has some stuff in it')
+        m = self.getMsg(' ')
+        self.failUnless(str(m).startswith('PRIVMSG #test :i saw no stuff'))
+        self.assertNotError('messageparser remove "stuff"')
+        self.feedMsg('this message has some stuff in it')
+        self.assertNoResponse(' ', 1)
+
     def testMaxTriggers(self):
         self.assertNotError('messageparser add "stuff" "echo i saw some stuff"')
         self.assertNotError('messageparser add "sbd" "echo i saw somebody"')
@@ -63,6 +63,10 @@ conf.registerGlobalValue(Misc, 'timestampFormat',
     for the time module to see what formats are accepted. If you set this
     variable to the empty string, the timestamp will not be shown.""")))
 conf.registerGroup(Misc, 'last')
+conf.registerGlobalValue(Misc.last, 'regexpTimeout',
+    registry.PositiveFloat(1.0, _("""Determines how many seconds the
+    regular expressions given to the last command may take to search the
+    whole history.""")))
 conf.registerGroup(Misc.last, 'nested')
 conf.registerChannelValue(Misc.last.nested,
     'includeTimestamp', registry.Boolean(False, _("""Determines whether or not
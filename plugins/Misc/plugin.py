@@ -74,9 +74,6 @@ def getPluginsInDirectory(directory):
                 plugins.append(filename)
     return plugins
 
-class RegexpTimeout(Exception):
-    pass
-
 class Misc(callbacks.Plugin):
     """Miscellaneous commands to access Supybot core. This is a core
     Supybot plugin that should not be removed!"""
@@ -420,6 +417,7 @@ class Misc(callbacks.Plugin):
         given in is searched.
         """
         predicates = {}
+        regexps = []
         nolimit = False
         skipfirst = True
         if ircutils.isChannel(msg.args[0]):
@@ -451,22 +449,7 @@ class Misc(callbacks.Plugin):
                     return arg.lower() not in m.args[1].lower()
                 predicates.setdefault('without', []).append(f)
             elif option == 'regexp':
-                def f(m, arg=arg):
-                    def f1(s, arg):
-                        """Since we can't enqueue match objects into the multiprocessing queue,
-                        we'll just wrap the function to return bools."""
-                        if process(arg.search, s, timeout=0.1) is not None:
-                            return True
-                        else:
-                            return False
-                    if ircmsgs.isAction(m):
-                        m1 = ircmsgs.unAction(m)
-                    else:
-                        m1 = m.args[1]
-                    return regexp_wrapper(m1, reobj=arg, timeout=0.1,
-                                          plugin_name=self.name(),
-                                          fcn_name='last')
-                predicates.setdefault('regexp', []).append(f)
+                regexps.append(arg)
             elif option == 'nolimit':
                 nolimit = True
         iterable = filter(self._validLastMsg, reversed(irc.state.history))
@@ -488,7 +471,12 @@ class Misc(callbacks.Plugin):
                     or (m.args[0] in irc.state.channels \
                         and 's' not in irc.state.channels[m.args[0]].modes)
         predicates.append(notSecretMsg)
-        resp = []
+        def matches(m):
+            for predicate in predicates:
+                if not predicate(m):
+                    return False
+            return True
+        iterable = filter(matches, iterable)
         if irc.nested and not \
           self.registryValue('last.nested.includeTimestamp'):
             tsf = None
@@ -498,29 +486,35 @@ class Misc(callbacks.Plugin):
             showNick = False
         else:
             showNick = True
-        for m in iterable:
-            for predicate in predicates:
-                try:
-                    if not predicate(m):
-                        break
-                except RegexpTimeout:
-                    irc.error(_('The regular expression timed out.'))
-                    return
+        def callback(msgs):
+            resp = [ircmsgs.prettyPrint(m, timestampFormat=tsf,
+                                        showNick=showNick)
+                    for m in msgs]
+            if not resp:
+                irc.error(_('I couldn\'t find a message matching that '
+                            'criteria in my history of %s messages.')
+                          % len(irc.state.history))
+            elif nolimit:
+                irc.reply(format('%L', resp))
             else:
-                if nolimit:
-                    resp.append(ircmsgs.prettyPrint(m,
-                                                    timestampFormat=tsf,
-                                                    showNick=showNick))
-                else:
-                    irc.reply(ircmsgs.prettyPrint(m,
-                                                  timestampFormat=tsf,
-                                                  showNick=showNick))
-                    return
-        if not resp:
-            irc.error(_('I couldn\'t find a message matching that criteria in '
-                      'my history of %s messages.') % len(irc.state.history))
-        else:
-            irc.reply(format('%L', resp))
+                irc.reply(resp[0])
+        def errback(e):
+            if isinstance(e, commands.ProcessTimeoutError):
+                irc.error(_('The regular expression timed out.'))
+            else:
+                irc.error(utils.exnToString(e))
+        # Regexps are searched last, in a subprocess, as they may take too
+        # long.
+        def text(m):
+            if ircmsgs.isAction(m):
+                return ircmsgs.unAction(m)
+            else:
+                return m.args[1]
+        regexp_filter_async(iterable, regexps,
+                timeout=self.registryValue('last.regexpTimeout'),
+                plugin_name=self.name(), fcn_name='last', key=text,
+                callback=callback, errback=errback,
+                limit=None if nolimit else 1)
     last = wrap(last, [getopts({'nolimit': '',
                                 'on': 'something',
                                 'with': 'something',
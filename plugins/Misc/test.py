@@ -183,6 +183,29 @@ class MiscTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.plugins.Misc.timestampFormat.setValue(orig)
 
+    def testLastRegexp(self):
+        orig = conf.supybot.plugins.Misc.timestampFormat()
+        timeout = conf.supybot.plugins.Misc.last.regexpTimeout()
+        try:
+            conf.supybot.plugins.Misc.timestampFormat.setValue('')
+            for i in range(40):
+                self.feedMsg('foo %s bar' % i)
+            self.assertResponse('last --regexp m/bar$/ --regexp m/3/',
+                                '<%s> foo 39 bar' % self.nick)
+            self.assertResponse(r'last --nolimit --regexp "m/^foo 1\d /"',
+                    ', '.join('<%s> foo %s bar' % (self.nick, i)
+                              for i in range(19, 10, -1)) +
+                    ', and <%s> foo 10 bar' % self.nick)
+            self.assertError('last --regexp m/qux/')
+            if not world.disableMultiprocessing:
+                # Without subprocesses, the search can't be interrupted.
+                self.feedMsg('a'*30 + '!')
+                conf.supybot.plugins.Misc.last.regexpTimeout.setValue(0.5)
+                self.assertRegexp('last --regexp m/(a+)+b/', 'timed out')
+        finally:
+            conf.supybot.plugins.Misc.timestampFormat.setValue(orig)
+            conf.supybot.plugins.Misc.last.regexpTimeout.setValue(timeout)
+
     def testNestedLastTimestampConfig(self):
         tsConfig = conf.supybot.plugins.Misc.last.nested.includeTimestamp
         orig = tsConfig()
@@ -289,6 +289,7 @@ class Note(callbacks.Plugin):
         the notes.  If --sent is specified, only search sent notes.
         """
         criteria = []
+        regexps = []
         def to(note):
             return note.to == user.id
         def frm(note):
@@ -296,10 +297,7 @@ class Note(callbacks.Plugin):
         own = to
         for (option, arg) in optlist:
             if option == 'regexp':
-                criteria.append(lambda s:
-                                regexp_wrapper(s, reobj=arg, timeout=0.1,
-                                               plugin_name=self.name(),
-                                               fcn_name='search'))
+                regexps.append(arg)
             elif option == 'sent':
                 own = frm
         if glob:
@@ -310,14 +308,23 @@ class Note(callbacks.Plugin):
                 if not p(note.text):
                     return False
             return True
-        notes = list(self.db.select(lambda n: match(n) and own(n)))
-        if not notes:
-            irc.reply('No matching notes were found.')
-        else:
-            utils.sortBy(operator.attrgetter('id'), notes)
-            ids = [self._formatNoteId(msg, note) for note in notes]
-            ids = self._condense(ids)
-            irc.reply(format('%L', ids))
+        def callback(notes):
+            if not notes:
+                irc.reply('No matching notes were found.')
+            else:
+                utils.sortBy(operator.attrgetter('id'), notes)
+                ids = [self._formatNoteId(msg, note) for note in notes]
+                ids = self._condense(ids)
+                irc.reply(format('%L', ids))
+        def errback(e):
+            if isinstance(e, commands.ProcessTimeoutError):
+                irc.error(_('The regular expression timed out.'))
+            else:
+                irc.error(utils.exnToString(e))
+        regexp_filter_async(self.db.select(lambda n: match(n) and own(n)),
+                            regexps, timeout=0.1, plugin_name=self.name(),
+                            fcn_name='search', callback=callback,
+                            errback=errback, key=lambda note: note.text)
     search = wrap(search,
                   ['user', getopts({'regexp': ('regexpMatcher', True),
                                     'sent': ''}),
@@ -43,6 +43,7 @@ import feedparser
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
+import supybot.schedule as schedule
 from supybot.commands import *
 import supybot.utils.minisix as minisix
 import supybot.ircmsgs as ircmsgs
@@ -69,24 +70,12 @@ addConverter('feedName', get_feedName)
 announced_headlines_filename = \
         conf.supybot.directories.data.dirize('RSS_announced.flat')
 
-def only_one_at_once(f):
-    lock = [False]
-    def newf(*args, **kwargs):
-        if lock[0]:
-            return
-        lock[0] = True
-        try:
-            f(*args, **kwargs)
-        finally:
-            lock[0] = False
-    return newf
-
 class InvalidFeedUrl(ValueError):
     pass
 
 class Feed:
-    __slots__ = ('url', 'name', 'data', 'last_update', 'entries',
-            'etag', 'modified', 'initial',
+    __slots__ = ('url', 'name', 'data', 'last_update', 'next_check',
+            'entries', 'etag', 'modified', 'initial',
             'lock', 'announced_entries')
     def __init__(self, name, url, initial,
             plugin_is_loading=False, announced=None):
@@ -102,6 +91,9 @@ class Feed:
         # We don't want to fetch feeds right after the plugin is
         # loaded (the bot could be starting, and thus already busy)
         self.last_update = time.time() if plugin_is_loading else 0
+        # Time before which the scheduler does not need to check whether
+        # this feed is announced (and thus should be fetched) again.
+        self.next_check = 0
         self.entries = []
         self.etag = None
         self.modified = None
@@ -169,6 +161,7 @@ class RSS(callbacks.Plugin):
     the "add" command to add feeds to this plugin, and use the "announce"
     command to determine what feeds should be announced in a given channel."""
     threaded = True
+    dynamicCommands = True
     def __init__(self, irc):
         self.__parent = super(RSS, self)
         self.__parent.__init__(irc)
@@ -195,12 +188,28 @@ class RSS(callbacks.Plugin):
                 self.log.error('%s is not a valid feed, removing.', name)
                 continue
         world.flushers.append(self._flush)
+        self._fetch_queue = minisix.queue.Queue()
+        self._fetch_threads = []
+        self._fetch_threads_lock = threading.Lock()
+        schedule.addPeriodicEvent(self.update_feeds, 1, now=False,
+                                  name=self._update_event_name())
 
     def die(self):
+        try:
+            schedule.removePeriodicEvent(self._update_event_name())
+        except KeyError:
+            pass
+        with self._fetch_threads_lock:
+            for t in self._fetch_threads:
+                self._fetch_queue.put(None)
+            self._fetch_threads = []
         self._flush()
         world.flushers.remove(self._flush)
         self.__parent.die()
 
+    def _update_event_name(self):
+        return 'RSS feeds fetching (%s)' % id(self)
+
     def _flush(self):
         l = [(f.name, f.announced_entries) for f in self.feeds.values()]
         with utils.file.AtomicFile(announced_headlines_filename, 'w',
@@ -242,12 +251,17 @@ class RSS(callbacks.Plugin):
     def register_feed(self, name, url, initial,
             plugin_is_loading, announced=None):
         self.feed_names[name] = url
-        self.feeds[url] = Feed(name, url, initial,
-                plugin_is_loading, announced)
+        feed = Feed(name, url, initial, plugin_is_loading, announced)
+        self.feeds[url] = feed
+        # Feeds can be called by their name and by their URL.
+        callbacks.commandIndex.add(self, feed.name)
+        callbacks.commandIndex.add(self, feed.url)
 
     def remove_feed(self, feed):
         del self.feed_names[feed.name]
         del self.feeds[feed.url]
+        callbacks.commandIndex.remove(self, feed.name)
+        callbacks.commandIndex.remove(self, feed.url)
         conf.supybot.plugins.RSS.feeds().remove(feed.name)
         conf.supybot.plugins.RSS.feeds.unregister(feed.name)
 
@@ -269,10 +283,6 @@ class RSS(callbacks.Plugin):
         except AttributeError:
             return self.get_feed(command[0]).get_command(self)
 
-    def __call__(self, irc, msg):
-        self.__parent.__call__(irc, msg)
-        threading.Thread(target=self.update_feeds).start()
-
 
     ##################
     # Status accessors
@@ -280,14 +290,17 @@ class RSS(callbacks.Plugin):
     def get_feed(self, name):
         return self.feeds.get(self.feed_names.get(name, name), None)
 
-    def is_expired(self, feed):
-        assert feed
+    def get_wait_period(self, feed):
         period = self.registryValue('waitPeriod')
         if feed.name != feed.url: # Named feed
             specific_period = self.registryValue('feeds.%s.waitPeriod' % feed.name)
             if specific_period:
                 period = specific_period
-        event_horizon = time.time() - period
+        return period
+
+    def is_expired(self, feed):
+        assert feed
+        event_horizon = time.time() - self.get_wait_period(feed)
         return feed.last_update < event_horizon
 
     ###############
@@ -303,42 +316,76 @@ class RSS(callbacks.Plugin):
         with feed.lock:
             d = feedparser.parse(feed.url, etag=feed.etag,
                     modified=feed.modified, handlers=handlers)
-            if 'status' not in d or d.status != 304: # Not modified
+            feed.last_update = time.time()
+            not_modified = d.get('status') == 304
+            if not not_modified:
                 if 'etag' in d:
                     feed.etag = d.etag
                 if 'modified' in d:
                     feed.modified = d.modified
                 feed.data = d.feed
                 feed.entries = d.entries
-                feed.last_update = time.time()
             (initial, feed.initial) = (feed.initial, False)
-        self.announce_feed(feed, initial)
+        if not not_modified:
+            self.announce_feed(feed, initial)
+
+    def _fetch_worker(self):
+        while True:
+            feed = self._fetch_queue.get()
+            if feed is None:
+                return
+            try:
+                self.update_feed(feed)
+            except Exception:
+                self.log.exception('Error while fetching feed %s:', feed.url)
 
     def update_feed_in_thread(self, feed):
+        """Queues the feed to be fetched by one of the fetching threads,
+        starting a new one if they are all busy and there are less than
+        supybot.plugins.RSS.fetchThreads of them."""
         feed.last_update = time.time()
-        t = world.SupyThread(target=self.update_feed,
-                             name=format('Fetching feed %u', feed.url),
-                             args=(feed,))
-        t.setDaemon(True)
-        t.start()
+        with self._fetch_threads_lock:
+            if self._fetch_queue.qsize() >= len(self._fetch_threads) and \
+                    len(self._fetch_threads) < self.registryValue('fetchThreads'):
+                t = world.SupyThread(target=self._fetch_worker,
+                        name='Thread #%s (for fetching RSS feeds)' %
+                        world.threadsSpawned)
+                t.setDaemon(True)
+                self._fetch_threads.append(t)
+                t.start()
+        self._fetch_queue.put(feed)
 
     def update_feed_if_needed(self, feed):
         if self.is_expired(feed):
             self.update_feed(feed)
 
-    @only_one_at_once
     def update_feeds(self):
+        """Called every second by the scheduler; queues the announced feeds
+        whose wait period has expired."""
+        now = time.time()
+        due_feeds = [feed for feed in list(self.feeds.values())
+                     if feed.next_check <= now and self.is_expired(feed)]
+        if not due_feeds:
+            return
         announced_feeds = set()
         for irc in world.ircs:
             for channel in irc.state.channels:
                 announced_feeds |= self.registryValue('announce', channel)
+        announced = set()
         for name in announced_feeds:
             feed = self.get_feed(name)
-            if not feed:
+            if feed:
+                announced.add(feed)
+            else:
                 self.log.warning('Feed %s is announced but does not exist.',
                         name)
-                continue
-            self.update_feed_if_needed(feed)
+        for feed in due_feeds:
+            if feed in announced:
+                self.update_feed_in_thread(feed)
+            else:
+                # Don't compute the set of announced feeds every second
+                # because of a feed nobody wants announced.
+                feed.next_check = now + self.get_wait_period(feed)
 
     def get_new_entries(self, feed):
         # http://validator.w3.org/feed/docs/rss2.html#hrelementsOfLtitemgt
@@ -503,6 +550,7 @@ class RSS(callbacks.Plugin):
                     plugin.register_feed_config(name, name)
                     plugin.register_feed(name, name, True, False)
                     feed = plugin.get_feed(name)
+                feed.next_check = 0
                 plugin.announce_feed(feed, True)
         add = wrap(add, [('checkChannelCapability', 'op'),
                          many(first('url', 'feedName'))])
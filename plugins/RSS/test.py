@@ -134,6 +134,46 @@ class RSSTestCase(ChannelPluginTestCase):
             self._feedMsg('rss remove xkcd')
             feedparser._open_resource = old_open
 
+    def testAnnounceWithoutMessages(self):
+        old_open = feedparser._open_resource
+        feedparser._open_resource = constant(xkcd_old)
+        try:
+            self.assertNotError('rss add xkcd http://xkcd.com/rss.xml')
+            self.assertNotError('rss announce add xkcd')
+            self.assertNotError(' ')
+            with conf.supybot.plugins.RSS.waitPeriod.context(1):
+                feedparser._open_resource = constant(xkcd_new)
+                # Feeds are fetched by the scheduler, not when the bot
+                # receives a message.
+                m = None
+                timeout = time.time() + 10
+                while m is None and time.time() < timeout:
+                    time.sleep(0.1)
+                    drivers.run()
+                    m = self.irc.takeMsg()
+                self.assertTrue(m is not None)
+                self.assertIn('Telescopes', m.args[1])
+                self.assertRegexp(' ', 'Chaos')
+        finally:
+            self._feedMsg('rss announce remove xkcd')
+            self._feedMsg('rss remove xkcd')
+            feedparser._open_resource = old_open
+
+    def testUpdateFeedsAnnouncedByUrl(self):
+        self.assertNotError('rss add xkcd http://xkcd.com/rss.xml')
+        cb = self.irc.getCallback('RSS')
+        announce = conf.supybot.plugins.RSS.announce.get(self.channel)
+        updated = []
+        cb.update_feed_in_thread = updated.append
+        try:
+            announce.setValue(set(['http://xkcd.com/rss.xml']))
+            cb.update_feeds()
+            self.assertEqual(updated, [cb.get_feed('xkcd')])
+        finally:
+            del cb.update_feed_in_thread
+            announce.setValue(set())
+            self._feedMsg('rss remove xkcd')
+
     def testAnnounceAnonymous(self):
         old_open = feedparser._open_resource
         feedparser._open_resource = constant(xkcd_old)
@@ -38,6 +38,8 @@ import subprocess
 import supybot.conf as conf
 import supybot.utils as utils
 import supybot.world as world
+import supybot.drivers as drivers
+import supybot.schedule as schedule
 from supybot.commands import *
 import supybot.callbacks as callbacks
 from supybot.i18n import PluginInternationalization, internationalizeDocstring
@@ -97,6 +99,13 @@ class Status(callbacks.Plugin):
         s = format(_('I have spawned %n; %n %b still currently active: %L.'),
                    (world.threadsSpawned, 'thread'),
                    (len(threads), 'thread'), len(threads), threads)
+        metrics = callbacks.commandPool.metrics()
+        s += format(_('  The command pool has %n, running %n; %n %b '
+                      'queued (at most %i so far).'),
+                    (metrics['workers'], 'thread'),
+                    (metrics['running'], 'command'),
+                    (metrics['queued'], 'command'), metrics['queued'],
+                    metrics['maxQueued'])
         irc.reply(s)
     threads = wrap(threads)
 
@@ -115,6 +124,26 @@ class Status(callbacks.Plugin):
         irc.reply(s)
     processes = wrap(processes)
 
+    @internationalizeDocstring
+    def events(self, irc, msg, args):
+        """takes no arguments
+
+        Returns the number of scheduled events, and how late the events that
+        already ran were.
+        """
+        stats = schedule.schedule.stats
+        if stats['ran']:
+            averageLag = stats['totalLag'] / stats['ran']
+        else:
+            averageLag = 0
+        irc.reply(format(_('I have %n scheduled.  I ran %n, which were %s '
+                           'seconds late on average, and at most %s '
+                           'seconds late.'),
+                         (len(schedule.schedule.events), 'event'),
+                         (stats['ran'], 'event'),
+                         '%.3f' % averageLag, '%.3f' % stats['maxLag']))
+    events = wrap(events)
+
     def net(self, irc, msg, args):
         """takes no arguments
 
@@ -125,13 +154,82 @@ class Status(callbacks.Plugin):
             timeElapsed = utils.timeElapsed(elapsed)
         except KeyError:
             timeElapsed = _('an indeterminate amount of time')
-        irc.reply(format(_('I have received %s messages for a total of %S.  '
+        s = format(_('I have received %s messages for a total of %S.  '
                   'I have sent %s messages for a total of %S.  '
                   'I have been connected to %s for %s.'),
                   self.recvdMsgs, self.recvdBytes,
-                  self.sentMsgs, self.sentBytes, irc.server, timeElapsed))
+                  self.sentMsgs, self.sentBytes, irc.server, timeElapsed)
+        driver = irc.getRealIrc().driver
+        inbuffer = getattr(driver, 'inbuffer', None)
+        if isinstance(inbuffer, drivers.LineBuffer):
+            s += format(_('  Over the last minute, I received %s bytes and '
+                          '%s lines per second.'),
+                        '%.1f' % inbuffer.bytes.rate(),
+                        '%.1f' % inbuffer.lines.rate())
+        outbuffer = getattr(driver, 'outbuffer', None)
+        if isinstance(outbuffer, drivers.SendBuffer):
+            s += format(_('  Over the last minute, I queued %s bytes and '
+                          'sent %s bytes per second; %n waiting to be '
+                          'sent.'),
+                        '%.1f' % outbuffer.queued.rate(),
+                        '%.1f' % outbuffer.sent.rate(),
+                        (len(outbuffer), 'byte'))
+        irc.reply(s)
     net = wrap(net)
 
+    @internationalizeDocstring
+    def http(self, irc, msg, args):
+        """takes no arguments
+
+        Returns statistics about the HTTP requests of the bot: how many were
+        answered from its cache, how many connections were reused, and how
+        long servers took to respond.
+        """
+        stats = utils.web.stats
+        if stats['requests']:
+            hitRate = 100. * (stats['cacheHits'] + stats['revalidated']) / \
+                    stats['requests']
+        else:
+            hitRate = 0
+        if stats['serverResponses']:
+            averageLatency = stats['totalLatency'] / stats['serverResponses']
+        else:
+            averageLatency = 0
+        irc.reply(format(_('I made %n; %i were answered from my cache and %i '
+                           'revalidated by the server, a hit rate of %s%%.  '
+                           'I opened %n and reused them %n.  Servers took '
+                           '%s seconds to respond on average, and at most %s '
+                           'seconds.'),
+                         (stats['requests'], 'HTTP request'),
+                         stats['cacheHits'], stats['revalidated'],
+                         '%.1f' % hitRate,
+                         (stats['connections'], 'connection'),
+                         (stats['reusedConnections'], 'time'),
+                         '%.3f' % averageLatency, '%.3f' % stats['maxLatency']))
+    http = wrap(http)
+
+    @internationalizeDocstring
+    def caches(self, irc, msg, args):
+        """takes no arguments
+
+        Returns statistics about the caches of the bot: how full they are,
+        how often what was looked up was in them, and how many items were
+        dropped to make room for others.
+        """
+        L = []
+        for (name, cache) in sorted(world.caches.items()):
+            lookups = cache.hits + cache.misses
+            if lookups:
+                hitRate = 100. * cache.hits / lookups
+            else:
+                hitRate = 0
+            L.append(format(_('%s: %i/%i items, %s%% hits, %n'),
+                            name, len(cache), force(cache.max),
+                            '%.1f' % hitRate,
+                            (cache.evictions, 'eviction')))
+        irc.reply(format('%L', L))
+    caches = wrap(caches)
+
     @internationalizeDocstring
     def cpu(self, irc, msg, args):
         """takes no arguments
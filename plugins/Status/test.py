@@ -71,9 +71,20 @@ class StatusTestCase(PluginTestCase):
 
     def testThreads(self):
         self.assertNotError('threads')
+        self.assertRegexp('threads', 'command pool has')
+
+    def testHttp(self):
+        self.assertRegexp('status http', r'I made \d+ HTTP requests?;')
+
+    def testCaches(self):
+        self.assertRegexp('status caches',
+                          r'hostmask patterns: \d+/\d+ items, [\d.]+% hits')
 
     def testProcesses(self):
         self.assertNotError('processes')
 
+    def testEvents(self):
+        self.assertRegexp('events', r'I have \d+ events? scheduled\.')
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
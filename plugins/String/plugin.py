@@ -203,18 +203,21 @@ class String(callbacks.Plugin):
             s = _('You probably don\'t want to match the empty string.')
             irc.error(s)
         else:
-            t = self.registryValue('re.timeout')
-            try:
-                v = process(f, text, timeout=t, pn=self.name(), cn='re')
+            def callback(v):
                 if isinstance(v, list):
                     v = format('%L', v)
                 irc.reply(v)
-            except commands.ProcessTimeoutError as e:
-                irc.error("ProcessTimeoutError: %s" % (e,))
-            except re.error as e:
-                irc.error(e.args[0])
-    re = thread(wrap(re, [first('regexpMatcherMany', 'regexpReplacer'),
-                   'text']))
+            def errback(e):
+                if isinstance(e, commands.ProcessTimeoutError):
+                    irc.error("ProcessTimeoutError: %s" % (e,))
+                elif isinstance(e, re.error):
+                    irc.error(e.args[0])
+                else:
+                    irc.error(utils.exnToString(e))
+            t = self.registryValue('re.timeout')
+            processAsync(f, text, timeout=t, pn=self.name(), cn='re',
+                         callback=callback, errback=errback)
+    re = wrap(re, [first('regexpMatcherMany', 'regexpReplacer'), 'text'])
 
     def xor(self, irc, msg, args, password, text):
         """<password> <text>
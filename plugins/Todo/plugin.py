@@ -238,21 +238,33 @@ class Todo(callbacks.Plugin):
         if not optlist and not globs:
             raise callbacks.ArgumentError
         criteria = []
+        regexps = []
         for (option, arg) in optlist:
             if option == 'regexp':
-                criteria.append(lambda s:
-                                regexp_wrapper(s, reobj=arg, timeout=0.1,
-                                               plugin_name=self.name(),
-                                               fcn_name='search'))
+                regexps.append(arg)
         for glob in globs:
             glob = utils.python.glob2re(glob)
             criteria.append(re.compile(glob).search)
         try:
             tasks = self.db.select(user.id, criteria)
-            L = [format('#%i: %s', t.id, self._shrink(t.task)) for t in tasks]
-            irc.reply(format('%L', L))
         except dbi.NoRecordError:
             irc.reply(_('No tasks matched that query.'))
+            return
+        def callback(tasks):
+            if not tasks:
+                irc.reply(_('No tasks matched that query.'))
+                return
+            L = [format('#%i: %s', t.id, self._shrink(t.task)) for t in tasks]
+            irc.reply(format('%L', L))
+        def errback(e):
+            if isinstance(e, commands.ProcessTimeoutError):
+                irc.error(_('The regular expression timed out.'))
+            else:
+                irc.error(utils.exnToString(e))
+        regexp_filter_async(tasks, regexps, timeout=0.1,
+                            plugin_name=self.name(), fcn_name='search',
+                            callback=callback, errback=errback,
+                            key=lambda task: task.task)
     search = wrap(search,
                   ['user', getopts({'regexp': 'regexpMatcher'}), any('glob')])
 
@@ -78,6 +78,11 @@ conf.registerGlobalValue(Web, 'timeout',
     seconds the bot will wait for the site to respond, when using a command
     in this plugin other than 'fetch'. If 0, will use socket.defaulttimeout"""))
 
+conf.registerGlobalValue(Web, 'titleCacheTimeout',
+    registry.NonNegativeInteger(600, _("""Determines how many seconds the
+    bot remembers the title of a URL, to reply to the 'title' command and the
+    title snarfer without fetching it again.  0 disables this cache.""")))
+
 conf.registerGroup(Web, 'fetch')
 conf.registerGlobalValue(Web.fetch, 'maximum',
     registry.NonNegativeInteger(0, _("""Determines the maximum number of
@@ -30,7 +30,10 @@
 
 import re
 import sys
+import time
+import codecs
 import socket
+import threading
 
 import supybot.conf as conf
 import supybot.utils as utils
@@ -58,6 +61,7 @@ class Title(utils.web.HtmlToText):
     def __init__(self):
         self.inTitle = False
         self.inSvg = False
+        self.done = False
         utils.web.HtmlToText.__init__(self)
 
     @property
@@ -72,6 +76,7 @@ class Title(utils.web.HtmlToText):
 
     def handle_endtag(self, tag):
         if tag == 'title':
+            self.done = self.done or self.inHtmlTitle
             self.inTitle = False
         elif tag == 'svg':
             self.inSvg = False
@@ -145,36 +150,81 @@ class Web(callbacks.PluginRegexp):
     def noIgnore(self, irc, msg):
         return not self.registryValue('checkIgnored', msg.args[0])
 
+    def __init__(self, irc):
+        self.__parent = super(Web, self)
+        self.__parent.__init__(irc)
+        # url -> (time it was fetched at, target, title)
+        self.titles = utils.structures.LRUCacheDict(1000)
+        # Our commands run in several threads.
+        self.titlesLock = threading.Lock()
+
     def getTitle(self, irc, url, raiseErrors):
+        timeout = self.registryValue('titleCacheTimeout')
+        with self.titlesLock:
+            cached = self.titles.get(url)
+        if cached is not None and time.time() - cached[0] < timeout:
+            return cached[1:]
+        r = self._fetchTitle(irc, url, raiseErrors)
+        if r and timeout:
+            with self.titlesLock:
+                self.titles[url] = (time.time(),) + r
+        return r
+
+    _charsetRe = re.compile(r'charset=["\']?([\w.:-]+)', re.I)
+    def _fetchTitle(self, irc, url, raiseErrors):
         size = conf.supybot.protocols.http.peekSize()
         timeout = self.registryValue('timeout')
-        (target, text) = utils.web.getUrlTargetAndContent(url, size=size,
-                timeout=timeout)
+        fd = utils.web.getUrlFd(url, timeout=timeout)
         try:
-            text = text.decode(utils.web.getEncoding(text) or 'utf8',
-                    'replace')
-        except UnicodeDecodeError:
-            pass
-        parser = Title()
-        if minisix.PY3 and isinstance(text, bytes):
-            if raiseErrors:
-                irc.error(_('Could not guess the page\'s encoding. (Try '
-                        'installing python-charade.)'), Raise=True)
-            else:
+            target = fd.geturl()
+            contentType = fd.headers.get('Content-Type') or ''
+            mimetype = contentType.split(';')[0].strip().lower()
+            if mimetype and 'html' not in mimetype and 'xml' not in mimetype:
+                if raiseErrors:
+                    irc.error(format(_('That URL is not an HTML page (its '
+                                       'content type is %s).'), mimetype),
+                              Raise=True)
                 return None
-        parser.feed(text)
-        parser.close()
+            match = self._charsetRe.search(contentType)
+            # The page is read in chunks and fed to the parser as they
+            # come, until the end of its title.  The encoding is guessed
+            # from the first chunk, which usually has the <meta> tags.
+            text = self._read(fd, min(size, 4096))
+            encoding = (match and match.group(1)) or \
+                    utils.web.getEncoding(text) or 'utf8'
+            try:
+                decoder = codecs.getincrementaldecoder(encoding)('replace')
+            except LookupError:
+                decoder = codecs.getincrementaldecoder('utf8')('replace')
+            parser = Title()
+            read = 0
+            while text:
+                read += len(text)
+                parser.feed(decoder.decode(text))
+                if parser.done or read >= size:
+                    break
+                text = self._read(fd, min(size - read, 4096))
+            parser.feed(decoder.decode(b'', True))
+            parser.close()
+        finally:
+            fd.close()
         title = utils.str.normalizeWhitespace(''.join(parser.data).strip())
         if title:
             return (target, title)
         elif raiseErrors:
-            if len(text) < size:
+            if read < size:
                 irc.error(_('That URL appears to have no HTML title.'),
                         Raise=True)
             else:
                 irc.error(format(_('That URL appears to have no HTML title '
                                  'within the first %S.'), size), Raise=True)
 
+    def _read(self, fd, size):
+        try:
+            return fd.read(size)
+        except socket.timeout:
+            raise utils.web.Error(utils.web.TIMED_OUT)
+
     @fetch_sandbox
     def titleSnarfer(self, irc, msg, match):
         channel = msg.args[0]
@@ -144,6 +144,36 @@ class WebTestCase(ChannelPluginTestCase):
                 conf.supybot.plugins.Web.urlWhitelist.set('')
                 conf.supybot.plugins.Web.fetch.maximum.set(fm)
 
+    def testTitleStreamingAndCache(self):
+        pages = {
+            'http://example.org/page': ('text/html; charset=iso-8859-1',
+                b'<html><head><title>Caf\xe9</title></head>' +
+                b'<body>' * 10000),
+            'http://example.org/image': ('image/png', b'\x89PNG' * 1000),
+            }
+        fds = []
+        def fakeGetUrlFd(url, *args, **kwargs):
+            (contentType, body) = pages[url]
+            fd = minisix.io.BytesIO(body)
+            fd.geturl = lambda: url
+            fd.close = lambda: None
+            fd.headers = {'Content-Type': contentType}
+            fds.append(fd)
+            return fd
+        (utils.web.getUrlFd, realGetUrlFd) = (fakeGetUrlFd, utils.web.getUrlFd)
+        try:
+            self.assertResponse('title http://example.org/page', u'Caf\xe9')
+            self.assertEqual(len(fds), 1)
+            # Reading stopped soon after the title.
+            self.assertEqual(fds[0].tell(), 4096)
+            self.assertResponse('title http://example.org/page', u'Caf\xe9')
+            self.assertEqual(len(fds), 1)
+            self.assertRegexp('title http://example.org/image',
+                              'not an HTML page.*image/png')
+            self.assertEqual(fds[1].tell(), 0)
+        finally:
+            utils.web.getUrlFd = realGetUrlFd
+
     def testNonSnarfingRegexpConfigurable(self):
         self.assertSnarfNoResponse('http://foo.bar.baz/', 2)
         try:
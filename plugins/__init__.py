@@ -33,12 +33,14 @@ import os
 import csv
 import time
 import codecs
+import shutil
 import fnmatch
 import os.path
 import threading
 import collections
 
-from .. import callbacks, conf, dbi, ircdb, ircutils, log, utils, world
+from .. import callbacks, commands, conf, dbi, ircdb, ircutils, log, utils, \
+        world
 from ..commands import *
 
 class NoSuitableDatabase(Exception):
@@ -217,21 +219,73 @@ class ChannelUserDictionary(collections.MutableMapping):
 #     interface.  This is just too odd and not extensible; any extension
 #     would very much feel like an extension, rather than part of the db
 #     itself.
+class DirtyIdDict(dict):
+    """Remembers the ids that were set, deleted, or read (because the values
+    of a ChannelUserDB are often mutable objects updated in place) since the
+    last time its dirty set was cleared."""
+    __slots__ = ('dirty',)
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self.dirty = set()
+
+    def __getitem__(self, id):
+        v = dict.__getitem__(self, id)
+        self.dirty.add(id)
+        return v
+
+    def __setitem__(self, id, v):
+        dict.__setitem__(self, id, v)
+        self.dirty.add(id)
+
+    def __delitem__(self, id):
+        dict.__delitem__(self, id)
+        self.dirty.add(id)
+
 class ChannelUserDB(ChannelUserDictionary):
+    """A csv file of (channel, id, serialized value...) rows.
+
+    When supybot.databases.plugins.journal is on, flushing only appends the
+    values that changed (or the ids that were deleted) to a journal file,
+    which is merged back into the csv file by a background thread when it
+    grows larger than it."""
     def __init__(self, filename):
         ChannelUserDictionary.__init__(self)
         self.filename = filename
+        self.journalFilename = filename + '.journal'
+        self.compactingFilename = self.journalFilename + '.compacting'
+        self.compactingThread = None
+        self.journal = conf.supybot.databases.plugins.journal()
+        if self.journal:
+            self.IdDict = DirtyIdDict
+        self._read(self.filename)
+        # If a compaction was interrupted, its journal comes before the
+        # current one.
+        interrupted = self._read(self.compactingFilename, journal=True)
+        self._read(self.journalFilename, journal=True)
+        if self.journal:
+            for ids in self.channels.values():
+                ids.dirty.clear()
+        if interrupted and self._writeAll(list(self.items())):
+            self._removeJournals()
+
+    def _read(self, filename, journal=False):
+        """Loads the rows of the given file.  Rows of journals start with
+        '+' for updated values and '-' for deleted ids.  Returns whether the
+        file exists."""
         try:
-            fd = codecs.open(self.filename, encoding='utf8')
+            fd = codecs.open(filename, encoding='utf8')
         except EnvironmentError as e:
-            log.warning('Couldn\'t open %s: %s.', self.filename, e)
-            return
+            if not journal:
+                log.warning('Couldn\'t open %s: %s.', filename, e)
+            return False
         reader = csv.reader(fd)
         try:
             lineno = 0
             for t in reader:
                 lineno += 1
                 try:
+                    if journal:
+                        op = t.pop(0)
                     channel = t.pop(0)
                     id = t.pop(0)
                     try:
@@ -239,6 +293,10 @@ class ChannelUserDB(ChannelUserDictionary):
                     except ValueError:
                         # We'll skip over this so, say, nicks can be kept here.
                         pass
+                    if journal and op == '-':
+                        if (channel, id) in self:
+                            del self[channel, id]
+                        continue
                     v = self.deserialize(channel, id, t)
                     self[channel, id] = v
                 except Exception as e:
@@ -249,17 +307,21 @@ class ChannelUserDB(ChannelUserDictionary):
             log.warning('Invalid line #%s in %s.',
                         lineno, self.__class__.__name__)
             log.debug('Exception: %s', utils.exnToString(e))
+        finally:
+            fd.close()
+        return True
 
-    def flush(self):
+    def _writeAll(self, items):
+        """Rewrites the whole file with the given items.  Returns whether it
+        was written."""
         mode = 'wb' if utils.minisix.PY2 else 'w'
         fd = utils.file.AtomicFile(self.filename, mode, makeBackupIfSmaller=False)
         writer = csv.writer(fd)
-        items = list(self.items())
         if not items:
             log.debug('%s: Refusing to write blank file.',
                       self.__class__.__name__)
             fd.rollback()
-            return
+            return False
         try:
             items.sort()
         except TypeError:
@@ -267,14 +329,86 @@ class ChannelUserDB(ChannelUserDictionary):
             # with both strings and integers as keys.
             pass
         for ((channel, id), v) in items:
-            L = self.serialize(v)
+            L = list(self.serialize(v))
             L.insert(0, id)
             L.insert(0, channel)
             writer.writerow(L)
         fd.close()
+        return True
+
+    def _removeJournals(self):
+        for filename in (self.compactingFilename, self.journalFilename):
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def flush(self):
+        if not self.journal:
+            if self._writeAll(list(self.items())):
+                self._removeJournals()
+            return
+        rows = []
+        for (channel, ids) in self.channels.items():
+            for id in ids.dirty:
+                if id in ids:
+                    L = list(self.serialize(dict.__getitem__(ids, id)))
+                    rows.append(['+', channel, id] + L)
+                else:
+                    rows.append(['-', channel, id])
+            ids.dirty.clear()
+        if rows:
+            mode = 'ab' if utils.minisix.PY2 else 'a'
+            encoding = None if utils.minisix.PY2 else 'utf8'
+            with codecs.open(self.journalFilename, mode,
+                             encoding=encoding) as fd:
+                csv.writer(fd).writerows(rows)
+        if self.compactingThread is not None:
+            if self.compactingThread.is_alive():
+                return
+            self.compactingThread = None
+        if not os.path.exists(self.journalFilename):
+            return
+        journalSize = os.path.getsize(self.journalFilename)
+        if os.path.exists(self.filename):
+            size = os.path.getsize(self.filename)
+        else:
+            size = 0
+        if journalSize > max(size, 65536):
+            self._compact()
+
+    def _compact(self):
+        """Merges the journal into the database, from another thread."""
+        # Listing the items is much cheaper than serializing them, which is
+        # done by the thread.  Values changed after that will be in the new
+        # journal anyway.
+        items = [((channel, id), v)
+                 for (channel, ids) in self.channels.items()
+                 for (id, v) in dict.items(ids)]
+        if not items:
+            return
+        if os.path.exists(self.compactingFilename):
+            # A previous compaction failed, so this journal was not merged
+            # yet; the current one has to come after it.
+            with open(self.compactingFilename, 'ab') as compactingFd:
+                with open(self.journalFilename, 'rb') as fd:
+                    shutil.copyfileobj(fd, compactingFd)
+            os.remove(self.journalFilename)
+        else:
+            os.rename(self.journalFilename, self.compactingFilename)
+        def compact():
+            try:
+                if self._writeAll(items):
+                    os.remove(self.compactingFilename)
+            except Exception:
+                log.exception('Error while compacting %s:', self.filename)
+        self.compactingThread = world.SupyThread(target=compact,
+                name='Compacting %s' % os.path.basename(self.filename))
+        self.compactingThread.start()
 
     def close(self):
         self.flush()
+        if self.compactingThread is not None:
+            self.compactingThread.join()
+            self.compactingThread = None
         self.clear()
 
     def deserialize(self, channel, id, L):
@@ -396,6 +530,7 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
         Searches for $types matching the criteria given.
         """
         predicates = []
+        regexps = []
         def p(record):
             for predicate in predicates:
                 if not predicate(record):
@@ -406,21 +541,30 @@ class ChannelIdDatabasePlugin(callbacks.Plugin):
             if opt == 'by':
                 predicates.append(lambda r, arg=arg: r.by == arg.id)
             elif opt == 'regexp':
-                predicates.append(lambda r: regexp_wrapper(r.text, reobj=arg,
-                        timeout=0.1, plugin_name=self.name(), fcn_name='search'))
+                regexps.append(arg)
         if glob:
             def globP(r, glob=glob.lower()):
                 return fnmatch.fnmatch(r.text.lower(), glob)
             predicates.append(globP)
-        L = []
-        for record in self.db.select(channel, p):
-            L.append(self.searchSerializeRecord(record))
-        if L:
-            L.sort()
-            irc.reply(format('%s found: %L', len(L), L))
-        else:
-            what = self.name().lower()
-            irc.reply(format('No matching %p were found.', what))
+        def callback(records):
+            L = [self.searchSerializeRecord(record) for record in records]
+            if L:
+                L.sort()
+                irc.reply(format('%s found: %L', len(L), L))
+            else:
+                what = self.name().lower()
+                irc.reply(format('No matching %p were found.', what))
+        def errback(e):
+            if isinstance(e, commands.ProcessTimeoutError):
+                irc.error('The regular expression timed out.')
+            else:
+                irc.error(utils.exnToString(e))
+        # Regexps are searched last, in a subprocess, as they may take too
+        # long.
+        regexp_filter_async(self.db.select(channel, p), regexps,
+                timeout=0.1, plugin_name=self.name(), fcn_name='search',
+                callback=callback, errback=errback,
+                key=lambda record: record.text)
     search = wrap(search, ['channeldb',
                            getopts({'by': 'otherUser',
                                     'regexp': 'regexpMatcher'}),
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Dispatches commands through 1k and 10k akas, comparing the previous
+behavior of the Aka plugin (querying the database for each prefix of the
+command, then fetching and tokenizing the alias on each call) with
+AkaCache, both while it is filled and once it is.
+
+Usage: aka.py [<commands>]"""
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import supybot.conf as conf
+import supybot.callbacks as callbacks
+
+WORDS = ('foo bar baz qux quux corge grault garply waldo fred plugh xyzzy '
+         'thud').split()
+MAXIMUM_WORDS = 5
+CHANNEL = '#limnoria'
+
+def makeDb(Aka, count):
+    db = Aka.AkaDB(conf.supybot.directories.data.dirize('Aka.sqlite3.db'))
+    names = []
+    for i in range(count):
+        channel = CHANNEL if i % 4 == 0 else 'global'
+        name = '%s%d' % (random.choice(WORDS), i)
+        db.add_aka(channel, name, 'echo [reverse $1] @1 $*')
+        names.append(name)
+    return (db, names)
+
+def makeCommands(count, names):
+    commands = []
+    for i in range(count):
+        if i % 5 == 0:
+            # Some other plugin's command.
+            name = random.choice(WORDS)
+        else:
+            name = random.choice(names)
+        commands.append([name] + random.sample(WORDS, 3))
+    return commands
+
+def dispatch(has_aka, get_body, commands):
+    found = 0
+    for args in commands:
+        for i in range(1, min(len(args)+1, MAXIMUM_WORDS)):
+            name = callbacks.formatCommand(args[0:i])
+            if has_aka(CHANNEL, name) or has_aka('global', name):
+                get_body(name)
+                found += 1
+                break
+    return found
+
+def runUncached(Aka, db, cache, commands):
+    def get_body(name):
+        original = db.get_alias(CHANNEL, name) or \
+                db.get_alias('global', name)
+        Aka.findBiggestDollar(original)
+        Aka.findBiggestAt(original)
+        return callbacks.tokenize(original)
+    return dispatch(db.has_aka, get_body, commands)
+
+def runCached(Aka, db, cache, commands):
+    def get_body(name):
+        template = cache.get_template(CHANNEL, name) or \
+                cache.get_template('global', name)
+        return template.tokenize()
+    return dispatch(cache.has_aka, get_body, commands)
+
+def main():
+    ncommands = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(42)
+    directory = tempfile.mkdtemp()
+    original = conf.supybot.directories.data()
+    try:
+        conf.supybot.directories.data.setValue(directory)
+        import supybot.plugins.Aka.plugin as Aka
+        for akas in (1000, 10000):
+            conf.supybot.directories.data.setValue('%s/%d' % (directory, akas))
+            (db, names) = makeDb(Aka, akas)
+            commands = makeCommands(ncommands, names)
+            print('%d commands, %d akas' % (ncommands, akas))
+            cache = Aka.AkaCache(db)
+            for (name, f) in (('uncached', runUncached),
+                              ('cold cache', runCached),
+                              ('warm cache', runCached)):
+                start = time.time()
+                found = f(Aka, db, cache, commands)
+                elapsed = time.time() - start
+                print('%-12s %8.3fs %10.0f commands/s (%d akas called)' %
+                      (name, elapsed, ncommands / elapsed, found))
+    finally:
+        conf.supybot.directories.data.setValue(original)
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
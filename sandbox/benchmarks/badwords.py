@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""Censors random messages with 100, 1k and 10k bad words, comparing the
+previous behavior of the BadWords plugin (one regexp alternating all the
+words) with its WordMatcher, with and without word boundaries.
+
+Usage: badwords.py [<messages>]"""
+
+from __future__ import print_function
+
+import re
+import sys
+import time
+import random
+import string
+
+import supybot.plugins.BadWords.plugin as BadWords
+
+def randomWord():
+    return ''.join(random.choice(string.ascii_lowercase)
+                   for i in range(random.randint(3, 9)))
+
+def makeMessages(count, words):
+    messages = []
+    for i in range(count):
+        L = [randomWord() for j in range(random.randint(5, 40))]
+        if i % 10 == 0:
+            L[random.randrange(len(L))] = random.choice(words).upper()
+        messages.append(' '.join(L))
+    return messages
+
+def replace(word):
+    return '*' * len(word)
+
+def makeRegexp(words, requireWordBoundaries):
+    s = '(%s)' % '|'.join(map(re.escape, words))
+    if requireWordBoundaries:
+        s = r'\b%s\b' % s
+    regexp = re.compile(s, re.I)
+    return lambda s: regexp.sub(lambda m: replace(m.group(1)), s)
+
+def makeMatcher(words, requireWordBoundaries):
+    matcher = BadWords.WordMatcher(words)
+    return lambda s: matcher.sub(replace, s, requireWordBoundaries)
+
+def main():
+    nmessages = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    random.seed(42)
+    for nwords in (100, 1000, 10000):
+        words = list(set(randomWord() for i in range(nwords)))
+        messages = makeMessages(nmessages, words)
+        print('%d messages, %d words' % (nmessages, len(words)))
+        for requireWordBoundaries in (False, True):
+            results = []
+            for (name, make) in (('regexp', makeRegexp),
+                                 ('WordMatcher', makeMatcher)):
+                start = time.time()
+                sub = make(words, requireWordBoundaries)
+                sub('') # Builds the automaton.
+                built = time.time() - start
+                start = time.time()
+                censored = [sub(s) for s in messages]
+                elapsed = time.time() - start
+                changed = sum(1 for (s, t) in zip(messages, censored)
+                              if s != t)
+                results.append(censored)
+                print('%-12s boundaries=%-5s built in %7.3fs, '
+                      '%9.0f messages/s (%d censored)' %
+                      (name, requireWordBoundaries, built,
+                       nmessages / elapsed, changed))
+            if results[0] != results[1]:
+                print('(results differ where words overlap)')
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""Load-tests the HTTP server: clients request a page as fast as they can,
+on new connections or on kept-alive ones, with or without a client which
+opens a connection and sends nothing.  Compares the previous server, which
+handled one connection at a time in the thread of serve_forever, with the
+current one.  Prints the number of requests per second.
+
+Usage: httpserver.py [<clients> [<seconds>]]"""
+
+from __future__ import print_function
+
+import sys
+import time
+import socket
+import threading
+
+import supybot.conf as conf
+import supybot.httpserver as httpserver
+from supybot.utils import minisix
+
+if minisix.PY2:
+    from httplib import HTTPConnection, HTTPException
+    from BaseHTTPServer import HTTPServer
+else:
+    from http.client import HTTPConnection, HTTPException
+    from http.server import HTTPServer
+
+PAGE = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 50
+
+class PageCallback(httpserver.SupyHTTPServerCallback):
+    name = 'page'
+    def doGet(self, handler, path):
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.end_headers()
+        self.write(PAGE)
+
+class OldHandler(httpserver.SupyHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+    def log_message(self, format, *args):
+        pass
+
+class Handler(httpserver.SupyHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class OldServer(httpserver.RealSupyHTTPServer):
+    process_request = HTTPServer.process_request
+
+def client(port, keepAlive, deadline, counts):
+    count = 0
+    connection = None
+    headers = {'Accept-Encoding': 'gzip'}
+    while time.time() < deadline:
+        if connection is None:
+            connection = HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            connection.request('GET', '/page/', headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (socket.error, HTTPException):
+            connection.close()
+            connection = None
+            continue
+        count += 1
+        if not keepAlive or response.getheader('Connection') == 'close':
+            connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+    counts.append(count)
+
+def run(serverClass, handlerClass, nclients, seconds, keepAlive, idleClient):
+    server = serverClass(('127.0.0.1', 0), 4, handlerClass)
+    server.hook('page', PageCallback())
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.start()
+    port = server.server_address[1]
+    idle = None
+    if idleClient:
+        idle = socket.create_connection(('127.0.0.1', port))
+        time.sleep(0.1)
+    counts = []
+    deadline = time.time() + seconds
+    clients = [threading.Thread(target=client,
+                                args=(port, keepAlive, deadline, counts))
+               for i in range(nclients)]
+    for t in clients:
+        t.start()
+    for t in clients:
+        t.join()
+    if idle is not None:
+        idle.close()
+    server.shutdown()
+    server.server_close()
+    thread.join()
+    return sum(counts) / float(seconds)
+
+def main():
+    nclients = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 3
+    # Short enough for the previous server not to stall for the whole run.
+    conf.supybot.servers.http.timeout.setValue(2)
+    print('%d clients, %s seconds per run' % (nclients, seconds))
+    for (name, serverClass, handlerClass) in (
+            ('previous', OldServer, OldHandler),
+            ('current', httpserver.RealSupyHTTPServer, Handler)):
+        for keepAlive in (False, True):
+            if keepAlive and handlerClass is OldHandler:
+                continue
+            for idleClient in (False, True):
+                rate = run(serverClass, handlerClass, nclients, seconds,
+                           keepAlive, idleClient)
+                print('%-9s %-13s %-16s %10.0f requests/s' %
+                      (name, 'keep-alive' if keepAlive else 'no keep-alive',
+                       'with idle client' if idleClient else '', rate))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Parses the lines of an IRC log (raw lines, as received from a server)
+with the previous IrcMsg parser, which split prefixes and parsed server tags
+eagerly, and with the current one.  Without a log, replays a generated one
+with a netsplit, NAMES and WHO replies and tagged PRIVMSGs.
+
+Usage: ircmsgs.py [<log> [<repeat>]]"""
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+import datetime
+
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+from supybot.utils import minisix
+
+class OldIrcMsg(object):
+    """The string parsing part of the previous IrcMsg.__init__."""
+    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
+                 '_hash', '_str', '_repr', '_len', 'tags', 'reply_env',
+                 'server_tags', 'time')
+    def __init__(self, s):
+        self._str = None
+        self._repr = None
+        self._hash = None
+        self._len = None
+        self.reply_env = None
+        self.tags = {}
+        if not s.endswith('\n'):
+            s += '\n'
+        self._str = s
+        if s[0] == '@':
+            (server_tags, s) = s.split(' ', 1)
+            self.server_tags = ircmsgs.parse_server_tags(server_tags[1:])
+        else:
+            self.server_tags = {}
+        if s[0] == ':':
+            self.prefix, s = s[1:].split(None, 1)
+        else:
+            self.prefix = ''
+        if ' :' in s:
+            s, last = s.split(' :', 1)
+            self.args = s.split()
+            self.args.append(last.rstrip('\r\n'))
+        else:
+            self.args = s.split()
+        self.command = self.args.pop(0)
+        if 'time' in self.server_tags:
+            s = self.server_tags['time']
+            date = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
+            date = minisix.make_datetime_utc(date)
+            self.time = minisix.datetime__timestamp(date)
+        else:
+            self.time = time.time()
+        self.args = tuple(self.args)
+        if ircutils.isUserHostmask(self.prefix):
+            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
+        else:
+            (self.nick, self.user, self.host) = (self.prefix,)*3
+
+def makeLog(count):
+    random.seed(42)
+    nicks = ['user%d' % i for i in range(500)]
+    def prefix(nick):
+        return '%s!~%s@host-%s.example.net' % (nick, nick, len(nick))
+    def tags():
+        return '@time=2017-05-%02dT12:%02d:%02d.%03dZ;account=%s ' % (
+            random.randint(1, 28), random.randint(0, 59),
+            random.randint(0, 59), random.randint(0, 999),
+            random.choice(nicks))
+    lines = []
+    while len(lines) < count:
+        kind = random.random()
+        if kind < 0.5:
+            nick = random.choice(nicks)
+            lines.append('%s:%s PRIVMSG #limnoria :%s' % (tags(), prefix(nick),
+                ' '.join(random.choice(nicks) for i in range(8))))
+        elif kind < 0.7:
+            # A netsplit, and the users joining back.
+            for nick in random.sample(nicks, 50):
+                lines.append(':%s QUIT :irc1.example.net irc2.example.net' %
+                             prefix(nick))
+                lines.append(':%s JOIN #limnoria' % prefix(nick))
+        elif kind < 0.85:
+            for i in range(0, len(nicks), 40):
+                lines.append(':irc.example.net 353 bot = #limnoria :%s' %
+                             ' '.join(nicks[i:i+40]))
+        else:
+            for nick in random.sample(nicks, 50):
+                lines.append(':irc.example.net 352 bot #limnoria ~%s '
+                             'host.example.net irc.example.net %s H :0 %s' %
+                             (nick, nick, nick))
+    return lines[:count]
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as fd:
+            lines = [line.rstrip('\r\n') for line in fd if line.strip()]
+    else:
+        lines = makeLog(100000)
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    print('%d lines' % len(lines))
+    def parse(cls):
+        for line in lines:
+            cls(line)
+    def parseAndUse(cls):
+        for line in lines:
+            msg = cls(line)
+            (msg.nick, msg.time)
+    for (name, f) in (('parse', parse), ('parse, nick and time', parseAndUse)):
+        for cls in (OldIrcMsg, ircmsgs.IrcMsg):
+            best = None
+            for i in range(repeat):
+                start = time.time()
+                f(cls)
+                elapsed = time.time() - start
+                best = elapsed if best is None else min(best, elapsed)
+            print('%-22s %-10s %8.3fs %10.0f lines/s' %
+                  (name, cls.__name__, best, len(lines) / best))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
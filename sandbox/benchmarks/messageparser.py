@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""Feeds N messages through M MessageParser triggers, comparing the
+previous behavior (querying the database and running every regexp on each
+message) with the cached TriggerIndex.
+
+Usage: messageparser.py [<messages> [<triggers>]]"""
+
+from __future__ import print_function
+
+import re
+import sys
+import time
+import random
+import sqlite3
+
+from supybot.plugins.MessageParser.plugin import TriggerIndex
+
+WORDS = ('foo bar baz qux quux corge grault garply waldo fred plugh xyzzy '
+         'thud limnoria supybot channel network message trigger').split()
+
+def makeTriggers(count):
+    triggers = []
+    for i in range(count):
+        word = random.choice(WORDS)
+        if i % 30 == 0:
+            triggers.append((r'%s (\w+)' % word, 'echo $1'))
+        elif i % 3 == 0:
+            triggers.append((r'%s(\d+)' % (word + str(i)), 'echo $1'))
+        elif i % 3 == 1:
+            triggers.append((r'^%s%d .*' % (word, i), 'echo hi'))
+        else:
+            triggers.append((r'\b%s%d\b' % (word, i), 'echo ho'))
+    return triggers
+
+def makeMessages(count):
+    return [' '.join(random.choice(WORDS) for _ in range(12))
+            for _ in range(count)]
+
+def makeDb(triggers):
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE triggers (regexp TEXT, action TEXT)')
+    db.executemany('INSERT INTO triggers VALUES (?, ?)', triggers)
+    return db
+
+def runUncached(db, messages):
+    matches = 0
+    for message in messages:
+        cursor = db.cursor()
+        cursor.execute('SELECT regexp, action FROM triggers')
+        for (regexp, action) in cursor.fetchall():
+            for match in re.finditer(regexp, message):
+                matches += 1
+    return matches
+
+def runIndexed(db, messages):
+    cursor = db.cursor()
+    cursor.execute('SELECT regexp, action FROM triggers')
+    index = TriggerIndex(cursor.fetchall())
+    matches = 0
+    for message in messages:
+        for (regexp, compiled, action) in index.candidates(message):
+            for match in compiled.finditer(message):
+                matches += 1
+    return matches
+
+def main():
+    nmessages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    ntriggers = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    random.seed(42)
+    db = makeDb(makeTriggers(ntriggers))
+    messages = makeMessages(nmessages)
+    print('%d messages, %d triggers' % (nmessages, ntriggers))
+    for (name, f) in (('uncached', runUncached), ('indexed', runIndexed)):
+        start = time.time()
+        matches = f(db, messages)
+        elapsed = time.time() - start
+        print('%-10s %8.3fs %10.0f msg/s (%d matches)' %
+              (name, elapsed, nmessages / elapsed, matches))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
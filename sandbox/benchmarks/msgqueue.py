@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+"""Simulates the output queue of a bot answering many channels, while one
+of them gets a flood of replies, and prints how long the replies waited in
+the queue.  Compares the previous queue (one FIFO per priority, and one
+message every throttleTime seconds) with the current one (targets take turns,
+and a token bucket allows bursts).  Then measures the cost of enqueuing
+messages when duplicates are refused, as the backlog grows.
+
+Usage: msgqueue.py [<throttleTime> [<burst>]]"""
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+from supybot.utils.structures import smallqueue
+
+class OldIrcMsgQueue(object):
+    """The previous IrcMsgQueue, without the JOIN rate limit."""
+    def __init__(self):
+        self.highpriority = smallqueue()
+        self.normal = smallqueue()
+        self.lowpriority = smallqueue()
+
+    def enqueue(self, msg):
+        if msg in self and \
+           conf.supybot.protocols.irc.queuing.duplicates():
+            return False
+        if msg.command in irclib._high:
+            self.highpriority.enqueue(msg)
+        elif msg.command in irclib._low:
+            self.lowpriority.enqueue(msg)
+        else:
+            self.normal.enqueue(msg)
+        return True
+
+    def dequeue(self):
+        for queue in (self.highpriority, self.normal, self.lowpriority):
+            if queue:
+                return queue.dequeue()
+        return None
+
+    def __contains__(self, msg):
+        return msg in self.normal or \
+               msg in self.lowpriority or \
+               msg in self.highpriority
+
+    def __len__(self):
+        return len(self.highpriority)+len(self.lowpriority)+len(self.normal)
+
+class OldRateLimiter(object):
+    """One message every <interval> seconds."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.lastTake = -interval
+
+    def nextTime(self, now):
+        return max(now, self.lastTake + self.interval)
+
+    def take(self, now):
+        self.lastTake = now
+
+def makeArrivals():
+    random.seed(42)
+    arrivals = []
+    # The output of a long command, in one channel.
+    for i in range(300):
+        arrivals.append((0., ircmsgs.privmsg('#flood', 'line %d' % i)))
+    # Replies to single-line commands in the other channels, over 5 minutes.
+    for i in range(200):
+        channel = '#channel%d' % random.randint(0, 49)
+        arrivals.append((random.uniform(0, 300),
+                         ircmsgs.privmsg(channel, 'reply %d' % i)))
+    arrivals.sort(key=lambda x: x[0])
+    return arrivals
+
+def simulate(queue, limiter, arrivals):
+    """Returns the latency of each message, by channel."""
+    latencies = {}
+    enqueued = {}
+    now = 0.
+    i = 0
+    while i < len(arrivals) or len(queue):
+        while i < len(arrivals) and arrivals[i][0] <= now:
+            (at, msg) = arrivals[i]
+            enqueued[id(msg)] = at
+            queue.enqueue(msg)
+            i += 1
+        if len(queue) and limiter.nextTime(now) <= now:
+            msg = queue.dequeue()
+            limiter.take(now)
+            latencies.setdefault(msg.args[0], []).append(
+                now - enqueued[id(msg)])
+        times = []
+        if i < len(arrivals):
+            times.append(arrivals[i][0])
+        if len(queue):
+            times.append(limiter.nextTime(now))
+        if times:
+            now = max(now, min(times))
+    return latencies
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def describe(values):
+    return 'mean %7.1fs, median %7.1fs, 95th percentile %7.1fs, max %7.1fs' % (
+        sum(values) / len(values), percentile(values, 0.5),
+        percentile(values, 0.95), max(values))
+
+def main():
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    burst = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    arrivals = makeArrivals()
+    print('300 replies to #flood at once, 200 replies to 50 other channels '
+          'over 5 minutes; throttleTime %s, burst %s.' % (interval, burst))
+    for (name, queue, limiter) in (
+            ('previous', OldIrcMsgQueue(), OldRateLimiter(interval)),
+            ('current', irclib.IrcMsgQueue(),
+             irclib.TokenBucket(interval, burst))):
+        latencies = simulate(queue, limiter, arrivals)
+        others = sum([v for (k, v) in latencies.items() if k != '#flood'], [])
+        print('%-9s #flood:  %s' % (name, describe(latencies['#flood'])))
+        print('%-9s others:  %s' % ('', describe(others)))
+
+    print('Enqueuing with supybot.protocols.irc.queuing.duplicates on:')
+    with conf.supybot.protocols.irc.queuing.duplicates.context(True):
+        for backlog in (1000, 3000):
+            msgs = [ircmsgs.privmsg('#channel%d' % (i % 50), str(i))
+                    for i in range(backlog)]
+            for (name, cls) in (('previous', OldIrcMsgQueue),
+                                ('current', irclib.IrcMsgQueue)):
+                queue = cls()
+                start = time.time()
+                for msg in msgs:
+                    queue.enqueue(msg)
+                elapsed = time.time() - start
+                print('%-9s %5d messages: %8.3fs %10.0f messages/s' %
+                      (name, backlog, elapsed, backlog / elapsed))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""Replays a netsplit (QUITs of many users, then their JOINs and a few nick
+changes) on an IrcState in thousands of channels, comparing the previous
+QUIT and NICK handlers, which looked for the nick in every channel, with the
+current ones, which use the nick to channels index.
+
+Usage: netsplit.py [<channels> [<users>]]"""
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+
+import supybot.irclib as irclib
+import supybot.ircmsgs as ircmsgs
+import supybot.ircutils as ircutils
+
+CHANNELS_PER_USER = 3
+
+class FakeIrc:
+    nick = 'bot'
+    prefix = 'bot!bot@example.net'
+
+class OldIrcState(irclib.IrcState):
+    def doQuit(self, irc, msg):
+        channel_names = ircutils.IrcSet()
+        for (name, channel) in self.channels.items():
+            if msg.nick in channel.users:
+                channel_names.add(name)
+                channel.removeUser(msg.nick)
+        msg.tag('channels', channel_names)
+        if msg.nick in self.nicksToHostmasks:
+            del self.nicksToHostmasks[msg.nick]
+
+    def doNick(self, irc, msg):
+        newNick = msg.args[0]
+        oldNick = msg.nick
+        try:
+            if msg.user and msg.host:
+                newHostmask = ircutils.joinHostmask(newNick,msg.user,msg.host)
+                self.nicksToHostmasks[newNick] = newHostmask
+            del self.nicksToHostmasks[oldNick]
+        except KeyError:
+            pass
+        channel_names = ircutils.IrcSet()
+        for (name, channel) in self.channels.items():
+            if msg.nick in channel.users:
+                channel_names.add(name)
+            channel.replaceUser(oldNick, newNick)
+        msg.tag('channels', channel_names)
+
+def makeState(cls, irc, channels, memberships):
+    state = cls()
+    for channel in channels:
+        state.addMsg(irc, ircmsgs.join(channel, prefix=irc.prefix))
+    for (channel, nicks) in memberships.items():
+        for i in range(0, len(nicks), 50):
+            state.addMsg(irc, ircmsgs.IrcMsg(':irc.example.net 353 %s = %s :%s'
+                % (irc.nick, channel, ' '.join(nicks[i:i+50]))))
+    return state
+
+def makeSplit(nicks, userChannels):
+    msgs = []
+    for nick in nicks:
+        msgs.append(ircmsgs.quit('irc1.example.net irc2.example.net',
+                                 prefix='%s!~%s@example.net' % (nick, nick)))
+    for nick in nicks:
+        msgs.append(ircmsgs.join(','.join(userChannels[nick]),
+                                 prefix='%s!~%s@example.net' % (nick, nick)))
+    for nick in nicks[::10]:
+        msgs.append(ircmsgs.IrcMsg(':%s!~%s@example.net NICK %s_' %
+                                   (nick, nick, nick)))
+    return msgs
+
+def main():
+    nchannels = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    nusers = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    random.seed(42)
+    irc = FakeIrc()
+    channels = ['#channel%d' % i for i in range(nchannels)]
+    nicks = ['user%d' % i for i in range(nusers)]
+    memberships = dict((channel, []) for channel in channels)
+    userChannels = {}
+    for nick in nicks:
+        userChannels[nick] = random.sample(channels, CHANNELS_PER_USER)
+        for channel in userChannels[nick]:
+            memberships[channel].append(nick)
+    print('%d channels, %d users, %d channels per user' %
+          (nchannels, nusers, CHANNELS_PER_USER))
+    for cls in (OldIrcState, irclib.IrcState):
+        state = makeState(cls, irc, channels, memberships)
+        # Messages are tagged by the state, so each run needs its own.
+        msgs = makeSplit(nicks, userChannels)
+        start = time.time()
+        for msg in msgs:
+            state.addMsg(irc, msg)
+        elapsed = time.time() - start
+        print('%-12s %8.3fs %10.0f messages/s' %
+              (cls.__name__, elapsed, len(msgs) / elapsed))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""Looks up plugin values, globally and for a few channels, comparing the
+previous behavior of PluginMixin.registryValue (walking the registry from
+supybot.plugins on every call) with registry.Accessor.
+
+Usage: registryvalue.py [<lookups>]"""
+
+from __future__ import print_function
+
+import sys
+import time
+
+import supybot.conf as conf
+import supybot.registry as registry
+import supybot.ircutils as ircutils
+
+NAMES = ('enable', 'timestamp', 'stripFormatting', 'flushImmediately')
+CHANNELS = ('#limnoria', '#supybot', '#python', None)
+
+def makePlugin():
+    plugin = conf.registerPlugin('RegistryValueBenchmark')
+    for name in NAMES:
+        conf.registerChannelValue(plugin, name,
+            registry.Boolean(True, 'help'))
+    conf.registerGroup(plugin, 'nested')
+    conf.registerChannelValue(plugin.nested, 'value',
+        registry.String('foo', 'help'))
+    return 'RegistryValueBenchmark'
+
+def walk(plugin, name, channel=None):
+    group = conf.supybot.plugins.get(plugin)
+    for name in registry.split(name):
+        group = group.get(name)
+    if channel is not None and ircutils.isChannel(channel):
+        group = group.get(channel)
+    return group()
+
+def makeAccessed(plugin):
+    accessors = {}
+    def accessed(plugin, name, channel=None):
+        try:
+            accessor = accessors[name]
+        except KeyError:
+            names = [plugin] + registry.split(name)
+            accessor = registry.Accessor(conf.supybot.plugins, names)
+            accessors[name] = accessor
+        if channel is not None and ircutils.isChannel(channel):
+            return accessor.get(channel)()
+        return accessor.get()()
+    return accessed
+
+def run(f, plugin, lookups):
+    names = NAMES + ('nested.value',)
+    for i in range(lookups):
+        f(plugin, names[i % len(names)], CHANNELS[i % len(CHANNELS)])
+
+def main():
+    lookups = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    plugin = makePlugin()
+    print('%d lookups' % lookups)
+    for (name, f) in (('walk', walk), ('accessor', makeAccessed(plugin))):
+        start = time.time()
+        run(f, plugin, lookups)
+        elapsed = time.time() - start
+        print('%-10s %8.3fs %10.0f lookups/s' %
+              (name, elapsed, lookups / elapsed))
+
+if __name__ == '__main__':
+    main()
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -40,9 +40,11 @@ from . import shlex
 import codecs
 import getopt
 import inspect
+import threading
+import collections
 
 from . import (conf, ircdb, irclib, ircmsgs, ircutils, log, registry,
-        utils, world)
+        schedule, utils, world)
 from .utils import minisix
 from .utils.iter import any, all
 from .i18n import PluginInternationalization
@@ -743,10 +745,11 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         (a list of strings) and the plugins for which it was a command."""
         assert isinstance(args, list)
         args = list(map(canonicalName, args))
+        candidates = commandIndex.candidates(self.irc.callbacks, args)
         cbs = []
         maxL = []
         for cb in self.irc.callbacks:
-            if not hasattr(cb, 'getCommand'):
+            if cb not in candidates:
                 continue
             L = cb.getCommand(args)
             #log.debug('%s.getCommand(%r) returned %r', cb.name(), args, L)
@@ -833,9 +836,8 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             args = self.args[len(command):]
             if world.isMainThread() and \
                (cb.threaded or conf.supybot.debug.threadAllCommands()):
-                t = CommandThread(target=cb._callCommand,
-                                  args=(command, self, self.msg, args))
-                t.start()
+                commandPool.submit(cb.name(), cb._callCommand,
+                                   (command, self, self.msg, args))
             else:
                 cb._callCommand(command, self, self.msg, args)
 
@@ -865,6 +867,12 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
         assert not isinstance(s, ircmsgs.IrcMsg), \
                'Old code alert: there is no longer a "msg" argument to reply.'
         self.repliedTo = True
+        if commandPool.inWorker():
+            return commandPool.callInMainLoopAndWait(self.reply, s,
+                    noLengthCheck=noLengthCheck, prefixNick=prefixNick,
+                    action=action, private=private, notice=notice, to=to,
+                    msg=msg, sendImmediately=sendImmediately,
+                    stripCtcp=stripCtcp)
         if sendImmediately:
             sendMsg = self.irc.sendMsg
         else:
@@ -1029,6 +1037,9 @@ class NestedCommandsIrcProxy(ReplyIrcProxy):
             else:
                 raise ArgumentError
         if s:
+            if commandPool.inWorker():
+                return commandPool.callInMainLoopAndWait(self.error, s,
+                                                         **kwargs)
             if not isinstance(self.irc, irclib.Irc):
                 return self.irc.error(s, **kwargs)
             else:
@@ -1085,6 +1096,167 @@ class CommandProcess(world.SupyProcess):
     def run(self):
         self.__parent.run()
 
+class _CommandPoolTask(object):
+    __slots__ = ('plugin', 'f', 'args', 'kwargs')
+    def __init__(self, plugin, f, args, kwargs):
+        self.plugin = plugin
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+
+class _CommandPoolWorker(world.SupyThread):
+    def __init__(self, pool):
+        self.pool = pool
+        name = 'Thread #%s (for the command pool)' % world.threadsSpawned
+        super(_CommandPoolWorker, self).__init__(name=name)
+        self.setDaemon(True)
+
+    def run(self):
+        self.pool._work()
+
+class CommandPool(object):
+    """A bounded pool of threads, running the commands of threaded plugins
+    (and the commands wrapped by commands.thread) without blocking the main
+    loop.
+
+    At most <size> commands run at once, and at most <perPlugin> of the
+    same plugin; the other ones are queued.  Both are callables, so they
+    can be registry values.  Replies sent from the threads of the pool are
+    sent from the main loop, in order, which is also where the evaluation of
+    the enclosing nested commands goes on; the threads wait for them to be
+    sent, and get the messages, as if they had sent them themselves."""
+    def __init__(self, size, perPlugin):
+        self.size = size
+        self.perPlugin = perPlugin
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.tasks = collections.deque() # Tasks which may run now.
+        self.waiting = {} # plugin -> deque of tasks over its limit
+        self.admitted = {} # plugin -> number of queued or running tasks
+        self.workers = []
+        self.idle = 0
+        self.calls = collections.deque()
+        self.callsScheduled = False
+        self.stats = {'submitted': 0, 'completed': 0, 'maxQueued': 0}
+
+    def submit(self, plugin, f, args=(), kwargs={}):
+        """Runs f(*args, **kwargs) in a thread of the pool, once fewer
+        than perPlugin tasks of <plugin> (a name) are running."""
+        task = _CommandPoolTask(plugin, f, args, kwargs)
+        with self.lock:
+            self.stats['submitted'] += 1
+            if self.admitted.get(plugin, 0) < self.perPlugin():
+                self._admit(task)
+            else:
+                self.waiting.setdefault(plugin, collections.deque()) \
+                        .append(task)
+            self.stats['maxQueued'] = max(self.stats['maxQueued'],
+                                          self._queued())
+
+    def _admit(self, task):
+        self.admitted[task.plugin] = self.admitted.get(task.plugin, 0) + 1
+        self.tasks.append(task)
+        if self.idle < len(self.tasks) and len(self.workers) < self.size():
+            worker = _CommandPoolWorker(self)
+            self.workers.append(worker)
+            self.idle += 1
+            worker.start()
+        self.ready.notify()
+
+    def _release(self, plugin):
+        self.admitted[plugin] -= 1
+        waiting = self.waiting.get(plugin)
+        if waiting:
+            self._admit(waiting.popleft())
+            if not waiting:
+                del self.waiting[plugin]
+        if not self.admitted[plugin]:
+            del self.admitted[plugin]
+
+    def _queued(self):
+        return len(self.tasks) + sum(map(len, self.waiting.values()))
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.tasks:
+                    self.ready.wait()
+                task = self.tasks.popleft()
+                self.idle -= 1
+            try:
+                task.f(*task.args, **task.kwargs)
+            except Exception:
+                log.exception('Uncaught exception in a command of %s:',
+                              task.plugin)
+            finally:
+                with self.lock:
+                    self.idle += 1
+                    self.stats['completed'] += 1
+                    self._release(task.plugin)
+
+    def metrics(self):
+        """Returns a dictionary of the current state of the pool, with
+        the number of workers, of running tasks, of queued tasks (including
+        the ones over the limit of their plugin), and the counters of
+        submitted and completed tasks and of the maximum number of queued
+        tasks."""
+        with self.lock:
+            d = dict(self.stats)
+            d['workers'] = len(self.workers)
+            d['running'] = len(self.workers) - self.idle
+            d['queued'] = self._queued()
+            return d
+
+    def inWorker(self):
+        """Returns whether the current thread is one of the pool."""
+        return isinstance(threading.currentThread(), _CommandPoolWorker)
+
+    def callInMainLoop(self, f, *args, **kwargs):
+        """Calls f(*args, **kwargs) from the main loop, after the other
+        calls given to this method."""
+        with self.lock:
+            self.calls.append((f, args, kwargs))
+            scheduled = self.callsScheduled
+            self.callsScheduled = True
+        if not scheduled:
+            schedule.addEvent(self._runCalls, time.time())
+
+    def callInMainLoopAndWait(self, f, *args, **kwargs):
+        """Like callInMainLoop, but waits for the call to be made, and
+        returns what f returned (or raises what it raised)."""
+        done = threading.Event()
+        result = []
+        def call():
+            try:
+                result.append((True, f(*args, **kwargs)))
+            except Exception as e:
+                result.append((False, e))
+            finally:
+                done.set()
+        self.callInMainLoop(call)
+        done.wait()
+        (succeeded, v) = result[0]
+        if succeeded:
+            return v
+        else:
+            raise v
+
+    def _runCalls(self):
+        while True:
+            with self.lock:
+                if not self.calls:
+                    self.callsScheduled = False
+                    return
+                (f, args, kwargs) = self.calls.popleft()
+            try:
+                f(*args, **kwargs)
+            except Exception:
+                log.exception('Uncaught exception in a reply from the '
+                              'command pool:')
+
+commandPool = CommandPool(conf.supybot.commands.threads.poolSize,
+                          conf.supybot.commands.threads.maximumPerPlugin)
+
 class CanonicalString(registry.NormalizedString):
     def normalize(self, s):
         return canonicalName(s)
@@ -1145,6 +1317,166 @@ class DisabledCommands(object):
         else:
             if self.d[command] is not None:
                 self.d[command].remove(plugin)
+        # Disabled commands are not indexed.
+        commandIndex.clear()
+
+class CommandIndex(object):
+    """A trie of the commands of the loaded plugins, which tells which
+    plugins may have a given command without asking each of them.
+
+    Plugins are indexed from their listCommands() the first time they are
+    seen.  Plugins whose commands change at runtime set
+    ``dynamicCommands``, and call add() and remove() as their commands come
+    and go; they may also have a refreshCommandIndex() method, called before
+    each lookup.  Plugins overriding getCommand or isCommandMethod without
+    setting ``dynamicCommands`` are always candidates."""
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.root = ({}, {}) # (callback -> count, word -> child)
+        self.indexed = {} # callback -> names from its listCommands()
+        self.dynamic = {} # callback -> {name: count}
+        self.opaque = set()
+        self.refreshers = set()
+
+    @staticmethod
+    def _split(command):
+        if isinstance(command, minisix.string_types):
+            command = command.split()
+        return tuple(map(canonicalName, command))
+
+    def _insert(self, cb, name, count=1):
+        for path in (name, (cb.canonicalName(),) + name):
+            node = self.root
+            for word in path:
+                node = node[1].setdefault(word, ({}, {}))
+            node[0][cb] = node[0].get(cb, 0) + count
+
+    def _delete(self, cb, name, count=1):
+        for path in (name, (cb.canonicalName(),) + name):
+            nodes = [self.root]
+            for word in path:
+                node = nodes[-1][1].get(word)
+                if node is None:
+                    break
+                nodes.append(node)
+            else:
+                counts = nodes[-1][0]
+                if counts.get(cb, 0) > count:
+                    counts[cb] -= count
+                else:
+                    counts.pop(cb, None)
+                # Prune the nodes left empty.
+                for (word, node, parent) in \
+                        reversed(list(zip(path, nodes[1:], nodes))):
+                    if node[0] or node[1]:
+                        break
+                    del parent[1][word]
+
+    def _isOpaque(self, cb):
+        if not isinstance(cb, Commands):
+            return True
+        if cb.dynamicCommands:
+            return False
+        for cls in type(cb).__mro__:
+            if cls is Commands:
+                return False
+            if 'getCommand' in vars(cls) or 'isCommandMethod' in vars(cls):
+                return True
+        return False
+
+    def _index(self, cb):
+        if not hasattr(cb, 'getCommand'):
+            self.indexed[cb] = []
+        elif self._isOpaque(cb):
+            self.indexed[cb] = []
+            self.opaque.add(cb)
+        else:
+            if cb.dynamicCommands:
+                names = Commands.listCommands(cb)
+            else:
+                names = cb.listCommands()
+            names = list(map(self._split, names))
+            self.indexed[cb] = names
+            for name in names:
+                self._insert(cb, name)
+            for (name, count) in self.dynamic.get(cb, {}).items():
+                self._insert(cb, name, count)
+            if hasattr(cb, 'refreshCommandIndex'):
+                self.refreshers.add(cb)
+
+    def _unindex(self, cb):
+        if cb in self.indexed and cb not in self.opaque:
+            for name in self.indexed[cb]:
+                self._delete(cb, name)
+            for (name, count) in self.dynamic.get(cb, {}).items():
+                self._delete(cb, name, count)
+        self.indexed.pop(cb, None)
+        self.opaque.discard(cb)
+        self.refreshers.discard(cb)
+
+    def add(self, cb, command):
+        """Adds a command (a string or a list of words) of the given
+        plugin."""
+        name = self._split(command)
+        with self.lock:
+            names = self.dynamic.setdefault(cb, {})
+            names[name] = names.get(name, 0) + 1
+            if cb in self.indexed and cb not in self.opaque:
+                self._insert(cb, name)
+
+    def remove(self, cb, command):
+        """Removes a command previously added with add()."""
+        name = self._split(command)
+        with self.lock:
+            names = self.dynamic.get(cb, {})
+            if name not in names:
+                return
+            names[name] -= 1
+            if not names[name]:
+                del names[name]
+            if cb in self.indexed and cb not in self.opaque:
+                self._delete(cb, name)
+
+    def reindex(self, cb):
+        """Indexes the given plugin again the next time it is seen."""
+        with self.lock:
+            self._unindex(cb)
+
+    def forget(self, cb):
+        """Removes the given plugin from the index."""
+        with self.lock:
+            self._unindex(cb)
+            self.dynamic.pop(cb, None)
+
+    def clear(self):
+        """Indexes all plugins again the next time they are seen."""
+        with self.lock:
+            self.root = ({}, {})
+            self.indexed.clear()
+            self.opaque.clear()
+            self.refreshers.clear()
+
+    def candidates(self, callbacks, args):
+        """Returns the set of the callbacks which may have a command that
+        is a prefix of args, which must already be canonical."""
+        with self.lock:
+            for cb in callbacks:
+                if cb not in self.indexed:
+                    self._index(cb)
+            refreshers = list(self.refreshers)
+        for cb in refreshers:
+            cb.refreshCommandIndex()
+        with self.lock:
+            candidates = set(self.opaque)
+            node = self.root
+            for word in args:
+                node = node[1].get(word)
+                if node is None:
+                    break
+                candidates.update(node[0])
+            return candidates
+
+commandIndex = CommandIndex()
 
 class BasePlugin(object):
     def __init__(self, *args, **kwargs):
@@ -1178,6 +1510,9 @@ class Commands(BasePlugin, SynchronizedAndFirewalled):
     __firewalled__ = {'isCommand': None,
                       '_callCommand': None}
     commandArgs = ['self', 'irc', 'msg', 'args']
+    # Set by plugins which have commands that are not methods, and which keep
+    # commandIndex up to date with them.
+    dynamicCommands = False
     # These must be class-scope, so all plugins use the same one.
     _disabled = DisabledCommands()
     pre_command_callbacks = []
@@ -1355,6 +1690,7 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
         self.log = log.getPluginLogger(myName)
         self.__parent = super(PluginMixin, self)
         self.__parent.__init__(irc)
+        self._registryAccessors = {}
         # We can't do this because of the specialness that Owner and Misc do.
         # I guess plugin authors will have to get the capitalization right.
         # self.callAfter = map(str.lower, self.callAfter)
@@ -1377,18 +1713,26 @@ class PluginMixin(BasePlugin, irclib.IrcCallback):
         else:
             self.__parent.__call__(irc, msg)
 
+    def die(self):
+        commandIndex.forget(self)
+        self.__parent.die()
+
     def registryValue(self, name, channel=None, value=True):
-        plugin = self.name()
-        group = conf.supybot.plugins.get(plugin)
-        names = registry.split(name)
-        for name in names:
-            group = group.get(name)
+        try:
+            accessor = self._registryAccessors[name]
+        except KeyError:
+            names = [self.name()] + registry.split(name)
+            accessor = registry.Accessor(conf.supybot.plugins, names)
+            self._registryAccessors[name] = accessor
         if channel is not None:
             if ircutils.isChannel(channel):
-                group = group.get(channel)
+                group = accessor.get(channel)
             else:
-                self.log.debug('%s: registryValue got channel=%r', plugin,
-                               channel)
+                self.log.debug('%s: registryValue got channel=%r',
+                               self.name(), channel)
+                group = accessor.get()
+        else:
+            group = accessor.get()
         if value:
             return group()
         else:
@@ -32,6 +32,7 @@
 Includes wrappers for commands.
 """
 
+import os
 import time
 import getopt
 import inspect
@@ -57,13 +58,13 @@ _ = PluginInternationalization()
 # Thread has to be a non-arg wrapper because by the time we're parsing and
 # validating arguments, we're inside the function we'd want to thread.
 def thread(f):
-    """Makes sure a command spawns a thread when called."""
+    """Makes sure a command runs in a thread (of callbacks.commandPool) when
+    called."""
     def newf(self, irc, msg, args, *L, **kwargs):
         if world.isMainThread():
             targetArgs = (self.callingCommand, irc, msg, args) + tuple(L)
-            t = callbacks.CommandThread(target=self._callCommand,
-                                        args=targetArgs, kwargs=kwargs)
-            t.start()
+            callbacks.commandPool.submit(self.name(), self._callCommand,
+                                         targetArgs, kwargs)
         else:
             f(self, irc, msg, args, *L, **kwargs)
     return utils.python.changeFunctionName(newf, f.__name__, f.__doc__)
@@ -72,29 +73,13 @@ class ProcessTimeoutError(Exception):
     """Gets raised when a process is killed due to timeout."""
     pass
 
-def process(f, *args, **kwargs):
-    """Runs a function <f> in a subprocess.
-    
-    Several extra keyword arguments can be supplied. 
-    <pn>, the pluginname, and <cn>, the command name, are strings used to
-    create the process name, for identification purposes.
-    <timeout>, if supplied, limits the length of execution of target 
-    function to <timeout> seconds.
-    <heap_size>, if supplied, limits the memory used by the target
-    function."""
-    timeout = kwargs.pop('timeout', None)
-    heap_size = kwargs.pop('heap_size', None)
+def _runInNewProcess(f, args, kwargs, timeout, heap_size):
+    """Runs a function <f> in a subprocess spawned for this sole call, and
+    returns its result (or raises its exception).  This is what process()
+    falls back to when <f> or its arguments cannot be sent to a worker of
+    the process pool."""
     if resource and heap_size is None:
         heap_size = resource.RLIM_INFINITY
-
-    if world.disableMultiprocessing:
-        pn = kwargs.pop('pn', 'Unknown')
-        cn = kwargs.pop('cn', 'unknown')
-        try:
-            return f(*args, **kwargs)
-        except Exception as e:
-            raise e
-    
     try:
         q = multiprocessing.Queue()
     except OSError:
@@ -135,24 +120,332 @@ def process(f, *args, **kwargs):
     else:
         return v
 
+def _workerMain(conn, parentPid):
+    """Main loop of the worker processes of a ProcessPool: receives
+    (function, args, kwargs, heap_size) tuples, and sends back
+    (succeeded, return value or exception) pairs."""
+    while True:
+        try:
+            while not conn.poll(60):
+                if os.getppid() != parentPid:
+                    return # Orphaned.
+            task = conn.recv()
+        except (EOFError, IOError, KeyboardInterrupt):
+            return
+        if task is None:
+            return
+        (f, args, kwargs, heap_size) = task
+        limits = None
+        try:
+            if resource and heap_size is not None:
+                rsrc = resource.RLIMIT_DATA
+                limits = resource.getrlimit(rsrc)
+                resource.setrlimit(rsrc, (heap_size, limits[1]))
+            result = (True, f(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        finally:
+            if limits is not None:
+                resource.setrlimit(rsrc, limits)
+        try:
+            try:
+                conn.send(result)
+            except (EOFError, IOError):
+                raise
+            except Exception as e:
+                # Unpicklable return value or exception.
+                conn.send((False, e))
+        except (EOFError, IOError):
+            return
+
+class _PoolTask(object):
+    __slots__ = ('f', 'args', 'kwargs', 'timeout', 'heap_size', 'name',
+                 'callback', 'errback')
+    def __init__(self, f, args, kwargs, timeout, heap_size, name,
+                 callback, errback):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.timeout = timeout
+        self.heap_size = heap_size
+        self.name = name
+        self.callback = callback
+        self.errback = errback
+
+class _PoolWorker(world.SupyThread):
+    """Thread owning one worker process of a ProcessPool.  It feeds tasks
+    to its process, enforces their timeout, replaces the process when it
+    is killed, and calls the callbacks of the tasks."""
+    def __init__(self, pool):
+        self.pool = pool
+        self.process = None
+        self.conn = None
+        name = 'Thread #%s (for the process pool)' % world.threadsSpawned
+        super(_PoolWorker, self).__init__(name=name)
+        self.setDaemon(True)
+
+    def _startProcess(self):
+        (self.conn, childConn) = multiprocessing.Pipe()
+        name = 'Process #%s (pooled worker)' % world.processesSpawned
+        self.process = world.SupyProcess(target=_workerMain,
+                                         args=(childConn, os.getpid()),
+                                         name=name)
+        self.process.daemon = True
+        self.process.start()
+        childConn.close()
+
+    def _killProcess(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.conn.close()
+        self.process = self.conn = None
+
+    def run(self):
+        while True:
+            task = self.pool.tasks.get()
+            if task is None:
+                self._killProcess()
+                return
+            with self.pool.lock:
+                self.pool.idle -= 1
+            try:
+                (succeeded, value) = self._runTask(task)
+                try:
+                    if succeeded:
+                        task.callback(value)
+                    else:
+                        task.errback(value)
+                except Exception:
+                    log.exception('Uncaught exception in callback of %s:',
+                                  task.name)
+            finally:
+                with self.pool.lock:
+                    self.pool.idle += 1
+
+    def _runTask(self, task):
+        if self.process is None or not self.process.is_alive():
+            self._killProcess()
+            self._startProcess()
+        try:
+            self.conn.send((task.f, task.args, task.kwargs, task.heap_size))
+        except Exception:
+            # Closures and other unpicklable objects cannot be sent to the
+            # worker; fork a process dedicated to this call, which inherits
+            # them.
+            with self.pool.lock:
+                self.pool.stats['unpicklable'] += 1
+            try:
+                return (True, _runInNewProcess(task.f, task.args, task.kwargs,
+                                               task.timeout, task.heap_size))
+            except Exception as e:
+                return (False, e)
+        if not self.conn.poll(task.timeout):
+            with self.pool.lock:
+                self.pool.stats['timeouts'] += 1
+            self._killProcess()
+            return (False, ProcessTimeoutError('%s aborted due to timeout.' %
+                                               (task.name,)))
+        try:
+            return self.conn.recv()
+        except (EOFError, IOError):
+            # The worker died (eg. it was killed by the OS).
+            self._killProcess()
+            return (True, None)
+
+class ProcessPool(object):
+    """A bounded pool of long-lived worker processes, used to run functions
+    which may take too much time or memory without forking a process for
+    every call.
+
+    Workers are spawned lazily, up to <size> (a callable, so the size can
+    be a registry value), and are replaced when they time out."""
+    def __init__(self, size):
+        self.size = size
+        self.tasks = minisix.queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = []
+        self.idle = 0
+        self.stats = {'submitted': 0, 'timeouts': 0, 'unpicklable': 0}
+
+    def submit(self, f, args=(), kwargs={}, timeout=None, heap_size=None,
+               name='Unknown', callback=None, errback=None):
+        """Runs <f> in a worker process.  Once it is done, <callback> is
+        called with its return value, or <errback> with the exception it
+        raised (ProcessTimeoutError if it ran for more than <timeout>
+        seconds).  Both are called from a thread of the pool."""
+        if callback is None:
+            callback = lambda v: None
+        if errback is None:
+            errback = lambda e: log.error('Exception in %s: %s', name,
+                                          utils.exnToString(e))
+        task = _PoolTask(f, args, kwargs, timeout, heap_size, name,
+                         callback, errback)
+        with self.lock:
+            self.stats['submitted'] += 1
+            queued = self.tasks.qsize() + 1
+            if self.idle < queued and len(self.workers) < self.size():
+                worker = _PoolWorker(self)
+                self.workers.append(worker)
+                self.idle += 1
+                worker.start()
+        self.tasks.put(task)
+
+    def close(self):
+        """Stops all workers once the pending tasks are done."""
+        with self.lock:
+            for worker in self.workers:
+                self.tasks.put(None)
+            self.workers = []
+            self.idle = 0
+
+processPool = ProcessPool(conf.supybot.commands.processes.poolSize)
+
+def _popProcessKwargs(kwargs):
+    timeout = kwargs.pop('timeout', None)
+    heap_size = kwargs.pop('heap_size', None)
+    pn = kwargs.pop('pn', 'Unknown')
+    cn = kwargs.pop('cn', 'unknown')
+    return (timeout, heap_size, '%s.%s' % (pn, cn))
+
+def processAsync(f, *args, **kwargs):
+    """Runs a function <f> in a sandboxed worker process, without waiting
+    for it to finish.
+
+    Accepts the same extra keyword arguments as process(), plus
+    <callback>, which will be called with the value returned by <f>, and
+    <errback>, which will be called with the exception it raised (or with
+    a ProcessTimeoutError).  They are called from the main loop, so
+    commands can reply from them, and must handle their own errors.
+
+    Commands should use this rather than process(), which makes them (and
+    the main loop, unless they are threaded) wait for <f>."""
+    callback = kwargs.pop('callback', None)
+    errback = kwargs.pop('errback', None)
+    (timeout, heap_size, name) = _popProcessKwargs(kwargs)
+    if callback is None:
+        callback = lambda v: None
+    if errback is None:
+        errback = lambda e: log.error('Exception in %s: %s', name,
+                                      utils.exnToString(e))
+    if world.disableMultiprocessing:
+        try:
+            v = f(*args, **kwargs)
+        except Exception as e:
+            errback(e)
+        else:
+            callback(v)
+        return
+    def inMainLoop(f):
+        return lambda v: callbacks.commandPool.callInMainLoop(f, v)
+    processPool.submit(f, args, kwargs, timeout=timeout, heap_size=heap_size,
+                       name=name, callback=inMainLoop(callback),
+                       errback=inMainLoop(errback))
+
+def process(f, *args, **kwargs):
+    """Runs a function <f> in a subprocess.
+    
+    Several extra keyword arguments can be supplied. 
+    <pn>, the pluginname, and <cn>, the command name, are strings used to
+    create the process name, for identification purposes.
+    <timeout>, if supplied, limits the length of execution of target 
+    function to <timeout> seconds.
+    <heap_size>, if supplied, limits the memory used by the target
+    function.
+
+    The function is run by a worker of the process pool, so <f>, its
+    arguments, and its return value should be picklable; otherwise, a
+    process is forked for this call only.  The caller waits for <f> to
+    return; see processAsync for a version that does not."""
+    (timeout, heap_size, name) = _popProcessKwargs(kwargs)
+
+    if world.disableMultiprocessing:
+        try:
+            return f(*args, **kwargs)
+        except Exception as e:
+            raise e
+
+    done = threading.Event()
+    result = []
+    def callback(v):
+        result.append((True, v))
+        done.set()
+    def errback(e):
+        result.append((False, e))
+        done.set()
+    processPool.submit(f, args, kwargs, timeout=timeout, heap_size=heap_size,
+                       name=name, callback=callback, errback=errback)
+    done.wait()
+    (succeeded, v) = result[0]
+    if succeeded:
+        return v
+    else:
+        raise v
+
+def _re_bool(s, reobj):
+    """Since we can't enqueue match objects into the multiprocessing queue,
+    we'll just wrap the function to return bools."""
+    if reobj.search(s) is not None:
+        return True
+    else:
+        return False
+
 def regexp_wrapper(s, reobj, timeout, plugin_name, fcn_name):
     '''A convenient wrapper to stuff regexp search queries through a subprocess.
     
     This is used because specially-crafted regexps can use exponential time
     and hang the bot.'''
-    def re_bool(s, reobj):
-        """Since we can't enqueue match objects into the multiprocessing queue,
-        we'll just wrap the function to return bools."""
-        if reobj.search(s) is not None:
-            return True
-        else:
-            return False
     try:
-        v = process(re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
+        v = process(_re_bool, s, reobj, timeout=timeout, pn=plugin_name, cn=fcn_name)
         return v
     except ProcessTimeoutError:
         return False
 
+def _re_filter(strings, reobjs):
+    """Returns the indexes of the strings matched by all the regexps."""
+    return [i for (i, s) in enumerate(strings)
+            if all(reobj.search(s) is not None for reobj in reobjs)]
+
+def regexp_filter_async(items, reobjs, timeout, plugin_name, fcn_name,
+                        callback, errback, key=None, limit=None):
+    '''Searches <items> for the ones matched by all the regexps in
+    <reobjs>, without waiting for the subprocess: the list of these items
+    (only the first <limit> ones, if it is given) is passed to <callback>,
+    or a ProcessTimeoutError to <errback> once <timeout> is exceeded.  Both
+    are called from the main loop, as with processAsync.
+
+    Unlike regexp_wrapper, items are sent to a subprocess in batches
+    (small at first, so the first matches come quickly), and <timeout> is
+    the time allowed for the whole search.  <key>, if supplied, returns the
+    string to search in an item.'''
+    if key is None:
+        key = lambda item: item
+    # Copy the items, as they will be iterated over from later iterations of
+    # the main loop.
+    items = list(items)
+    if not reobjs:
+        callback(items[:limit])
+        return
+    deadline = time.time() + timeout
+    matched = []
+    def searchBatch(start, size):
+        batch = items[start:start+size]
+        if not batch or (limit is not None and len(matched) >= limit):
+            callback(matched[:limit])
+            return
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            errback(ProcessTimeoutError('%s.%s aborted due to timeout.' %
+                                        (plugin_name, fcn_name)))
+            return
+        def batchCallback(indexes):
+            matched.extend(batch[i] for i in indexes)
+            searchBatch(start+size, min(size*2, 512))
+        processAsync(_re_filter, [key(item) for item in batch], reobjs,
+                     timeout=remaining, pn=plugin_name, cn=fcn_name,
+                     callback=batchCallback, errback=errback)
+    searchBatch(0, 16)
+
 class UrlSnarfThread(world.SupyThread):
     def __init__(self, *args, **kwargs):
         assert 'url' in kwargs
@@ -1125,7 +1418,8 @@ __all__ = [
     # Decorators.
     'urlSnarfer', 'thread',
     # Functions.
-    'wrap', 'process', 'regexp_wrapper',
+    'wrap', 'process', 'processAsync', 'regexp_wrapper',
+    'regexp_filter_async',
     # Stuff for testing.
     'Spec',
 ]
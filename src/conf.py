@@ -748,6 +748,23 @@ registerGlobalValue(supybot.commands.defaultPlugins, 'importantPlugins',
         know what you're doing, then also know that this set is
         case-sensitive.""")))
 
+registerGroup(supybot.commands, 'processes')
+registerGlobalValue(supybot.commands.processes, 'poolSize',
+    registry.PositiveInteger(2, _("""Determines how many worker processes
+    may be kept running to evaluate functions that could take too much time
+    or memory (such as regexps given by users), so that no process has to be
+    forked for every call.""")))
+
+registerGroup(supybot.commands, 'threads')
+registerGlobalValue(supybot.commands.threads, 'poolSize',
+    registry.PositiveInteger(10, _("""Determines how many threaded commands
+    may run at the same time.  The other ones wait for one of them to
+    finish.""")))
+registerGlobalValue(supybot.commands.threads, 'maximumPerPlugin',
+    registry.PositiveInteger(4, _("""Determines how many threaded commands
+    of the same plugin may run at the same time, so a plugin with slow
+    commands does not keep the commands of other plugins waiting.""")))
+
 # supybot.commands.disabled moved to callbacks for canonicalName.
 
 ###
@@ -804,14 +821,24 @@ registerGlobalValue(supybot.drivers, 'poll',
     driver should block waiting for input.""")))
 
 class ValidDriverModule(registry.OnlySomeStrings):
-    validStrings = ('default', 'Socket', 'Twisted')
+    validStrings = ('default', 'Socket', 'Selectors', 'Asyncio', 'Twisted')
 
 registerGlobalValue(supybot.drivers, 'module',
     ValidDriverModule('default', _("""Determines what driver module the 
     bot will use. The default is Socket which is simple and stable 
-    and supports SSL. Twisted doesn't work if the IRC server which 
+    and supports SSL. Selectors works like Socket, but waits for all
+    connections at once (using epoll or kqueue when available), which scales
+    better to many networks; it requires Python 3.4 or newer. Asyncio runs
+    the connections, the scheduled events and the HTTP server in an asyncio
+    event loop, which plugins can use too; it requires Python 3.5 or newer
+    (3.7 for STARTTLS). Twisted doesn't work if the IRC server which 
     you are connecting to has IPv6 (most of them do).""")))
 
+registerGlobalValue(supybot.drivers, 'receiveBufferSize',
+    registry.PositiveInteger(65536, _("""Determines how many bytes drivers
+    receive from the server at most at once.  It is also the initial size of
+    the buffer holding the lines that are not received entirely yet.""")))
+
 registerGlobalValue(supybot.drivers, 'maxReconnectWait',
     registry.PositiveFloat(300.0, _("""Determines the maximum time the bot will
     wait before attempting to reconnect to an IRC server.  The bot may, of
@@ -879,6 +906,9 @@ registerGlobalValue(supybot.directories.data, 'tmp',
 registerGlobalValue(supybot.directories.data, 'web',
     DataFilenameDirectory('web', _("""Determines what directory files of the
     web server (templates, custom images, ...) are put into.""")))
+registerGlobalValue(supybot.directories.data, 'http',
+    DataFilenameDirectory('http', _("""Determines what directory responses of
+    HTTP servers are cached into.""")))
 
 def _update_tmp():
     utils.file.AtomicFile.default.tmpDir = supybot.directories.data.tmp
@@ -1014,6 +1044,14 @@ registerChannelValue(supybot.databases.plugins.channelSpecific.link, 'allow',
     databases.  Do note that the bot needs to be restarted immediately after
     changing this variable or your db plugins may not work for your channel.
     """)))
+registerGlobalValue(supybot.databases.plugins, 'journal',
+    registry.Boolean(False, _("""Determines whether the channel/user databases
+    of plugins (such as Seen, ChannelStats, and Herald) will only append the
+    records that changed to a journal file when they are flushed, instead of
+    rewriting the whole database every time.  The journal is merged back into
+    the database, in the background, when it grows larger than the
+    database.  Plugins using these databases have to be reloaded after this
+    variable is changed.""")))
 
 
 class CDB(registry.Boolean):
@@ -1154,7 +1192,8 @@ registerGlobalValue(supybot.protocols.irc, 'maxHistoryLength',
 registerGlobalValue(supybot.protocols.irc, 'throttleTime',
     registry.Float(1.0, _("""A floating point number of seconds to throttle
     queued messages -- that is, messages will not be sent faster than once per
-    throttleTime seconds.""")))
+    throttleTime seconds, apart from the bursts allowed by
+    supybot.protocols.irc.queuing.rateLimit.burst.""")))
 
 registerGlobalValue(supybot.protocols.irc, 'ping',
     registry.Boolean(True, _("""Determines whether the bot will send PINGs to
@@ -1176,6 +1215,11 @@ registerGlobalValue(supybot.protocols.irc.queuing, 'duplicates',
     doing certain kinds of plugin hacking.""")))
 
 registerGroup(supybot.protocols.irc.queuing, 'rateLimit')
+registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'burst',
+    registry.PositiveInteger(1, _("""Determines how many queued messages the
+    bot may send at once after it has not sent any for a while; it then sends
+    one every supybot.protocols.irc.throttleTime seconds.  Most servers
+    tolerate a few, but disconnect clients that go over their limit.""")))
 registerGlobalValue(supybot.protocols.irc.queuing.rateLimit, 'join',
     registry.Float(0, _("""Determines how many seconds must elapse between
     JOINs sent to the server.""")))
@@ -1212,6 +1256,20 @@ registerGlobalValue(supybot.protocols.http, 'proxy',
     through.  The value should be of the form 'host:port'.""")))
 utils.web.proxy = supybot.protocols.http.proxy
 
+registerGroup(supybot.protocols.http, 'cache')
+registerGlobalValue(supybot.protocols.http.cache, 'memorySize',
+    registry.NonNegativeInteger(100, _("""Determines how many HTTP responses
+    the bot keeps in memory, to reuse them for as long as the servers allow
+    it.  0 disables this cache.""")))
+registerGlobalValue(supybot.protocols.http.cache, 'diskSize',
+    registry.NonNegativeInteger(0, _("""Determines how many HTTP responses
+    the bot keeps in supybot.directories.data.http, so they can also be reused
+    after a restart.  Responses may be up to 1MB each.  0 disables this
+    cache.""")))
+utils.web.client.cache.memorySize = supybot.protocols.http.cache.memorySize
+utils.web.client.cache.diskSize = supybot.protocols.http.cache.diskSize
+utils.web.client.cache.directory = supybot.directories.data.http
+
 ###
 # supybot.protocols.ssl
 ###
@@ -1253,6 +1311,18 @@ registerGlobalValue(supybot.servers.http, 'keepAlive',
     registry.Boolean(False, _("""Determines whether the server will stay
     alive if no plugin is using it. This also means that the server will
     start even if it is not used.""")))
+registerGlobalValue(supybot.servers.http, 'maximumWorkers',
+    registry.PositiveInteger(10, _("""Determines how many threads the HTTP
+    server may use to handle connections at once.  Connections wait while
+    they are all busy, and kept-alive connections are then closed after
+    their current request.""")))
+registerGlobalValue(supybot.servers.http, 'timeout',
+    registry.PositiveInteger(10, _("""Determines how many seconds the HTTP
+    server waits for a client to send or receive data, including the next
+    request on a kept-alive connection, before closing its connection.""")))
+registerGlobalValue(supybot.servers.http, 'gzip',
+    registry.Boolean(True, _("""Determines whether the HTTP server compresses
+    its text responses for the clients that support it.""")))
 registerGlobalValue(supybot.servers.http, 'favicon',
     registry.String('', _("""Determines the path of the file served as
     favicon to browsers.""")))
@@ -1294,6 +1364,27 @@ registerGlobalValue(supybot, 'pidFile',
     the default) then no PID file will be written.  A restart is required for
     changes to this variable to take effect.""")))
 
+###
+# supybot.performance
+###
+registerGroup(supybot, 'performance')
+registerGroup(supybot.performance, 'cacheSizes')
+registerGlobalValue(supybot.performance.cacheSizes, 'hostmaskPatterns',
+    registry.PositiveInteger(1000, _("""Determines how many hostmask patterns
+    (from bans, ignores and user hostmasks) the bot keeps compiled.  When
+    there are more, the least recently used ones are dropped and compiled
+    again when they are needed.""")))
+registerGlobalValue(supybot.performance.cacheSizes, 'hostmaskMatches',
+    registry.PositiveInteger(1000, _("""Determines how many results of
+    matching a hostmask against a hostmask pattern the bot remembers.""")))
+registerGlobalValue(supybot.performance.cacheSizes, 'users',
+    registry.PositiveInteger(1000, _("""Determines how many user names and
+    hostmasks the bot remembers the user of, so it does not have to look them
+    up in the user database again.""")))
+ircutils._patternCache.max = supybot.performance.cacheSizes.hostmaskPatterns
+ircutils._hostmaskPatternEqualCache.max = \
+        supybot.performance.cacheSizes.hostmaskMatches
+
 ###
 # Debugging options.
 ###
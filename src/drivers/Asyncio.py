@@ -0,0 +1,494 @@
+###
+# Copyright (c) 2026, The Limnoria contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+"""
+Driver running the IRC connections as protocols of an asyncio event loop.
+
+The loop is also the current event loop of the main thread, so plugins can
+use it (through asyncio.get_event_loop()) to run non-blocking tasks, and the
+events of supybot.schedule run as timers of this loop.
+"""
+
+from __future__ import division
+
+import os
+import time
+import asyncio
+import functools
+
+from .. import conf, drivers, schedule, utils, world
+
+try:
+    import ssl
+except ImportError:
+    drivers.log.debug('ssl module is not available, '
+                      'cannot connect to SSL servers.')
+    ssl = None
+
+
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+def _callAt(when, f, *args):
+    """Like loop.call_at, but with a time.time() timestamp."""
+    return loop.call_later(max(0, when - time.time()), f, *args)
+
+def _openSocket(host, port, socks_proxy, attempt):
+    """Returns a socket and the address to connect it to, or a connected
+    socket and None if it goes through a SOCKS proxy.  This blocks, so it is
+    run in the executor of the loop."""
+    if socks_proxy:
+        address = host
+    else:
+        address = utils.net.getAddressFromHostname(host, attempt=attempt)
+    conn = utils.net.getSocket(address, port=port,
+            socks_proxy=socks_proxy,
+            vhost=conf.supybot.protocols.irc.vhost(),
+            vhostv6=conf.supybot.protocols.irc.vhostv6(),
+            )
+    if socks_proxy:
+        conn.settimeout(max(10, conf.supybot.drivers.poll()*10))
+        try:
+            conn.connect((address, port))
+        except:
+            conn.close()
+            raise
+        return (conn, None)
+    else:
+        return (conn, address)
+
+
+class AsyncioRunnerDriver(drivers.IrcDriver):
+    """Runs the loop for supybot.drivers.poll seconds at a time, so the other
+    drivers still run, and keeps a timer of the loop set to the time of the
+    next scheduled event."""
+    def __init__(self):
+        self.timer = None
+        self.timerTime = None
+        super(AsyncioRunnerDriver, self).__init__()
+        schedule.schedule.wakeup = self._wakeup
+        self._setTimer()
+
+    def name(self):
+        return self.__class__.__name__
+
+    def run(self):
+        handle = loop.call_later(conf.supybot.drivers.poll(), loop.stop)
+        try:
+            loop.run_forever()
+        finally:
+            handle.cancel()
+
+    def _wakeup(self, t):
+        timerTime = self.timerTime
+        if timerTime is None or t < timerTime:
+            loop.call_soon_threadsafe(self._setTimer)
+
+    def _setTimer(self):
+        t = schedule.nextEventTime()
+        if t == self.timerTime:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timerTime = t
+        if t is None:
+            self.timer = None
+        else:
+            self.timer = _callAt(t, self._runSchedule)
+
+    def _runSchedule(self):
+        self.timer = self.timerTime = None
+        schedule.run()
+        self._setTimer()
+
+    def die(self):
+        if schedule.schedule.wakeup == self._wakeup:
+            schedule.schedule.wakeup = None
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = self.timerTime = None
+        super(AsyncioRunnerDriver, self).die()
+
+
+class IrcProtocol(asyncio.Protocol):
+    """A single connection of an AsyncioDriver."""
+    def __init__(self, driver):
+        self.driver = driver
+        self.transport = None
+        self.inbuffer = driver.inbuffer
+        self.inbuffer.clear()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        driver = self.driver
+        if driver.protocol is not self:
+            return
+        self.inbuffer.feed(data)
+        for line in self.inbuffer.readLines():
+            if driver.protocol is not self:
+                # We were disconnected by one of these lines.
+                return
+            msg = drivers.parseMsg(line)
+            if msg is not None and driver.irc is not None:
+                driver.irc.feedMsg(msg)
+        if driver.protocol is self:
+            driver._sendIfMsgs()
+
+    def connection_lost(self, exc):
+        self.driver._connectionLost(self, exc)
+
+
+class AsyncioDriver(drivers.IrcDriver, drivers.ServersMixin):
+    _instances = []
+    _runner = None
+
+    def __init__(self, irc):
+        assert irc is not None
+        cls = self.__class__
+        if cls._runner is None:
+            cls._runner = AsyncioRunnerDriver()
+        self._instances.append(self)
+        self.irc = irc
+        drivers.IrcDriver.__init__(self, irc)
+        drivers.ServersMixin.__init__(self, irc)
+        self.protocol = None
+        self.inbuffer = drivers.LineBuffer()
+        self.connecting = None
+        self.reconnectTimer = None
+        self.sendTimer = None
+        self._attempt = -1
+        self.servers = ()
+        self.zombie = False
+        self.connected = False
+        self.startingTls = False
+        self.resetDelay()
+        if self.networkGroup.get('ssl').value and ssl is None:
+            drivers.log.error('The Asyncio driver can not connect to SSL '
+                              'servers without the ssl module.')
+            self.ssl = False
+        else:
+            self.ssl = self.networkGroup.get('ssl').value
+            self.connect()
+
+    def getDelay(self):
+        ret = self.currentDelay
+        self.currentDelay = min(self.currentDelay * 2,
+                                conf.supybot.drivers.maxReconnectWait())
+        return ret
+
+    def resetDelay(self):
+        self.currentDelay = 10.0
+
+    def _getNextServer(self):
+        oldServer = getattr(self, 'currentServer', None)
+        server = drivers.ServersMixin._getNextServer(self)
+        if self.currentServer != oldServer:
+            self.resetDelay()
+        return server
+
+    def _getSslContext(self):
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        certfile = network_config.certfile()
+        if not certfile:
+            certfile = conf.supybot.protocols.irc.certfile()
+        if not certfile:
+            certfile = None
+        elif not os.path.isfile(certfile):
+            drivers.log.warning('Could not find cert file %s.' %
+                    certfile)
+            certfile = None
+        verifyCertificates = conf.supybot.protocols.ssl.verifyCertificates()
+        if not verifyCertificates:
+            drivers.log.warning('Not checking SSL certificates, connections '
+                    'are vulnerable to man-in-the-middle attacks. Set '
+                    'supybot.protocols.ssl.verifyCertificates to "true" '
+                    'to enable validity checks.')
+        return utils.net.ssl_context(certfile=certfile,
+                verify=verifyCertificates,
+                trusted_fingerprints=network_config.ssl.serverFingerprints(),
+                ca_file=network_config.ssl.authorityCertificate(),
+                )
+
+    def _checkFingerprint(self, transport):
+        """Returns whether the certificate of the server is trusted, for
+        connections that were not checked by the SSL context."""
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        fingerprints = network_config.ssl.serverFingerprints()
+        if not fingerprints or \
+                not conf.supybot.protocols.ssl.verifyCertificates():
+            return True
+        try:
+            utils.net.check_certificate_fingerprint(
+                    transport.get_extra_info('ssl_object'), fingerprints)
+        except ssl.CertificateError as e:
+            drivers.log.error(('Certificate validation failed when '
+                'connecting to %s: %s\n'
+                'This means either someone is doing a man-in-the-middle '
+                'attack on your connection, or the server\'s certificate is '
+                'not in your trusted fingerprints list.')
+                % (self.irc.network, e.args[0]))
+            return False
+        return True
+
+    def connect(self, **kwargs):
+        self.reconnect(reset=False, **kwargs)
+
+    def reconnect(self, wait=False, reset=True):
+        self._attempt += 1
+        self._cancelConnection()
+        if self.protocol is not None:
+            drivers.log.reconnect(self.irc.network)
+            self._closeConnection()
+        if reset:
+            drivers.log.debug('Resetting %s.', self.irc)
+            self.irc.reset()
+        else:
+            drivers.log.debug('Not resetting %s.', self.irc)
+        if wait:
+            self.scheduleReconnect()
+            return
+        self.server = self._getNextServer()
+        network_config = getattr(conf.supybot.networks, self.irc.network)
+        socks_proxy = network_config.socksproxy()
+        try:
+            if socks_proxy:
+                import socks
+        except ImportError:
+            drivers.log.error('Cannot use socks proxy (SocksiPy not '
+                    'installed), using direct connection instead.')
+            socks_proxy = ''
+        sslContext = None
+        if network_config.ssl():
+            sslContext = self._getSslContext()
+        elif not network_config.requireStarttls():
+            drivers.log.warning(('Connection to network %s '
+                'does not use SSL/TLS, which makes it vulnerable to '
+                'man-in-the-middle attacks and passive eavesdropping. '
+                'You should consider upgrading your connection to SSL/TLS '
+                '<http://doc.supybot.aperio.fr/en/latest/use/faq.html#how-to-make-a-connection-secure>')
+                % self.irc.network)
+        drivers.log.connect(self.currentServer)
+        self.protocol = IrcProtocol(self)
+        self.connecting = asyncio.ensure_future(asyncio.wait_for(
+            self._connect(self.protocol, self.server, socks_proxy, sslContext),
+            max(10, conf.supybot.drivers.poll()*10), loop=loop), loop=loop)
+        self.connecting.add_done_callback(
+                functools.partial(self._connected, self.protocol))
+
+    async def _connect(self, protocol, server, socks_proxy, sslContext):
+        (host, port) = server
+        (conn, address) = await loop.run_in_executor(None, _openSocket,
+                host, port, socks_proxy, self._attempt)
+        try:
+            if address is not None:
+                conn.setblocking(False)
+                await loop.sock_connect(conn, (address, port))
+            if sslContext is None:
+                kwargs = {}
+            else:
+                kwargs = {'ssl': sslContext, 'server_hostname': host}
+            await loop.create_connection(lambda: protocol, sock=conn,
+                    **kwargs)
+        except:
+            conn.close()
+            raise
+
+    def _connected(self, protocol, future):
+        if future.cancelled():
+            return
+        if protocol is not self.protocol:
+            if future.exception() is None and protocol.transport is not None:
+                protocol.transport.abort()
+            return
+        self.connecting = None
+        e = future.exception()
+        if e is not None:
+            drivers.log.connectError(self.currentServer, e)
+            self.protocol = None
+            self.scheduleReconnect()
+            return
+        if self.ssl and not self._checkFingerprint(protocol.transport):
+            self._closeConnection()
+            self.scheduleReconnect()
+            return
+        self.connected = True
+        self.resetDelay()
+        self._sendIfMsgs()
+
+    def _connectionLost(self, protocol, e):
+        if protocol is not self.protocol:
+            return
+        drivers.log.disconnect(self.currentServer, e)
+        self.protocol = None
+        self.connected = False
+        self.startingTls = False
+        self._cancelSendTimer()
+        if not self.zombie:
+            self.scheduleReconnect()
+
+    def _cancelConnection(self):
+        if self.reconnectTimer is not None:
+            self.reconnectTimer.cancel()
+            self.reconnectTimer = None
+        if self.connecting is not None:
+            self.connecting.cancel()
+            self.connecting = None
+
+    def _cancelSendTimer(self):
+        if self.sendTimer is not None:
+            self.sendTimer.cancel()
+            self.sendTimer = None
+
+    def _closeConnection(self):
+        """Closes the connection, after the data we already wrote to it is
+        sent."""
+        protocol = self.protocol
+        self.protocol = None
+        self.connected = False
+        self.startingTls = False
+        self._cancelSendTimer()
+        if protocol is not None and protocol.transport is not None:
+            protocol.transport.close()
+
+    def scheduleReconnect(self):
+        when = time.time() + self.getDelay()
+        if not world.dying:
+            drivers.log.reconnect(self.irc.network, when)
+        if self.reconnectTimer is not None:
+            drivers.log.error('Updating next reconnect time when one is '
+                              'already present.  This is a bug; please '
+                              'report it, with an explanation of what caused '
+                              'this to happen.')
+            self.reconnectTimer.cancel()
+        self.reconnectTimer = _callAt(when, self._reconnectFromTimer)
+
+    def _reconnectFromTimer(self):
+        self.reconnectTimer = None
+        self.reconnect()
+
+    def _nextSendTime(self):
+        """Returns when Irc.takeMsg may return something, even if we do not
+        receive anything until then."""
+        irc = self.irc
+        times = []
+        if irc.queue:
+            times.append(irc.nextTakeTime())
+        if irc.afterConnect and conf.supybot.protocols.irc.ping():
+            times.append(irc.lastping +
+                         conf.supybot.protocols.irc.ping.interval())
+        if times:
+            return min(times)
+        else:
+            return None
+
+    def _sendIfMsgs(self):
+        if not self.connected or self.startingTls:
+            return
+        self._cancelSendTimer()
+        if not self.zombie:
+            msgs = [self.irc.takeMsg()]
+            while msgs[-1] is not None:
+                msgs.append(self.irc.takeMsg())
+            del msgs[-1]
+            if msgs and self.protocol is not None:
+                self.protocol.transport.write(''.join(map(str, msgs)).encode())
+        if self.zombie:
+            self._reallyDie()
+        elif self.connected and self.irc is not None:
+            when = self._nextSendTime()
+            if when is not None:
+                self.sendTimer = _callAt(when, self._sendIfMsgs)
+
+    def run(self):
+        # Messages queued by other threads than the loop's are sent here;
+        # the others are sent as soon as they are queued or the throttling
+        # allows it.
+        self._sendIfMsgs()
+
+    def starttls(self):
+        protocol = self.protocol
+        if protocol is None or protocol.transport is None:
+            return
+        if not hasattr(loop, 'start_tls'):
+            drivers.log.error('STARTTLS needs Python 3.7 or newer with the '
+                              'Asyncio driver.')
+            self._closeConnection()
+            self.scheduleReconnect()
+            return
+        self.startingTls = True
+        future = asyncio.ensure_future(loop.start_tls(protocol.transport,
+            protocol, self._getSslContext(), server_hostname=self.server[0]),
+            loop=loop)
+        future.add_done_callback(
+                functools.partial(self._tlsStarted, protocol))
+
+    def _tlsStarted(self, protocol, future):
+        if future.cancelled() or protocol is not self.protocol:
+            return
+        e = future.exception()
+        if e is not None:
+            drivers.log.error('Could not start TLS on %s: %s',
+                              self.currentServer, utils.exnToString(e))
+            self._closeConnection()
+            self.scheduleReconnect()
+            return
+        protocol.transport = future.result()
+        if not self._checkFingerprint(protocol.transport):
+            self._closeConnection()
+            self.scheduleReconnect()
+            return
+        self.startingTls = False
+        self._sendIfMsgs()
+
+    def die(self):
+        self.zombie = True
+        self._cancelConnection()
+        drivers.log.die(self.irc)
+
+    def _reallyDie(self):
+        self._cancelConnection()
+        self._closeConnection()
+        if self in self._instances:
+            self._instances.remove(self)
+        cls = self.__class__
+        if not self._instances and cls._runner is not None:
+            cls._runner.die()
+            cls._runner = None
+        drivers.IrcDriver.die(self)
+
+    def name(self):
+        return '%s(%s)' % (self.__class__.__name__, self.irc)
+
+
+Driver = AsyncioDriver
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
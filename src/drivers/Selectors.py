@@ -0,0 +1,210 @@
+###
+# Copyright (c) 2026, The Limnoria contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+"""
+Socket driver using a single selector (epoll, kqueue, ...) for all the
+connections, instead of calling select() once per connection.
+"""
+
+from __future__ import division
+
+import time
+import selectors
+
+from .. import conf, drivers, schedule
+from . import Socket
+
+
+class SelectorsRunnerDriver(drivers.IrcDriver):
+    """Waits for events on the sockets of all the SelectorsDriver instances,
+    until the next one of them needs to do something or the next scheduled
+    event is due."""
+    def __init__(self):
+        super(SelectorsRunnerDriver, self).__init__()
+        schedule.schedule.wakeup = SelectorsDriver._waker.wake
+
+    def name(self):
+        return self.__class__.__name__
+
+    def die(self):
+        if schedule.schedule.wakeup == SelectorsDriver._waker.wake:
+            schedule.schedule.wakeup = None
+        super(SelectorsRunnerDriver, self).die()
+
+    def run(self):
+        SelectorsDriver._poll()
+
+class SelectorsDriver(Socket.SocketDriver):
+    _instances = []
+    _drivers = set()
+    _selector = None
+    _runner = None
+    _waker = None
+
+    def __init__(self, irc):
+        cls = self.__class__
+        if cls._selector is None:
+            cls._selector = selectors.DefaultSelector()
+            cls._waker = drivers.Waker()
+            cls._selector.register(cls._waker, selectors.EVENT_READ, None)
+        if cls._runner is None:
+            cls._runner = SelectorsRunnerDriver()
+        self._drivers.add(self)
+        self._registeredConn = None
+        self._events = 0
+        super(SelectorsDriver, self).__init__(irc)
+
+    def _register(self):
+        """Starts watching the current connection."""
+        self._unregister()
+        self._selector.register(self.conn, selectors.EVENT_READ, self)
+        self._registeredConn = self.conn
+        self._events = selectors.EVENT_READ
+        self._updateEvents()
+
+    def _unregister(self):
+        if self._registeredConn is not None:
+            try:
+                self._selector.unregister(self._registeredConn)
+            except (KeyError, ValueError):
+                pass
+            self._registeredConn = None
+            self._events = 0
+
+    def _updateEvents(self):
+        """Watches the connection for writability only while there is data
+        that the kernel could not take yet."""
+        if self._registeredConn is None:
+            return
+        events = selectors.EVENT_READ
+        if self.outbuffer:
+            events |= selectors.EVENT_WRITE
+        if events != self._events:
+            self._selector.modify(self._registeredConn, events, self)
+            self._events = events
+
+    def _nextDeadline(self):
+        """Returns the time at which this driver needs to run next without
+        waiting for its socket, or None."""
+        deadlines = [t for t in (self.nextReconnectTime, self.writeCheckTime)
+                     if t is not None]
+        irc = self.irc
+        if self.connected and not self.zombie and irc is not None:
+            if irc.fastqueue:
+                return 0
+            if irc.queue:
+                deadlines.append(irc.nextTakeTime())
+            if irc.afterConnect and conf.supybot.protocols.irc.ping():
+                interval = conf.supybot.protocols.irc.ping.interval()
+                deadlines.append(irc.lastping + interval)
+        if deadlines:
+            return min(deadlines)
+        else:
+            return None
+
+    @classmethod
+    def _getTimeout(cls):
+        """Returns how long the selector may block.  This is never more than
+        supybot.drivers.poll, because messages queued by other threads do not
+        wake it up (unlike scheduled events)."""
+        deadlines = [d._nextDeadline() for d in cls._drivers]
+        deadlines.append(schedule.nextEventTime())
+        deadlines = [t for t in deadlines if t is not None]
+        timeout = conf.supybot.drivers.poll()
+        if deadlines:
+            timeout = min(timeout, min(deadlines) - time.time())
+        return max(0, timeout)
+
+    @classmethod
+    def _poll(cls):
+        timeout = cls._getTimeout()
+        for (key, mask) in cls._selector.select(timeout):
+            driver = key.data
+            if driver is None:
+                cls._waker.clear()
+                continue
+            if mask & selectors.EVENT_READ:
+                driver._read()
+                # SSL sockets may hold decrypted data the selector does not
+                # know about.
+                while driver._registeredConn is key.fileobj and \
+                        getattr(driver.conn, 'pending', lambda: 0)():
+                    driver._read()
+            if mask & selectors.EVENT_WRITE and \
+                    driver._registeredConn is key.fileobj:
+                driver._sendIfMsgs(writable=True)
+
+    def _sendIfMsgs(self, writable=False):
+        super(SelectorsDriver, self)._sendIfMsgs(writable)
+        self._updateEvents()
+
+    def _handleSocketError(self, e):
+        super(SelectorsDriver, self)._handleSocketError(e)
+        if not self.connected:
+            self._unregister()
+
+    def run(self):
+        now = time.time()
+        if self.nextReconnectTime is not None and now > self.nextReconnectTime:
+            self.reconnect()
+        elif self.writeCheckTime is not None and now > self.writeCheckTime:
+            self._checkAndWriteOrReconnect()
+        # Unlike SocketDriver, we don't sleep when disconnected, and the
+        # socket is watched by SelectorsRunnerDriver.
+        if self.connected:
+            self._sendIfMsgs()
+
+    def reconnect(self, wait=False, reset=True):
+        self._unregister()
+        super(SelectorsDriver, self).reconnect(wait=wait, reset=reset)
+        if self.connected:
+            self._register()
+
+    def _checkAndWriteOrReconnect(self):
+        super(SelectorsDriver, self)._checkAndWriteOrReconnect()
+        if self.connected and self._registeredConn is None:
+            self._register()
+
+    def die(self):
+        self._unregister()
+        super(SelectorsDriver, self).die()
+
+    def _reallyDie(self):
+        self._unregister()
+        self._drivers.discard(self)
+        cls = self.__class__
+        if not self._drivers and cls._runner is not None:
+            cls._runner.die()
+            cls._runner = None
+        super(SelectorsDriver, self)._reallyDie()
+
+
+Driver = SelectorsDriver
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -40,9 +40,8 @@ import errno
 import select
 import socket
 
-from .. import (conf, drivers, log, utils, world)
+from .. import (conf, drivers, log, schedule, utils, world)
 from ..utils import minisix
-from ..utils.str import decode_raw_line
 
 try:
     import ssl
@@ -57,6 +56,9 @@ except:
 class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
     _instances = []
     _selecting = [False] # We want it to be mutable.
+    # Wakes up select() when an event is scheduled, eg. by a thread of the
+    # command pool which waits for the main loop.
+    _waker = None
     def __init__(self, irc):
         self._instances.append(self)
         assert irc is not None
@@ -67,8 +69,8 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
         self._attempt = -1
         self.servers = ()
         self.eagains = 0
-        self.inbuffer = b''
-        self.outbuffer = ''
+        self.inbuffer = drivers.LineBuffer()
+        self.outbuffer = drivers.SendBuffer()
         self.zombie = False
         self.connected = False
         self.writeCheckTime = None
@@ -117,22 +119,22 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
             log.debug('Got EAGAIN, current count: %s.', self.eagains)
             self.eagains += 1
 
-    def _sendIfMsgs(self):
+    def _sendIfMsgs(self, writable=False):
+        """Queues the messages the Irc object has for us, and sends them.
+        Once the kernel did not take all the data, the rest is only sent when
+        writable is true, ie. when the socket was reported writable."""
         if not self.connected:
             return
+        waiting = bool(self.outbuffer)
         if not self.zombie:
             msgs = [self.irc.takeMsg()]
             while msgs[-1] is not None:
                 msgs.append(self.irc.takeMsg())
             del msgs[-1]
-            self.outbuffer += ''.join(map(str, msgs))
-        if self.outbuffer:
+            self.outbuffer.append(msgs)
+        if self.outbuffer and (writable or self.zombie or not waiting):
             try:
-                if minisix.PY2:
-                    sent = self.conn.send(self.outbuffer)
-                else:
-                    sent = self.conn.send(self.outbuffer.encode())
-                self.outbuffer = self.outbuffer[sent:]
+                self.outbuffer.sendTo(self.conn)
                 self.eagains = 0
             except socket.error as e:
                 self._handleSocketError(e)
@@ -157,11 +159,25 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                     inst.reconnect()
             if not cls._instances:
                 return
-            rlist, wlist, xlist = select.select([x.conn for x in cls._instances],
-                    [], [], conf.supybot.drivers.poll())
-            for instance in cls._instances:
+            if cls._waker is None:
+                cls._waker = drivers.Waker()
+            if schedule.schedule.wakeup is None:
+                schedule.schedule.wakeup = cls._waker.wake
+            timeout = conf.supybot.drivers.poll()
+            nextEventTime = schedule.nextEventTime()
+            if nextEventTime is not None:
+                timeout = max(0, min(timeout, nextEventTime - time.time()))
+            rlist, wlist, xlist = select.select(
+                    [cls._waker] + [x.conn for x in cls._instances],
+                    [x.conn for x in cls._instances if x.outbuffer], [],
+                    timeout)
+            if cls._waker in rlist:
+                cls._waker.clear()
+            for instance in cls._instances[:]:
                 if instance.conn in rlist:
                     instance._read()
+                if instance.conn in wlist and instance.connected:
+                    instance._sendIfMsgs(writable=True)
         except select.error as e:
             if e.args[0] != errno.EINTR:
                 # 'Interrupted system call'
@@ -190,13 +206,9 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
     def _read(self):
         """Called by _select() when we can read data."""
         try:
-            self.inbuffer += self.conn.recv(1024)
+            self.inbuffer.recvInto(self.conn)
             self.eagains = 0 # If we successfully recv'ed, we can reset this.
-            lines = self.inbuffer.split(b'\n')
-            self.inbuffer = lines.pop()
-            for line in lines:
-                line = decode_raw_line(line)
-
+            for line in self.inbuffer.readLines():
                 msg = drivers.parseMsg(line)
                 if msg is not None and self.irc is not None:
                     self.irc.feedMsg(msg)
@@ -230,6 +242,8 @@ class SocketDriver(drivers.IrcDriver, drivers.ServersMixin):
                 pass
             self.conn.close()
             self.connected = False
+        self.inbuffer.clear()
+        self.outbuffer.clear()
         if reset:
             drivers.log.debug('Resetting %s.', self.irc)
             self.irc.reset()
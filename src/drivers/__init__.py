@@ -32,10 +32,20 @@
 Contains various drivers (network, file, and otherwise) for using IRC objects.
 """
 
+import time
 import socket
+import itertools
+import threading
+import collections
 
 from .. import conf, ircmsgs, log as supylog, utils
 from ..utils import minisix
+from ..utils.str import decode_raw_line
+
+try:
+    memoryview
+except NameError: # Python 2.6
+    memoryview = None
 
 _drivers = {}
 _deadDrivers = set()
@@ -84,6 +94,250 @@ class ServersMixin(object):
         return server
 
 
+class RateCounter(object):
+    """Counts events, and how many happened per second over the last
+    interval seconds."""
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.total = 0
+        # [second, count] pairs, from the oldest second.
+        self.seconds = collections.deque()
+
+    def add(self, n=1):
+        self.total += n
+        now = int(time.time())
+        if self.seconds and self.seconds[-1][0] == now:
+            self.seconds[-1][1] += n
+        else:
+            self.seconds.append([now, n])
+            self._prune(now)
+
+    def _prune(self, now):
+        while self.seconds and self.seconds[0][0] <= now - self.interval:
+            self.seconds.popleft()
+
+    def rate(self):
+        self._prune(int(time.time()))
+        return sum(count for (second, count) in self.seconds) / \
+                float(self.interval)
+
+class LineBuffer(object):
+    """Splits the data received from a server into lines.
+
+    Data is received in a preallocated bytearray, in which only the new bytes
+    are searched for newlines; the complete lines are then decoded at once.
+    When the buffer is mostly full, the incomplete line at its end is moved
+    to its beginning, or the buffer grows if that line fills most of it."""
+    def __init__(self, size=None):
+        if size is None:
+            size = conf.supybot.drivers.receiveBufferSize()
+        self._setBuffer(bytearray(size))
+        # The received data is self.buffer[self.start:self.end]; it has no
+        # newline before self.scanned.
+        self.start = self.end = self.scanned = 0
+        self.bytes = RateCounter()
+        self.lines = RateCounter()
+
+    def clear(self):
+        self.start = self.end = self.scanned = 0
+
+    def _setBuffer(self, buffer):
+        self.buffer = buffer
+        if memoryview is not None:
+            self.view = memoryview(buffer)
+        else:
+            self.view = None
+
+    def _reserve(self):
+        if self.end < len(self.buffer) * 3 // 4:
+            return
+        length = self.end - self.start
+        if self.start:
+            self.buffer[0:length] = self.buffer[self.start:self.end]
+        else:
+            # A bytearray can't be resized while it is viewed, so the data
+            # is copied to a larger one.
+            buffer = bytearray(len(self.buffer) * 2)
+            buffer[0:length] = self.buffer[0:length]
+            self._setBuffer(buffer)
+        self.scanned -= self.start
+        (self.start, self.end) = (0, length)
+
+    def recvInto(self, sock):
+        """Receives data from sock into the buffer, and returns how many
+        bytes were received."""
+        self._reserve()
+        if self.view is not None:
+            n = sock.recv_into(self.view[self.end:])
+        else:
+            data = sock.recv(len(self.buffer) - self.end)
+            n = len(data)
+            self.buffer[self.end:self.end+n] = data
+        self.end += n
+        self.bytes.add(n)
+        return n
+
+    def feed(self, data):
+        """Copies data (received by other means) into the buffer."""
+        self.bytes.add(len(data))
+        while data:
+            self._reserve()
+            n = min(len(data), len(self.buffer) - self.end)
+            self.buffer[self.end:self.end+n] = data[:n]
+            self.end += n
+            data = data[n:]
+
+    def readLines(self):
+        """Returns the decoded lines that were received entirely, and removes
+        them from the buffer."""
+        last = self.buffer.rfind(b'\n', self.scanned, self.end)
+        self.scanned = self.end
+        if last == -1:
+            return []
+        if self.view is not None:
+            data = self.view[self.start:last].tobytes()
+        else:
+            data = bytes(self.buffer[self.start:last])
+        self.start = last + 1
+        if self.start == self.end:
+            self.clear()
+        if minisix.PY2:
+            lines = data.split(b'\n')
+        else:
+            try:
+                lines = data.decode('utf8').split('\n')
+            except UnicodeError:
+                lines = list(map(decode_raw_line, data.split(b'\n')))
+        self.lines.add(len(lines))
+        return lines
+
+class SendBuffer(object):
+    """Holds the data waiting to be sent to a server.
+
+    Each message is encoded once, when it is queued, and kept as a chunk of
+    its own; as many chunks as the kernel takes are then sent by a single
+    sendmsg() call, without being copied together first.  For sockets which
+    can't do that (SSL sockets, and all sockets on Python 2), the chunks are
+    joined and sent with send()."""
+    maxChunks = 1024 # IOV_MAX on most systems.
+
+    def __init__(self):
+        self.chunks = collections.deque()
+        # Number of bytes of self.chunks[0] that were already sent.
+        self.offset = 0
+        self.length = 0
+        self.useSendmsg = True
+        self.queued = RateCounter()
+        self.sent = RateCounter()
+
+    def __len__(self):
+        return self.length
+
+    def clear(self):
+        self.chunks.clear()
+        self.offset = self.length = 0
+        self.useSendmsg = True
+
+    def append(self, msgs):
+        """Encodes msgs and queues them after the data already waiting."""
+        length = 0
+        for msg in msgs:
+            data = str(msg)
+            if not minisix.PY2:
+                data = data.encode()
+            self.chunks.append(data)
+            length += len(data)
+        if length:
+            self.length += length
+            self.queued.add(length)
+
+    def sendTo(self, sock):
+        """Sends as much of the buffer to sock as it takes, removes it from
+        the buffer, and returns how many bytes were sent."""
+        if not self.chunks:
+            return 0
+        sent = None
+        sendmsg = getattr(sock, 'sendmsg', None)
+        if self.useSendmsg and sendmsg is not None and memoryview is not None:
+            buffers = [memoryview(self.chunks[0])[self.offset:]]
+            buffers.extend(itertools.islice(self.chunks, 1, self.maxChunks))
+            try:
+                sent = sendmsg(buffers)
+            except NotImplementedError:
+                self.useSendmsg = False
+        if sent is None:
+            if len(self.chunks) > 1:
+                data = b''.join(self.chunks)
+                self.chunks.clear()
+                self.chunks.append(data)
+            if memoryview is None:
+                # Python 2.6
+                data = self.chunks[0][self.offset:]
+            else:
+                data = memoryview(self.chunks[0])[self.offset:]
+            sent = sock.send(data)
+        self._consume(sent)
+        self.sent.add(sent)
+        return sent
+
+    def _consume(self, n):
+        self.length -= n
+        n += self.offset
+        while self.chunks and n >= len(self.chunks[0]):
+            n -= len(self.chunks.popleft())
+        self.offset = n
+
+def _socketpair():
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    # Python 2 on Windows
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        a = socket.create_connection(listener.getsockname())
+        (b, _) = listener.accept()
+    finally:
+        listener.close()
+    return (b, a)
+
+class Waker(object):
+    """Lets other threads wake up a driver blocked in select(): the socket
+    given by fileno() becomes readable when wake() is called, until clear()
+    is.  wake() takes the time of an event, so it can be used as
+    schedule.wakeup."""
+    def __init__(self):
+        (self.reader, self.writer) = _socketpair()
+        self.reader.setblocking(False)
+        self.writer.setblocking(False)
+        self.lock = threading.Lock()
+        self.awake = False
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def wake(self, t=None):
+        with self.lock:
+            if self.awake:
+                return
+            self.awake = True
+        try:
+            self.writer.send(b'\0')
+        except socket.error:
+            pass
+
+    def clear(self):
+        """Called after the reader was reported readable.  Callers must then
+        look at what they were woken up for, eg. schedule.nextEventTime(),
+        as it may have been before the last call to clear()."""
+        try:
+            while self.reader.recv(4096):
+                pass
+        except socket.error:
+            pass
+        with self.lock:
+            self.awake = False
+
 def empty():
     """Returns whether or not the driver loop is empty."""
     return (len(_drivers) + len(_newDrivers)) == 0
@@ -33,7 +33,13 @@ An embedded and centralized HTTP server for Supybot's plugins.
 
 import os
 import cgi
+import sys
+import gzip
+import time
+import select
 import socket
+import threading
+import collections
 from threading import Thread
 
 import supybot.log as log
@@ -164,10 +170,26 @@ def get_template(filename):
         with open(path + '.example', 'r') as fd:
             return fd.read()
 
+class _HTTPWorker(world.SupyThread):
+    def __init__(self, server):
+        self.server = server
+        name = 'Thread #%s (for the HTTP server)' % world.threadsSpawned
+        super(_HTTPWorker, self).__init__(name=name)
+        self.setDaemon(True)
+
+    def run(self):
+        self.server._work()
+
 class RealSupyHTTPServer(HTTPServer):
+    """Accepts connections in the thread of serve_forever (or in the event
+    loop given to serve_in_loop), and handles them in a pool of at most
+    supybot.servers.http.maximumWorkers threads, so a slow client does not
+    block the other ones.  Connections wait in a queue while all the
+    workers are busy."""
     # TODO: make this configurable
     timeout = 0.5
     running = False
+    loop = None
 
     def __init__(self, address, protocol, callback):
         self.protocol = protocol
@@ -179,6 +201,64 @@ class RealSupyHTTPServer(HTTPServer):
             raise AssertionError(protocol)
         HTTPServer.__init__(self, address, callback)
         self.callbacks = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.connections = collections.deque() # Waiting for a worker.
+        self.workers = []
+        self.idle = 0
+        self.stopped = False
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.append((request, client_address))
+            if self.idle < len(self.connections) and \
+                    len(self.workers) < configGroup.maximumWorkers():
+                worker = _HTTPWorker(self)
+                self.workers.append(worker)
+                self.idle += 1
+                worker.start()
+            self.ready.notify()
+
+    def _work(self):
+        while True:
+            with self.lock:
+                while not self.connections and not self.stopped:
+                    self.ready.wait()
+                if self.stopped:
+                    return
+                (request, client_address) = self.connections.popleft()
+                self.idle -= 1
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                with self.lock:
+                    self.idle += 1
+
+    def hasWaitingConnections(self):
+        """Returns whether connections are waiting for a worker; kept-alive
+        connections are closed after their current request, or while they
+        wait for the next one, if so."""
+        return bool(self.connections)
+
+    def _stopWorkers(self):
+        with self.lock:
+            self.stopped = True
+            connections = list(self.connections)
+            self.connections.clear()
+            self.ready.notify_all()
+        for (request, client_address) in connections:
+            self.shutdown_request(request)
+
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], socket.error):
+            log.debug('HTTP connection from %s failed: %s',
+                      client_address[0], sys.exc_info()[1])
+        else:
+            log.exception('Uncaught exception while handling an HTTP request '
+                          'from %s:', client_address[0])
 
     def server_bind(self):
         if self.protocol == 6:
@@ -199,6 +279,21 @@ class RealSupyHTTPServer(HTTPServer):
         callback.doUnhook(self)
         return callback
 
+    def serve_in_loop(self, loop):
+        """Accepts connections from an asyncio event loop, instead of running
+        serve_forever in a thread.  They are still handled by the workers."""
+        self.loop = loop
+        loop.add_reader(self.fileno(), self._handle_request_noblock)
+
+    def shutdown(self):
+        if self.loop is None:
+            HTTPServer.shutdown(self)
+        else:
+            self.loop.remove_reader(self.fileno())
+            self.loop = None
+            self.server_close()
+        self._stopWorkers()
+
     def __str__(self):
         return 'server at %s %i' % self.server_address[0:2]
 
@@ -207,6 +302,8 @@ class TestSupyHTTPServer(RealSupyHTTPServer):
         self.callbacks = {}
     def serve_forever(self, *args, **kwargs):
         pass
+    def serve_in_loop(self, *args, **kwargs):
+        pass
     def shutdown(self, *args, **kwargs):
         pass
 
@@ -215,7 +312,149 @@ if world.testing:
 else:
     SupyHTTPServer = RealSupyHTTPServer
 
+def acceptsGzip(acceptEncoding):
+    """Returns whether the value of an Accept-Encoding header allows
+    gzip."""
+    for coding in (acceptEncoding or '').split(','):
+        (name, __, params) = coding.partition(';')
+        if name.strip().lower() in ('gzip', 'x-gzip'):
+            params = params.replace(' ', '')
+            return params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def isCompressible(contentType):
+    contentType = (contentType or '').split(';')[0].strip().lower()
+    return contentType.startswith('text/') or contentType in (
+        'application/json', 'application/javascript', 'application/xml',
+        'application/xhtml+xml', 'image/svg+xml')
+
 class SupyHTTPRequestHandler(BaseHTTPRequestHandler):
+    # Callbacks write their responses to a buffer (see do_X), so they are
+    # always sent with a Content-Length, which allows keeping connections
+    # alive.
+    protocol_version = 'HTTP/1.1'
+    # Otherwise, the body of a response waits for the client to acknowledge
+    # its headers, which delayed ACKs make take up to 200ms.
+    disable_nagle_algorithm = True
+    _buffering = False
+
+    # How often a kept-alive connection waiting for its next request checks
+    # whether other connections are waiting for a worker.
+    idlePollInterval = 0.1
+
+    def setup(self):
+        # Applies to every read and write on the connection, including the
+        # wait for the next request of a kept-alive connection.
+        self.timeout = configGroup.timeout()
+        BaseHTTPRequestHandler.setup(self)
+
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self._waitForRequest():
+            self.handle_one_request()
+
+    def _hasBufferedInput(self):
+        rbuf = getattr(self.rfile, '_rbuf', None)
+        if rbuf is not None:
+            # Python 2's socket._fileobject
+            return rbuf.tell() > 0
+        # Returns the buffered data, without blocking to read more.
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        except (socket.error, IOError):
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def _waitForRequest(self):
+        """Waits for the next request of a kept-alive connection, and
+        returns whether it came.  Gives up after
+        supybot.servers.http.timeout, or as soon as other connections are
+        waiting for a worker, so that idle connections do not hold the
+        workers."""
+        if self._hasBufferedInput():
+            return True
+        hasWaitingConnections = getattr(self.server,
+                                        'hasWaitingConnections', None)
+        deadline = time.time() + self.timeout
+        while True:
+            if hasWaitingConnections is not None and hasWaitingConnections():
+                return False
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            (readable, _, _) = select.select([self.connection], [], [],
+                    min(remaining, self.idlePollInterval))
+            if readable:
+                return True
+
+    def send_response(self, code, message=None):
+        if self._buffering:
+            self._status = (code, message)
+        else:
+            BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def send_header(self, keyword, value):
+        if self._buffering:
+            self._responseHeaders.append((keyword, str(value)))
+        else:
+            BaseHTTPRequestHandler.send_header(self, keyword, value)
+
+    def end_headers(self):
+        if not self._buffering:
+            BaseHTTPRequestHandler.end_headers(self)
+
+    def _getHeader(self, name):
+        for (keyword, value) in self._responseHeaders:
+            if keyword.lower() == name:
+                return value
+        return None
+
+    def _sendBufferedResponse(self):
+        (code, message) = self._status or (200, None)
+        headers = [(keyword, value) for (keyword, value)
+                   in self._responseHeaders
+                   if keyword.lower() not in ('content-length', 'connection')]
+        body = self._body.getvalue()
+        if self.command == 'HEAD':
+            # The callback did not write the body, so we can only trust the
+            # length it announced.
+            length = self._getHeader('content-length')
+        else:
+            length = None
+            if configGroup.gzip() and len(body) >= 256 and \
+                    self._getHeader('content-encoding') is None and \
+                    isCompressible(self._getHeader('content-type')) and \
+                    acceptsGzip(self.headers.get('Accept-Encoding')):
+                fd = minisix.io.BytesIO()
+                with gzip.GzipFile(fileobj=fd, mode='wb',
+                                   compresslevel=6) as gzipFile:
+                    gzipFile.write(body)
+                body = fd.getvalue()
+                headers.append(('Content-Encoding', 'gzip'))
+                headers.append(('Vary', 'Accept-Encoding'))
+        if length is None and code >= 200 and code not in (204, 304):
+            length = str(len(body))
+        if length is not None:
+            headers.append(('Content-Length', length))
+        hasWaitingConnections = getattr(self.server,
+                                        'hasWaitingConnections', None)
+        if hasWaitingConnections is not None and hasWaitingConnections():
+            self.close_connection = True
+        if self.close_connection:
+            headers.append(('Connection', 'close'))
+        self._sendResponse(code, message, headers, body)
+
+    def _sendResponse(self, code, message, headers, body):
+        BaseHTTPRequestHandler.send_response(self, code, message)
+        for (keyword, value) in headers:
+            BaseHTTPRequestHandler.send_header(self, keyword, value)
+        BaseHTTPRequestHandler.end_headers(self)
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
     def do_X(self, callbackMethod, *args, **kwargs):
         if self.path == '/':
             callback = SupyIndex()
@@ -232,16 +471,26 @@ class SupyHTTPRequestHandler(BaseHTTPRequestHandler):
             except KeyError:
                 callback = Supy404()
 
-        # Some shortcuts
-        for name in ('send_response', 'send_header', 'end_headers', 'rfile',
-                'wfile', 'headers'):
-            setattr(callback, name, getattr(self, name))
-        # We call doX, because this is more supybotic than do_X.
-        path = self.path
-        if not callback.fullpath:
-            path = '/' + path.split('/', 2)[-1]
-        getattr(callback, callbackMethod)(self, path,
-                *args, **kwargs)
+        self._status = None
+        self._responseHeaders = []
+        self._body = minisix.io.BytesIO()
+        wfile = self.wfile
+        self.wfile = self._body
+        self._buffering = True
+        # For the shortcuts of the callback.
+        _currentRequest.handler = self
+        try:
+            # We call doX, because this is more supybotic than do_X.
+            path = self.path
+            if not callback.fullpath:
+                path = '/' + path.split('/', 2)[-1]
+            getattr(callback, callbackMethod)(self, path,
+                    *args, **kwargs)
+        finally:
+            _currentRequest.handler = None
+            self._buffering = False
+            self.wfile = wfile
+        self._sendBufferedResponse()
 
     def do_GET(self):
         self.do_X('doGet')
@@ -278,6 +527,13 @@ class SupyHTTPRequestHandler(BaseHTTPRequestHandler):
         log.info('HTTP request: %s - %s' %
                 (self.address_string(), format % args))
 
+# Callbacks are shared by the workers of the server, so their shortcuts to
+# the request handler are looked up in the handler of the current thread.
+_currentRequest = threading.local()
+
+def _handlerShortcut(name):
+    return property(lambda self: getattr(_currentRequest.handler, name))
+
 class SupyHTTPServerCallback(log.Firewalled):
     """This is a base class that should be overriden by any plugin that want
     to have a Web interface."""
@@ -288,6 +544,13 @@ class SupyHTTPServerCallback(log.Firewalled):
                       'doDelete': None,
                      }
 
+    # Some shortcuts
+    send_response = _handlerShortcut('send_response')
+    send_header = _handlerShortcut('send_header')
+    end_headers = _handlerShortcut('end_headers')
+    rfile = _handlerShortcut('rfile')
+    wfile = _handlerShortcut('wfile')
+    headers = _handlerShortcut('headers')
 
     fullpath = False
     name = "Unnamed plugin"
@@ -429,6 +692,17 @@ class Favicon(SupyHTTPServerCallback):
 
 http_servers = []
 
+def getEventLoop():
+    """Returns the event loop of the Asyncio driver if the bot uses it, so
+    the HTTP servers run in that loop instead of their own threads."""
+    if conf.supybot.drivers.module() != 'Asyncio':
+        return None
+    try:
+        import supybot.drivers.Asyncio as Asyncio
+    except (ImportError, SyntaxError):
+        return None
+    return Asyncio.loop
+
 def startServer():
     """Starts the HTTP server. Shouldn't be called from other modules.
     The callback should be an instance of a child of SupyHTTPServerCallback."""
@@ -438,9 +712,13 @@ def startServer():
     addresses6 = [(6, (x, configGroup.port()))
             for x in configGroup.hosts6().split(' ') if x != '']
     http_servers = []
+    loop = getEventLoop()
     for protocol, address in (addresses4 + addresses6):
         server = SupyHTTPServer(address, protocol, SupyHTTPRequestHandler)
-        Thread(target=server.serve_forever, name='HTTP Server').start()
+        if loop is None:
+            Thread(target=server.serve_forever, name='HTTP Server').start()
+        else:
+            server.serve_in_loop(loop)
         http_servers.append(server)
         log.info('Starting HTTP server: %s' % str(server))
 
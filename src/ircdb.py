@@ -32,6 +32,7 @@
 import os
 import time
 import operator
+import threading
 
 from . import conf, ircutils, log, registry, unpreserve, utils, world
 from .utils import minisix
@@ -105,6 +106,62 @@ _unwildcard_remover = utils.str.MultipleRemover('!@*?')
 def unWildcardHostmask(hostmask):
     return _unwildcard_remover(hostmask)
 
+class CapabilityCache(object):
+    """Remembers the decisions of checkCapability.
+
+    Decisions are keyed by hostmask, capability and flags, and stamped with
+    the generations of the users, channels and default capabilities they
+    were made with.  Changing any of them bumps its generation, which makes
+    all the decisions made before stale."""
+    USERS = 0
+    CHANNELS = 1
+    CAPABILITIES = 2
+    def __init__(self, max=10000):
+        self.decisions = utils.structures.LRUCacheDict(max)
+        self.generations = [0, 0, 0]
+        self.hits = 0
+        self.misses = 0
+        # Capabilities are checked by threaded commands too.
+        self.lock = threading.Lock()
+
+    def bump(self, kind):
+        with self.lock:
+            self.generations[kind] += 1
+
+    def get(self, key):
+        """Returns the decision for the given key.  Raises KeyError if there
+        is no fresh one."""
+        with self.lock:
+            decision = self.decisions.get(key)
+            if decision is not None:
+                (generations, expires, result) = decision
+                if generations == self.generations and \
+                        (expires is None or time.time() < expires):
+                    self.hits += 1
+                    return result
+                del self.decisions[key]
+            self.misses += 1
+            raise KeyError(key)
+
+    def set(self, key, result, generations, expires=None):
+        """Stores a decision, made with the given generations (as returned
+        by getGenerations before it was made); it is dropped if they
+        changed in the meantime."""
+        with self.lock:
+            if generations == self.generations:
+                self.decisions[key] = (generations, expires, result)
+
+    def getGenerations(self):
+        with self.lock:
+            return list(self.generations)
+
+    def clear(self):
+        with self.lock:
+            self.decisions.clear()
+            self.hits = self.misses = 0
+
+capabilityCache = CapabilityCache()
+
 _invert = invertCapability
 class CapabilitySet(set):
     """A subclass of set handling basic capability stuff."""
@@ -121,11 +178,13 @@ class CapabilitySet(set):
         if self.__parent.__contains__(inverted):
             self.__parent.remove(inverted)
         self.__parent.add(capability)
+        capabilityCache.bump(CapabilityCache.CAPABILITIES)
 
     def remove(self, capability):
         """Removes a capability from the set."""
         capability = ircutils.toLower(capability)
         self.__parent.remove(capability)
+        capabilityCache.bump(CapabilityCache.CAPABILITIES)
 
     def __contains__(self, capability):
         capability = ircutils.toLower(capability)
@@ -292,10 +351,13 @@ class IrcUser(object):
         if len(unWildcardHostmask(hostmask)) < 3:
             raise ValueError('Hostmask must contain at least 3 non-wildcard characters.')
         self.hostmasks.add(hostmask)
+        users.indexHostmask(self, hostmask)
+        capabilityCache.bump(CapabilityCache.USERS)
 
     def removeHostmask(self, hostmask):
         """Removes a hostmask from the user's hostmasks."""
         self.hostmasks.remove(hostmask)
+        capabilityCache.bump(CapabilityCache.USERS)
 
     def checkNick(self, network, nick):
         """Checks a given nick against the user's nicks."""
@@ -335,6 +397,8 @@ class IrcUser(object):
                 return False
             uniqued = list(filter(uniqueHostmask, reversed(self.auth)))
             self.auth = list(reversed(uniqued))
+            users.indexHostmask(self, hostmask)
+            capabilityCache.bump(CapabilityCache.USERS)
         else:
             raise ValueError('secure flag set, unmatched hostmask')
 
@@ -343,6 +407,7 @@ class IrcUser(object):
         for (when, hostmask) in self.auth:
             users.invalidateCache(hostmask=hostmask)
         self.auth = []
+        capabilityCache.bump(CapabilityCache.USERS)
 
     def preserve(self, fd, indent=''):
         def write(s):
@@ -439,6 +504,7 @@ class IrcChannel(object):
     def setDefaultCapability(self, b):
         """Sets the default capability in the channel."""
         self.defaultAllow = b
+        capabilityCache.bump(CapabilityCache.CHANNELS)
 
     def _checkCapability(self, capability, ignoreOwner=False):
         """Checks whether a certain capability is allowed by the channel."""
@@ -609,6 +675,90 @@ class IrcChannelCreator(Creator):
 class DuplicateHostmask(ValueError):
     pass
 
+def _isAscii(s):
+    try:
+        s.encode('ascii')
+    except UnicodeError:
+        return False
+    return True
+
+class HostmaskIndex(object):
+    """Finds the ids of the users whose hostmasks may match a given hostmask,
+    so it does not have to be matched against all the hostmasks of all the
+    users.
+
+    Hostmasks without wildcards are indexed by their lowered value, the
+    others by what follows their last wildcard (usually the end of the host)
+    or, if they end with a wildcard, by what precedes their first one (the
+    nick, or the nick and the ident).  Ids are only removed from the index
+    when the user is reindexed, so candidates still have to be checked."""
+    def __init__(self):
+        self.exact = {}
+        self.suffixes = {}
+        self.prefixes = {}
+        self.others = set()
+        self.keys = {} # id -> set of (table, key)
+        self.hostmasks = {} # id -> set of indexed hostmasks
+
+    def _getKey(self, hostmask):
+        if not _isAscii(hostmask):
+            # re.I may match non-ASCII characters ircutils.toLower does not
+            # lower.
+            return (None, None)
+        pattern = ircutils.toLower(hostmask)
+        last = max(pattern.rfind('*'), pattern.rfind('?'))
+        if last == -1:
+            return ('exact', pattern)
+        elif last < len(pattern) - 1:
+            return ('suffixes', pattern[last+1:])
+        first = min([i for i in (pattern.find('*'), pattern.find('?'))
+                     if i != -1])
+        if first:
+            return ('prefixes', pattern[:first])
+        else:
+            return (None, None)
+
+    def add(self, id, hostmask):
+        """Indexes a hostmask of the user with the given id.  Returns whether
+        it was not indexed yet."""
+        hostmasks = self.hostmasks.setdefault(id, set())
+        if hostmask in hostmasks:
+            return False
+        hostmasks.add(hostmask)
+        (table, key) = self._getKey(hostmask)
+        if table is None:
+            self.others.add(id)
+        else:
+            getattr(self, table).setdefault(key, set()).add(id)
+            self.keys.setdefault(id, set()).add((table, key))
+        return True
+
+    def remove(self, id):
+        """Removes all the hostmasks of the user with the given id."""
+        self.hostmasks.pop(id, None)
+        self.others.discard(id)
+        for (name, key) in self.keys.pop(id, ()):
+            table = getattr(self, name)
+            ids = table[key]
+            ids.discard(id)
+            if not ids:
+                del table[key]
+
+    def candidates(self, hostmask):
+        """Returns the ids of the users who may have a hostmask matching the
+        given one, or None if the index cannot tell."""
+        if not _isAscii(hostmask):
+            return None
+        s = ircutils.toLower(hostmask)
+        ids = set(self.others)
+        ids.update(self.exact.get(s, ()))
+        suffixes = self.suffixes
+        prefixes = self.prefixes
+        for i in range(len(s)):
+            ids.update(suffixes.get(s[i:], ()))
+            ids.update(prefixes.get(s[:i+1], ()))
+        return ids
+
 class UsersDictionary(utils.IterableMap):
     """A simple serialized-to-file User Database."""
     def __init__(self):
@@ -616,8 +766,16 @@ class UsersDictionary(utils.IterableMap):
         self.filename = None
         self.users = {}
         self.nextId = 0
-        self._nameCache = utils.structures.CacheDict(1000)
-        self._hostmaskCache = utils.structures.CacheDict(1000)
+        self._nameCache = utils.structures.CacheDict(
+                conf.supybot.performance.cacheSizes.users)
+        self._hostmaskCache = utils.structures.LRUCacheDict(
+                conf.supybot.performance.cacheSizes.users,
+                onEvict=self._uncacheHostmask)
+        self._hostmaskCacheIds = {} # id -> set of cached hostmasks
+        # Held while the caches and the hostmask index are used, as threaded
+        # commands look users up too.
+        self._cacheLock = threading.RLock()
+        self._hostmaskIndex = HostmaskIndex()
 
     # This is separate because the Creator has to access our instance.
     def open(self, filename):
@@ -641,8 +799,12 @@ class UsersDictionary(utils.IterableMap):
         """Reloads the database from its file."""
         self.nextId = 0
         self.users.clear()
-        self._nameCache.clear()
-        self._hostmaskCache.clear()
+        capabilityCache.bump(CapabilityCache.USERS)
+        with self._cacheLock:
+            self._nameCache.clear()
+            self._hostmaskCache.clear()
+            self._hostmaskCacheIds.clear()
+            self._hostmaskIndex = HostmaskIndex()
         if self.filename is not None:
             try:
                 self.open(self.filename)
@@ -673,28 +835,36 @@ class UsersDictionary(utils.IterableMap):
         if self.flush in world.flushers:
             world.flushers.remove(self.flush)
         self.users.clear()
+        capabilityCache.bump(CapabilityCache.USERS)
 
     def items(self):
         return self.users.items()
 
     def getUserId(self, s):
         """Returns the user ID of a given name or hostmask."""
+        with self._cacheLock:
+            return self._getUserId(s)
+
+    def _getUserId(self, s):
         if ircutils.isUserHostmask(s):
             try:
                 return self._hostmaskCache[s]
             except KeyError:
                 ids = {}
-                for (id, user) in self.users.items():
+                candidates = self._hostmaskIndex.candidates(s)
+                if candidates is None:
+                    candidates = list(self.users)
+                for id in candidates:
+                    user = self.users.get(id)
+                    if user is None or isinstance(user, int):
+                        continue
                     x = user.checkHostmask(s)
                     if x:
                         ids[id] = x
                 if len(ids) == 1:
                     id = list(ids.keys())[0]
                     self._hostmaskCache[s] = id
-                    try:
-                        self._hostmaskCache[id].add(s)
-                    except KeyError:
-                        self._hostmaskCache[id] = set([s])
+                    self._hostmaskCacheIds.setdefault(id, set()).add(s)
                     return id
                 elif len(ids) == 0:
                     raise KeyError(s)
@@ -751,24 +921,56 @@ class UsersDictionary(utils.IterableMap):
     def numUsers(self):
         return len(self.users)
 
+    def _uncacheHostmask(self, hostmask, id):
+        hostmasks = self._hostmaskCacheIds.get(id)
+        if hostmasks is not None:
+            hostmasks.discard(hostmask)
+            if not hostmasks:
+                del self._hostmaskCacheIds[id]
+
+    def _uncacheHostmasksMatching(self, pattern):
+        # Hostmasks cached as matching no one or someone else may now match
+        # this pattern too.
+        with self._cacheLock:
+            for hostmask in [h for h in self._hostmaskCache
+                             if ircutils.hostmaskPatternEqual(pattern, h)]:
+                self._uncacheHostmask(hostmask,
+                                      self._hostmaskCache.pop(hostmask))
+
     def invalidateCache(self, id=None, hostmask=None, name=None):
-        if hostmask is not None:
-            if hostmask in self._hostmaskCache:
-                id = self._hostmaskCache.pop(hostmask)
-                self._hostmaskCache[id].remove(hostmask)
-                if not self._hostmaskCache[id]:
-                    del self._hostmaskCache[id]
-        if name is not None:
-            del self._nameCache[self._nameCache[id]]
-            del self._nameCache[id]
-        if id is not None:
-            if id in self._nameCache:
+        with self._cacheLock:
+            if hostmask is not None:
+                if hostmask in self._hostmaskCache:
+                    id = self._hostmaskCache.pop(hostmask)
+                    self._uncacheHostmask(hostmask, id)
+            if name is not None:
                 del self._nameCache[self._nameCache[id]]
                 del self._nameCache[id]
-            if id in self._hostmaskCache:
-                for hostmask in self._hostmaskCache[id]:
-                    del self._hostmaskCache[hostmask]
-                del self._hostmaskCache[id]
+            if id is not None:
+                if id in self._nameCache:
+                    del self._nameCache[self._nameCache[id]]
+                    del self._nameCache[id]
+                for hostmask in self._hostmaskCacheIds.pop(id, ()):
+                    self._hostmaskCache.pop(hostmask, None)
+
+    def indexHostmask(self, user, hostmask):
+        """Adds a hostmask, or an authenticated hostmask, of the given user
+        to the hostmask index, if the user is in this database."""
+        with self._cacheLock:
+            if self.users.get(user.id) is user and \
+                    self._hostmaskIndex.add(user.id, hostmask):
+                self._uncacheHostmasksMatching(hostmask)
+
+    def _indexUser(self, user):
+        with self._cacheLock:
+            index = self._hostmaskIndex
+            indexed = index.hostmasks.get(user.id, set())
+            index.remove(user.id)
+            hostmasks = list(user.hostmasks)
+            hostmasks.extend([hostmask for (_, hostmask) in user.auth])
+            for hostmask in hostmasks:
+                if index.add(user.id, hostmask) and hostmask not in indexed:
+                    self._uncacheHostmasksMatching(hostmask)
 
     def setUser(self, user, flush=True):
         """Sets a user (given its id) to the IrcUser given it."""
@@ -794,19 +996,22 @@ class UsersDictionary(utils.IterableMap):
                         raise DuplicateHostmask(hostmask)
         self.invalidateCache(user.id)
         self.users[user.id] = user
+        self._indexUser(user)
+        capabilityCache.bump(CapabilityCache.USERS)
         if flush:
             self.flush()
 
     def delUser(self, id):
         """Removes a user from the database."""
         del self.users[id]
-        if id in self._nameCache:
-            del self._nameCache[self._nameCache[id]]
-            del self._nameCache[id]
-        if id in self._hostmaskCache:
-            for hostmask in list(self._hostmaskCache[id]):
-                del self._hostmaskCache[hostmask]
-            del self._hostmaskCache[id]
+        with self._cacheLock:
+            if id in self._nameCache:
+                del self._nameCache[self._nameCache[id]]
+                del self._nameCache[id]
+            for hostmask in self._hostmaskCacheIds.pop(id, ()):
+                self._hostmaskCache.pop(hostmask, None)
+            self._hostmaskIndex.remove(id)
+        capabilityCache.bump(CapabilityCache.USERS)
         self.flush()
 
     def newUser(self):
@@ -864,11 +1069,13 @@ class ChannelsDictionary(utils.IterableMap):
         if self.flush in world.flushers:
             world.flushers.remove(self.flush)
         self.channels.clear()
+        capabilityCache.bump(CapabilityCache.CHANNELS)
 
     def reload(self):
         """Reloads the channel database from its file."""
         if self.filename is not None:
             self.channels.clear()
+            capabilityCache.bump(CapabilityCache.CHANNELS)
             try:
                 self.open(self.filename)
             except EnvironmentError as e:
@@ -890,6 +1097,7 @@ class ChannelsDictionary(utils.IterableMap):
         """Sets a given channel to the IrcChannel object given."""
         channel = channel.lower()
         self.channels[channel] = ircChannel
+        capabilityCache.bump(CapabilityCache.CHANNELS)
         self.flush()
 
     def items(self):
@@ -996,6 +1204,9 @@ world.flushers.append(users.flush)
 world.flushers.append(ignores.flush)
 world.flushers.append(channels.flush)
 
+world.caches['user names'] = users._nameCache
+world.caches['user hostmasks'] = users._hostmaskCache
+
 
 ###
 # Useful functions for checking credentials.
@@ -1075,10 +1286,35 @@ def checkCapability(hostmask, capability, users=users, channels=channels,
       a capability or the associated anticapability, then they have the
       capability"
     """
-    if world.testing and (not isinstance(hostmask, str) or
-            '@' not in hostmask or
-            '__no_testcap__' not in hostmask.split('@')[1]):
+    if _isTestingHostmask(hostmask):
         return _x(capability, True)
+    return _checkCapabilityCached(hostmask, capability, users, channels,
+                                  ignoreOwner, ignoreChannelOp,
+                                  ignoreDefaultAllow)
+
+def _isTestingHostmask(hostmask):
+    return world.testing and (not isinstance(hostmask, str) or
+            '@' not in hostmask or
+            '__no_testcap__' not in hostmask.split('@')[1])
+
+def _checkCapabilityCached(hostmask, capability, users, channels,
+                           ignoreOwner, ignoreChannelOp, ignoreDefaultAllow):
+    key = (hostmask, capability, ignoreOwner, ignoreChannelOp,
+           ignoreDefaultAllow, users, channels)
+    try:
+        return capabilityCache.get(key)
+    except KeyError:
+        generations = capabilityCache.getGenerations()
+        expires = []
+        result = _checkCapability(hostmask, capability, users, channels,
+                                  ignoreOwner, ignoreChannelOp,
+                                  ignoreDefaultAllow, expires)
+        capabilityCache.set(key, result, generations,
+                            min(expires) if expires else None)
+        return result
+
+def _checkCapability(hostmask, capability, users, channels, ignoreOwner,
+                     ignoreChannelOp, ignoreDefaultAllow, expires):
     try:
         u = users.getUser(hostmask)
         if u.secure and not u.checkHostmask(hostmask, useAuth=False):
@@ -1092,6 +1328,11 @@ def checkCapability(hostmask, capability, users=users, channels=channels,
         log.warning('%s: %s', hostmask, e)
         return _checkCapabilityForUnknownUser(capability, users=users,
               channels=channels, ignoreDefaultAllow=ignoreDefaultAllow)
+    # The user may have been recognized by an authentication, which times
+    # out.
+    timeout = conf.supybot.databases.users.timeoutIdentification()
+    if timeout:
+        expires.extend([when + timeout for (when, _) in u.auth])
     if capability in u.capabilities:
         try:
             return u._checkCapability(capability, ignoreOwner)
@@ -1122,18 +1363,28 @@ def checkCapability(hostmask, capability, users=users, channels=channels,
         return _x(capability, conf.supybot.capabilities.default())
 
 
-def checkCapabilities(hostmask, capabilities, requireAll=False):
+def checkCapabilities(hostmask, capabilities, requireAll=False,
+                      users=users, channels=channels):
     """Checks that a user has capabilities in a list.
 
     requireAll is True if *all* capabilities in the list must be had, False if
     *any* of the capabilities in the list must be had.
+
+    ``users`` and ``channels`` default to ``ircdb.users`` and
+    ``ircdb.channels``.
     """
+    testing = _isTestingHostmask(hostmask)
     for capability in capabilities:
+        if testing:
+            result = _x(capability, True)
+        else:
+            result = _checkCapabilityCached(hostmask, capability, users,
+                                            channels, False, False, False)
         if requireAll:
-            if not checkCapability(hostmask, capability):
+            if not result:
                 return False
         else:
-            if checkCapability(hostmask, capability):
+            if result:
                 return True
     return requireAll
 
@@ -1167,6 +1418,13 @@ conf.registerGlobalValue(conf.supybot.capabilities, 'default',
     registry.Boolean(True, """Determines whether the bot by default will allow
     users to have a capability.  If this is disabled, a user must explicitly
     have the capability for whatever command they wish to run."""))
+conf.supybot.capabilities.addCallback(capabilityCache.bump,
+                                      CapabilityCache.CAPABILITIES)
+conf.supybot.capabilities.default.addCallback(capabilityCache.bump,
+                                              CapabilityCache.CAPABILITIES)
+conf.supybot.databases.users.timeoutIdentification.addCallback(
+    capabilityCache.bump, CapabilityCache.USERS)
+
 conf.registerGlobalValue(conf.supybot.capabilities, 'private',
     registry.SpaceSeparatedListOfStrings([], """Determines what capabilities
     the bot will never tell to a non-admin whether or not a user has them."""))
@@ -144,25 +144,72 @@ class IrcCallback(IrcCommandDispatcher, log.Firewalled):
         pass
 
 ###
-# Basic queue for IRC messages.  It doesn't presently (but should at some
-# later point) reorder messages based on priority or penalty calculations.
+# Queue for IRC messages, and the rate limiter of the messages taken from it.
 ###
 _high = frozenset(['MODE', 'KICK', 'PONG', 'NICK', 'PASS', 'CAPAB', 'REMOVE'])
 _low = frozenset(['PRIVMSG', 'PING', 'WHO', 'NOTICE', 'JOIN'])
-class IrcMsgQueue(object):
-    """Class for a queue of IrcMsgs.  Eventually, it should be smart.
+class _FairQueue(object):
+    """A queue of messages with one FIFO per target (the first argument of
+    the messages), which are served in turn, one message at a time."""
+    __slots__ = ('targets', 'active', 'length')
+    def __init__(self):
+        self.targets = {} # target -> deque of messages
+        self.active = collections.deque() # Targets with messages, in turn.
+        self.length = 0
+
+    def enqueue(self, msg):
+        if msg.args:
+            target = ircutils.toLower(msg.args[0])
+        else:
+            target = ''
+        msgs = self.targets.get(target)
+        if msgs is None:
+            msgs = self.targets[target] = collections.deque()
+            self.active.append(target)
+        msgs.append(msg)
+        self.length += 1
+
+    def peek(self):
+        return self.targets[self.active[0]][0]
+
+    def dequeue(self):
+        target = self.active.popleft()
+        msgs = self.targets[target]
+        msg = msgs.popleft()
+        if msgs:
+            self.active.append(target)
+        else:
+            del self.targets[target]
+        self.length -= 1
+        return msg
+
+    def skip(self):
+        """Gives the turn of the next target to the following one."""
+        self.active.rotate(-1)
+
+    def __iter__(self):
+        for target in self.active:
+            for msg in self.targets[target]:
+                yield msg
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+    __nonzero__ = __bool__
 
-    Probably smarter than it is now, though it's gotten quite a bit smarter
-    than it originally was.  A method to "score" methods, and a heapq to
-    maintain a priority queue of the messages would be the ideal way to do
-    intelligent queuing.
+class IrcMsgQueue(object):
+    """Class for a queue of IrcMsgs.
 
-    As it stands, however, we simply keep track of 'high priority' messages,
-    'low priority' messages, and normal messages, and just make sure to return
-    the 'high priority' ones before the normal ones before the 'low priority'
-    ones.
+    'High priority' messages are returned before the normal ones, which are
+    returned before the 'low priority' ones.  Within each of these, messages
+    to the same target (channel or nick) are returned in order, but targets
+    take turns, so a flood of replies to one channel does not hold back the
+    replies to the others.
     """
-    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin')
+    __slots__ = ('msgs', 'highpriority', 'normal', 'lowpriority', 'lastJoin',
+                 'counts')
     def __init__(self, iterable=()):
         self.reset()
         for msg in iterable:
@@ -171,9 +218,10 @@ class IrcMsgQueue(object):
     def reset(self):
         """Clears the queue."""
         self.lastJoin = 0
-        self.highpriority = smallqueue()
-        self.normal = smallqueue()
-        self.lowpriority = smallqueue()
+        self.highpriority = _FairQueue()
+        self.normal = _FairQueue()
+        self.lowpriority = _FairQueue()
+        self.counts = {} # msg -> number of times it is queued
 
     def enqueue(self, msg):
         """Enqueues a given message."""
@@ -189,6 +237,7 @@ class IrcMsgQueue(object):
                 self.lowpriority.enqueue(msg)
             else:
                 self.normal.enqueue(msg)
+            self.counts[msg] = self.counts.get(msg, 0) + 1
             return True
 
     def dequeue(self):
@@ -199,21 +248,38 @@ class IrcMsgQueue(object):
         elif self.normal:
             msg = self.normal.dequeue()
         elif self.lowpriority:
-            msg = self.lowpriority.dequeue()
-            if msg.command == 'JOIN':
+            if self.lowpriority.peek().command == 'JOIN':
                 limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
                 now = time.time()
                 if self.lastJoin + limit <= now:
                     self.lastJoin = now
                 else:
-                    self.lowpriority.enqueue(msg)
-                    msg = None
+                    self.lowpriority.skip()
+                    return None
+            msg = self.lowpriority.dequeue()
+        if msg is not None:
+            count = self.counts.pop(msg) - 1
+            if count:
+                self.counts[msg] = count
         return msg
 
+    def nextTime(self, now=None):
+        """Returns when dequeue may return a message, if the queue is not
+        empty: now, unless the next low priority messages are all JOINs held
+        back by supybot.protocols.irc.queuing.rateLimit.join."""
+        if now is None:
+            now = time.time()
+        if self.highpriority or self.normal or not self.lowpriority:
+            return now
+        lowpriority = self.lowpriority
+        for target in lowpriority.active:
+            if lowpriority.targets[target][0].command != 'JOIN':
+                return now
+        limit = conf.supybot.protocols.irc.queuing.rateLimit.join()
+        return max(now, self.lastJoin + limit)
+
     def __contains__(self, msg):
-        return msg in self.normal or \
-               msg in self.lowpriority or \
-               msg in self.highpriority
+        return msg in self.counts
 
     def __bool__(self):
         return bool(self.highpriority or self.normal or self.lowpriority)
@@ -229,14 +295,47 @@ class IrcMsgQueue(object):
                                             self.lowpriority)))
     __str__ = __repr__
 
+class TokenBucket(object):
+    """Models the flood protection of IRC servers: each message sent adds a
+    penalty of <interval> seconds to a timer which starts at the current
+    time, and messages are held back while the timer is more than
+    (<burst> - 1) * <interval> seconds ahead.  In other words, up to <burst>
+    messages can be sent at once, and then one every <interval> seconds.
+    Both may be callables, such as registry values."""
+    __slots__ = ('interval', 'burst', 'timer')
+    def __init__(self, interval, burst=1):
+        self.interval = interval
+        self.burst = burst
+        self.timer = 0
+
+    def reset(self):
+        self.timer = 0
+
+    def nextTime(self, now=None):
+        """Returns when a message can be sent."""
+        if now is None:
+            now = time.time()
+        (interval, burst) = (force(self.interval), force(self.burst))
+        return max(now, self.timer - (burst - 1) * interval)
+
+    def take(self, now=None):
+        """Returns whether a message can be sent now, and if so, adds its
+        penalty."""
+        if now is None:
+            now = time.time()
+        if self.nextTime(now) > now:
+            return False
+        self.timer = max(self.timer, now) + force(self.interval)
+        return True
 
 ###
 # Maintains the state of IRC connection -- the most recent messages, the
 # status of various modes (especially ops/halfops/voices) in channels, etc.
 ###
 class ChannelState(utils.python.Object):
-    __slots__ = ('users', 'ops', 'halfops', 'bans',
-                 'voices', 'topic', 'modes', 'created')
+    _fields = ('users', 'ops', 'halfops', 'bans',
+               'voices', 'topic', 'modes', 'created')
+    __slots__ = _fields + ('_name', '_nicksToChannels')
     def __init__(self):
         self.topic = ''
         self.created = 0
@@ -246,6 +345,42 @@ class ChannelState(utils.python.Object):
         self.voices = ircutils.IrcSet()
         self.halfops = ircutils.IrcSet()
         self.modes = {}
+        self._name = None
+        self._nicksToChannels = None
+
+    def _attach(self, name, nicksToChannels):
+        """Makes the users of this channel, and the ones added to it or
+        removed from it afterward, show up in the nicksToChannels index of a
+        ChannelStateDict, under the given channel name."""
+        if self._nicksToChannels is not None:
+            self._detach()
+        self._name = name
+        self._nicksToChannels = nicksToChannels
+        for nick in self.users:
+            self._indexUser(nick)
+
+    def _detach(self):
+        if self._nicksToChannels is not None:
+            for nick in self.users:
+                self._unindexUser(nick)
+        self._name = None
+        self._nicksToChannels = None
+
+    def _indexUser(self, nick):
+        if self._nicksToChannels is not None:
+            channels = self._nicksToChannels.get(nick)
+            if channels is None:
+                channels = ircutils.IrcSet()
+                self._nicksToChannels[nick] = channels
+            channels.add(self._name)
+
+    def _unindexUser(self, nick):
+        if self._nicksToChannels is not None:
+            channels = self._nicksToChannels.get(nick)
+            if channels is not None:
+                channels.discard(self._name)
+                if not channels:
+                    del self._nicksToChannels[nick]
 
     def isOp(self, nick):
         return nick in self.ops
@@ -277,13 +412,18 @@ class ChannelState(utils.python.Object):
                 self.halfops.add(nick)
             elif marker == '+':
                 self.voices.add(nick)
-        self.users.add(nick)
+        if nick not in self.users:
+            self.users.add(nick)
+            self._indexUser(nick)
 
     def replaceUser(self, oldNick, newNick):
         """Changes the user oldNick to newNick; used for NICK changes."""
         # Note that this doesn't have to have the sigil (@%+) that users
         # have to have for addUser; it just changes the name of the user
         # without changing any of their categories.
+        if oldNick in self.users:
+            self._unindexUser(oldNick)
+            self._indexUser(newNick)
         for s in (self.users, self.ops, self.halfops, self.voices):
             if oldNick in s:
                 s.remove(oldNick)
@@ -291,7 +431,9 @@ class ChannelState(utils.python.Object):
 
     def removeUser(self, user):
         """Removes a given user from the channel."""
-        self.users.discard(user)
+        if user in self.users:
+            self.users.remove(user)
+            self._unindexUser(user)
         self.ops.discard(user)
         self.halfops.discard(user)
         self.voices.discard(user)
@@ -334,18 +476,56 @@ class ChannelState(utils.python.Object):
                     self.unsetMode(modeChar)
 
     def __getstate__(self):
-        return [getattr(self, name) for name in self.__slots__]
+        return [getattr(self, name) for name in self._fields]
 
     def __setstate__(self, t):
-        for (name, value) in zip(self.__slots__, t):
+        for (name, value) in zip(self._fields, t):
             setattr(self, name, value)
+        self._name = None
+        self._nicksToChannels = None
 
     def __eq__(self, other):
         ret = True
-        for name in self.__slots__:
+        for name in self._fields:
             ret = ret and getattr(self, name) == getattr(other, name)
         return ret
 
+class ChannelStateDict(ircutils.IrcDict):
+    """Maps channel names to their ChannelState, and maintains
+    nicksToChannels, which maps each nick to the IrcSet of the names of the
+    channels it is in, as users join, leave, or change nick."""
+    def __init__(self, dict=None):
+        self.nicksToChannels = ircutils.IrcDict()
+        super(ChannelStateDict, self).__init__(dict)
+
+    def __setitem__(self, channel, state):
+        if channel in self:
+            self._detach(channel)
+        super(ChannelStateDict, self).__setitem__(channel, state)
+        if isinstance(state, ChannelState):
+            state._attach(channel, self.nicksToChannels)
+
+    def __delitem__(self, channel):
+        self._detach(channel)
+        super(ChannelStateDict, self).__delitem__(channel)
+
+    def _detach(self, channel):
+        state = self[channel]
+        if isinstance(state, ChannelState):
+            state._detach()
+
+    def clear(self):
+        for (channel, state) in self.items():
+            if isinstance(state, ChannelState):
+                state._name = None
+                state._nicksToChannels = None
+        self.data.clear()
+        self.nicksToChannels.clear()
+
+    def channelsOf(self, nick):
+        """Returns a new IrcSet of the names of the channels nick is in."""
+        return ircutils.IrcSet(self.nicksToChannels.get(nick, ()))
+
 Batch = collections.namedtuple('Batch', 'type arguments messages')
 
 class IrcState(IrcCommandDispatcher, log.Firewalled):
@@ -363,7 +543,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         if nicksToHostmasks is None:
             nicksToHostmasks = ircutils.IrcDict()
         if channels is None:
-            channels = ircutils.IrcDict()
+            channels = ChannelStateDict()
+        elif not isinstance(channels, ChannelStateDict):
+            channels = ChannelStateDict(channels)
         self.capabilities_ack = capabilities_ack or set()
         self.capabilities_nak = capabilities_nak or set()
         self.capabilities_ls = capabilities_ls or {}
@@ -511,6 +693,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
         (nick, user, host) = (msg.args[5], msg.args[2], msg.args[3])
         hostmask = '%s!%s@%s' % (nick, user, host)
         self.nicksToHostmasks[nick] = hostmask
+        channel = msg.args[1]
+        if channel in self.channels:
+            self.channels[channel].addUser(nick)
 
     def do354(self, irc, msg):
         # WHOX reply.
@@ -623,11 +808,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
                 chan.removeUser(user)
 
     def doQuit(self, irc, msg):
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-                channel.removeUser(msg.nick)
+        channel_names = self.channels.channelsOf(msg.nick)
+        for name in channel_names:
+            self.channels[name].removeUser(msg.nick)
         # Remember which channels the user was on
         msg.tag('channels', channel_names)
         if msg.nick in self.nicksToHostmasks:
@@ -659,11 +842,9 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             del self.nicksToHostmasks[oldNick]
         except KeyError:
             pass
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-            channel.replaceUser(oldNick, newNick)
+        channel_names = self.channels.channelsOf(oldNick)
+        for name in channel_names:
+            self.channels[name].replaceUser(oldNick, newNick)
         msg.tag('channels', channel_names)
 
     def doBatch(self, irc, msg):
@@ -680,11 +861,7 @@ class IrcState(IrcCommandDispatcher, log.Firewalled):
             assert False, msg.args[0]
 
     def doAway(self, irc, msg):
-        channel_names = ircutils.IrcSet()
-        for (name, channel) in self.channels.items():
-            if msg.nick in channel.users:
-                channel_names.add(name)
-        msg.tag('channels', channel_names)
+        msg.tag('channels', self.channels.channelsOf(msg.nick))
 
 
 ###
@@ -715,6 +892,9 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         self.state = IrcState()
         self.queue = IrcMsgQueue()
         self.fastqueue = smallqueue()
+        self.rateLimiter = TokenBucket(
+                conf.supybot.protocols.irc.throttleTime,
+                conf.supybot.protocols.irc.queuing.rateLimit.burst)
         self.driver = None # The driver should set this later.
         self._setNonResettingVariables()
         self._queueConnectMessages()
@@ -813,6 +993,12 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         else:
             log.warning('Refusing to send %r; %s is a zombie.', msg, self)
 
+    def nextTakeTime(self):
+        """Returns when takeMsg may return a message of the queue, if it is
+        not empty."""
+        now = time.time()
+        return max(self.rateLimiter.nextTime(now), self.queue.nextTime(now))
+
     def takeMsg(self):
         """Called by the IrcDriver; takes a message to be sent."""
         if not self.callbacks:
@@ -822,11 +1008,13 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         if self.fastqueue:
             msg = self.fastqueue.dequeue()
         elif self.queue:
-            if now-self.lastTake <= conf.supybot.protocols.irc.throttleTime():
+            if self.rateLimiter.nextTime(now) > now:
                 log.debug('Irc.takeMsg throttling.')
             else:
-                self.lastTake = now
                 msg = self.queue.dequeue()
+                if msg is not None:
+                    self.lastTake = now
+                    self.rateLimiter.take(now)
         elif self.afterConnect and \
              conf.supybot.protocols.irc.ping() and \
              now > self.lastping + conf.supybot.protocols.irc.ping.interval():
@@ -887,6 +1075,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             channel = None
         preInFilter = str(msg).rstrip('\r\n')
         log.debug('Incoming message (%s): %s', self.network, preInFilter)
+        originalMsg = msg
 
         # Yeah, so this is odd.  Some networks (oftc) seem to give us certain
         # messages with our nick instead of our prefix.  We'll fix that here.
@@ -933,9 +1122,11 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
             except:
                 log.exception('Uncaught exception in inFilter:')
             world.debugFlush()
-        postInFilter = str(msg).rstrip('\r\n')
-        if postInFilter != preInFilter:
-            log.debug('Incoming message (post-inFilter): %s', postInFilter)
+        if msg is not originalMsg:
+            postInFilter = str(msg).rstrip('\r\n')
+            if postInFilter != preInFilter:
+                log.debug('Incoming message (post-inFilter): %s',
+                          postInFilter)
         for callback in self.callbacks:
             try:
                 if callback is not None:
@@ -962,6 +1153,7 @@ class Irc(IrcCommandDispatcher, log.Firewalled):
         self.state.reset()
         self.queue.reset()
         self.fastqueue.reset()
+        self.rateLimiter.reset()
         self.startedSync.clear()
         for callback in self.callbacks:
             callback.reset()
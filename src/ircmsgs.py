@@ -114,9 +114,12 @@ class IrcMsg(object):
     # It's too useful to be able to tag IrcMsg objects with extra, unforeseen
     # data.  Goodbye, __slots__.
     # On second thought, let's use methods for tagging.
-    __slots__ = ('args', 'command', 'host', 'nick', 'prefix', 'user',
+    # nick, user, host, server_tags and time are properties: messages parsed
+    # from strings only split their prefix and parse their server tags when
+    # these attributes are first used.
+    __slots__ = ('args', 'command', '_host', '_nick', 'prefix', '_user',
                  '_hash', '_str', '_repr', '_len', 'tags', 'reply_env',
-                 'server_tags', 'time')
+                 '_server_tags', '_rawServerTags', '_time')
     def __init__(self, s='', command='', args=(), prefix='', msg=None,
             reply_env=None):
         assert not (msg and s), 'IrcMsg.__init__ cannot accept both s and msg'
@@ -126,6 +129,8 @@ class IrcMsg(object):
         self._repr = None
         self._hash = None
         self._len = None
+        self._nick = self._user = self._host = None
+        self._rawServerTags = None
         self.reply_env = reply_env
         self.tags = {}
         if s:
@@ -135,65 +140,129 @@ class IrcMsg(object):
                     s += '\n'
                 self._str = s
                 if s[0] == '@':
-                    (server_tags, s) = s.split(' ', 1)
-                    self.server_tags = parse_server_tags(server_tags[1:])
+                    (self._rawServerTags, s) = s[1:].split(' ', 1)
+                    self._server_tags = None
                 else:
-                    self.server_tags = {}
+                    self._server_tags = {}
                 if s[0] == ':':
-                    self.prefix, s = s[1:].split(None, 1)
+                    (self.prefix, s) = s[1:].split(None, 1)
                 else:
                     self.prefix = ''
-                if ' :' in s: # Note the space: IPV6 addresses are bad w/o it.
-                    s, last = s.split(' :', 1)
-                    self.args = s.split()
-                    self.args.append(last.rstrip('\r\n'))
-                else:
-                    self.args = s.split()
-                self.command = self.args.pop(0)
-                if 'time' in self.server_tags:
-                    s = self.server_tags['time']
-                    date = datetime.datetime.strptime(s, '%Y-%m-%dT%H:%M:%S.%fZ')
-                    date = minisix.make_datetime_utc(date)
-                    self.time = minisix.datetime__timestamp(date)
-                else:
-                    self.time = time.time()
+                # Note the space: IPV6 addresses are bad w/o it.
+                (s, trailing, last) = s.partition(' :')
+                args = s.split()
+                if trailing:
+                    args.append(last.rstrip('\r\n'))
+                self.command = args.pop(0)
+                self.args = tuple(args)
+                # Replaced by the time server tag, if any, once it is parsed.
+                self._time = time.time()
             except (IndexError, ValueError):
                 raise MalformedIrcMsg(repr(originalString))
-        else:
-            if msg is not None:
-                if prefix:
-                    self.prefix = prefix
-                else:
-                    self.prefix = msg.prefix
-                if command:
-                    self.command = command
-                else:
-                    self.command = msg.command
-                if args:
-                    self.args = args
-                else:
-                    self.args = msg.args
-                if reply_env:
-                    self.reply_env = reply_env
-                elif msg.reply_env:
-                    self.reply_env = msg.reply_env.copy()
-                else:
-                    self.reply_env = None
-                self.tags = msg.tags.copy()
-                self.server_tags = msg.server_tags
-                self.time = msg.time
-            else:
+            return
+        if msg is not None:
+            if prefix:
                 self.prefix = prefix
+            else:
+                self.prefix = msg.prefix
+            if command:
                 self.command = command
-                assert all(ircutils.isValidArgument, args), args
+            else:
+                self.command = msg.command
+            if args:
                 self.args = args
-                self.time = None
-                self.server_tags = {}
+            else:
+                self.args = msg.args
+            if reply_env:
+                self.reply_env = reply_env
+            elif msg.reply_env:
+                self.reply_env = msg.reply_env.copy()
+            else:
+                self.reply_env = None
+            self.tags = msg.tags.copy()
+            self._rawServerTags = msg._rawServerTags
+            self._server_tags = msg._server_tags
+            self._time = msg._time
+        else:
+            self.prefix = prefix
+            self.command = command
+            assert all(ircutils.isValidArgument, args), args
+            self.args = args
+            self._time = None
+            self._server_tags = {}
         self.args = tuple(self.args)
+
+    def _splitPrefix(self):
         if isUserHostmask(self.prefix):
-            (self.nick,self.user,self.host)=ircutils.splitHostmask(self.prefix)
+            (self._nick, self._user, self._host) = \
+                    ircutils.splitHostmask(self.prefix)
         else:
-            (self.nick, self.user, self.host) = (self.prefix,)*3
+            (self._nick, self._user, self._host) = (self.prefix,)*3
+
+    @property
+    def nick(self):
+        if self._nick is None:
+            self._splitPrefix()
+        return self._nick
+
+    @nick.setter
+    def nick(self, value):
+        self._nick = value
+
+    @property
+    def user(self):
+        if self._user is None:
+            self._splitPrefix()
+        return self._user
+
+    @user.setter
+    def user(self, value):
+        self._user = value
+
+    @property
+    def host(self):
+        if self._host is None:
+            self._splitPrefix()
+        return self._host
+
+    @host.setter
+    def host(self, value):
+        self._host = value
+
+    def _parseServerTags(self):
+        server_tags = parse_server_tags(self._rawServerTags)
+        (self._server_tags, self._rawServerTags) = (server_tags, None)
+        if 'time' in server_tags:
+            try:
+                date = datetime.datetime.strptime(server_tags['time'],
+                                                  '%Y-%m-%dT%H:%M:%S.%fZ')
+            except ValueError:
+                # Keep the time the message was received at.
+                return
+            date = minisix.make_datetime_utc(date)
+            self._time = minisix.datetime__timestamp(date)
+
+    @property
+    def server_tags(self):
+        if self._rawServerTags is not None:
+            self._parseServerTags()
+        return self._server_tags
+
+    @server_tags.setter
+    def server_tags(self, value):
+        (self._server_tags, self._rawServerTags) = (value, None)
+
+    @property
+    def time(self):
+        if self._rawServerTags is not None:
+            self._parseServerTags()
+        return self._time
+
+    @time.setter
+    def time(self, value):
+        if self._rawServerTags is not None:
+            self._parseServerTags()
+        self._time = value
 
     def __str__(self):
         if self._str is not None:
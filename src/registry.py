@@ -72,6 +72,9 @@ encoder = codecs.getencoder(ENCODING)
 
 _cache = utils.InsensitivePreservingDict()
 _lastModified = 0
+# Bumped whenever a node is unregistered, which makes Accessors resolve
+# their nodes again.
+_generation = 0
 def open_registry(filename, clear=False):
     """Initializes the module by loading the registry file into memory."""
     global _lastModified
@@ -295,9 +298,11 @@ class Group(object):
         return node
 
     def unregister(self, name):
+        global _generation
         try:
             node = self._children[name]
             del self._children[name]
+            _generation += 1
             # We do this because we need to remove case-insensitively.
             name = name.lower()
             for elt in reversed(self._added):
@@ -328,6 +333,42 @@ class Group(object):
             L = [(split(s)[-1], node) for (s, node) in L]
         return L
 
+class Accessor(object):
+    """Looks up a node of the registry, and its children, without walking the
+    registry from its root on every lookup.
+
+    Nodes are resolved once, and again only after a node was unregistered
+    somewhere, which happens when a value is set (its children that did not
+    have a value of their own go away) or when the registry is edited."""
+    __slots__ = ('root', 'names', 'generation', 'node', 'children')
+    def __init__(self, root, names):
+        self.root = root
+        self.names = names
+        self.generation = None
+        self.node = None
+        self.children = {}
+
+    def get(self, child=None):
+        """Returns the node, or its child of the given name."""
+        if self.generation != _generation:
+            # Unregistering may happen while we resolve, so read the
+            # generation first.
+            generation = _generation
+            node = self.root
+            for name in self.names:
+                node = node.get(name)
+            self.node = node
+            self.children = {}
+            self.generation = generation
+        if child is None:
+            return self.node
+        try:
+            return self.children[child]
+        except KeyError:
+            node = self.node.get(child)
+            self.children[child] = node
+            return node
+
 class _NoValueGiven:
     # Special value for Value.error()
     pass
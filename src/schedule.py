@@ -62,13 +62,26 @@ class Schedule(drivers.IrcDriver):
         drivers.IrcDriver.__init__(self)
         self.schedule = []
         self.events = {}
+        # Maps the name of each event to its entry in the heap.  Removed
+        # events stay in the heap until they reach its top or until there
+        # are too many of them; the entries that are not in this dict
+        # anymore are ignored.
+        self.entries = {}
+        self.cancelled = 0
         self.counter = 0
         self.lock = Lock()
+        self.stats = {'ran': 0, 'totalLag': 0.0, 'maxLag': 0.0}
+        # Drivers that wait for the next event instead of polling set this to
+        # a function called with the time of every new event, which may be
+        # called from any thread.
+        self.wakeup = None
 
     def reset(self):
         with self.lock:
             self.events.clear()
+            self.entries.clear()
             self.schedule[:] = []
+            self.cancelled = 0
         # We don't reset the counter here because if someone has held an id of
         # one of the nuked events, we don't want them removing new events with
         # their old id.
@@ -86,24 +99,39 @@ class Schedule(drivers.IrcDriver):
             self.counter += 1
         assert name not in self.events, \
                'An event with the same name has already been scheduled.'
+        entry = mytuple((t, name, args, kwargs))
         with self.lock:
             self.events[name] = f
-            heapq.heappush(self.schedule, mytuple((t, name, args, kwargs)))
+            self.entries[name] = entry
+            heapq.heappush(self.schedule, entry)
+        if self.wakeup is not None:
+            self.wakeup(t)
         return name
 
     def removeEvent(self, name):
         """Removes the event with the given name from the schedule."""
-        f = self.events.pop(name)
-        # We must heapify here because the heap property may not be preserved
-        # by the above list comprehension.  We could, conceivably, just mark
-        # the elements of the heap as removed and ignore them when we heappop,
-        # but that would only save a constant factor (we're already linear for
-        # the listcomp) so I'm not worried about it right now.
         with self.lock:
-            self.schedule = [x for x in self.schedule if x[1] != name]
-            heapq.heapify(self.schedule)
+            f = self.events.pop(name)
+            del self.entries[name]
+            self.cancelled += 1
+            # Rebuilding the heap is linear, but we only do it once the
+            # removed entries are half of it, so removals stay O(log n)
+            # amortized.
+            if self.cancelled * 2 > len(self.schedule):
+                self.schedule = [x for x in self.schedule
+                                 if self.entries.get(x[1]) is x]
+                heapq.heapify(self.schedule)
+                self.cancelled = 0
         return f
 
+    def _dropCancelled(self):
+        """Pops the entries of removed events from the top of the heap.
+        Must be called with the lock held."""
+        while self.schedule and \
+                self.entries.get(self.schedule[0][1]) is not self.schedule[0]:
+            heapq.heappop(self.schedule)
+            self.cancelled -= 1
+
     def rescheduleEvent(self, name, t):
         f = self.removeEvent(name)
         self.addEvent(f, t, name=name)
@@ -128,15 +156,33 @@ class Schedule(drivers.IrcDriver):
 
     removePeriodicEvent = removeEvent
 
+    def nextEventTime(self):
+        """Returns the time at which the next event should run, or None if
+        there is no scheduled event."""
+        with self.lock:
+            self._dropCancelled()
+            if self.schedule:
+                return self.schedule[0][0]
+            else:
+                return None
+
     def run(self):
         if len(drivers._drivers) == 1 and not world.testing:
             log.error('Schedule is the only remaining driver, '
                       'why do we continue to live?')
             time.sleep(1) # We're the only driver; let's pause to think.
-        while self.schedule and self.schedule[0][0] < time.time():
+        while True:
             with self.lock:
+                self._dropCancelled()
+                if not self.schedule or self.schedule[0][0] >= time.time():
+                    break
                 (t, name, args, kwargs) = heapq.heappop(self.schedule)
+                del self.entries[name]
                 f = self.events.pop(name)
+            lag = time.time() - t
+            self.stats['ran'] += 1
+            self.stats['totalLag'] += lag
+            self.stats['maxLag'] = max(self.stats['maxLag'], lag)
             try:
                 f(*args, **kwargs)
             except Exception:
@@ -149,6 +195,7 @@ removeEvent = schedule.removeEvent
 rescheduleEvent = schedule.rescheduleEvent
 addPeriodicEvent = schedule.addPeriodicEvent
 removePeriodicEvent = removeEvent
+nextEventTime = schedule.nextEventTime
 run = schedule.run
 
 
@@ -533,15 +533,14 @@ class TestRequestHandler(httpserver.SupyHTTPRequestHandler):
         self.wfile = wfile
         self.handle_one_request()
 
-    def send_response(self, code):
-        assert self._headers_mode
-        self._response = code
-    def send_headers(self, name, value):
-        assert self._headers_mode
-        self._headers[name] = value
-    def end_headers(self):
+    def _sendResponse(self, code, message, headers, body):
         assert self._headers_mode
         self._headers_mode = False
+        self._response = code
+        self._headers = dict(headers)
+        if minisix.PY3:
+            body = body.decode('utf8', 'replace')
+        self.wfile.write(body)
 
     def do_X(self, *args, **kwargs):
         assert httpserver.http_servers, \
@@ -158,9 +158,11 @@ def check_certificate_fingerprint(conn, trusted_fingerprints):
     raise ssl.CertificateError('No matching fingerprint.')
 
 if hasattr(ssl, 'create_default_context'):
-    def ssl_wrap_socket(conn, hostname, logger, certfile=None,
-            trusted_fingerprints=None, verify=True, ca_file=None,
-            **kwargs):
+    def ssl_context(certfile=None, trusted_fingerprints=None, verify=True,
+            ca_file=None, **kwargs):
+        """Returns the SSLContext ssl_wrap_socket uses to wrap connections.
+        The caller has to check trusted_fingerprints itself, with
+        check_certificate_fingerprint."""
         context = ssl.create_default_context(**kwargs)
         if trusted_fingerprints or not verify:
             # Do not use Certification Authorities
@@ -170,6 +172,14 @@ if hasattr(ssl, 'create_default_context'):
             context.load_verify_locations(cafile=ca_file)
         if certfile:
             context.load_cert_chain(certfile)
+        return context
+
+    def ssl_wrap_socket(conn, hostname, logger, certfile=None,
+            trusted_fingerprints=None, verify=True, ca_file=None,
+            **kwargs):
+        context = ssl_context(certfile=certfile,
+                trusted_fingerprints=trusted_fingerprints, verify=verify,
+                ca_file=ca_file, **kwargs)
         conn = context.wrap_socket(conn, server_hostname=hostname)
         if verify and trusted_fingerprints:
             check_certificate_fingerprint(conn, trusted_fingerprints)
@@ -37,6 +37,7 @@ import re
 import time
 import string
 import textwrap
+import functools
 
 from . import minisix
 from .iter import any
@@ -244,16 +245,22 @@ def perlReToPythonRe(s, allowG=False):
     else:
         return r
 
+def _searchGroup(r, s):
+    m = r.search(s)
+    return m and m.group(0) or ''
+
 def perlReToFindall(s):
     """Converts a string representation of a Perl regular expression (i.e.,
     m/^foo$/i or /foo|bar/) to a Python regular expression, with support for
     G flag
     """
     (r, g) = perlReToPythonRe(s, allowG=True)
+    # These are not lambdas, so they can be pickled and sent to the workers
+    # of commands.process.
     if g:
-        return lambda s: r.findall(s)
+        return r.findall
     else:
-        return lambda s: r.search(s) and r.search(s).group(0) or ''
+        return functools.partial(_searchGroup, r)
 
 def perlReToReplacer(s):
     """Converts a string representation of a Perl regular expression (i.e.,
@@ -280,9 +287,9 @@ def perlReToReplacer(s):
         flags = ''.join(flags)
     r = perlReToPythonRe(sep.join(('', regexp, flags)))
     if g:
-        return lambda s: r.sub(replace, s)
+        return functools.partial(r.sub, replace)
     else:
-        return lambda s: r.sub(replace, s, 1)
+        return functools.partial(r.sub, replace, count=1)
 
 _perlVarSubstituteRe = re.compile(r'\$\{([^}]+)\}|\$([a-zA-Z][a-zA-Z0-9]*)')
 def perlVariableSubstitute(vars, text):
@@ -32,6 +32,7 @@ Data structures for Python.
 """
 
 import time
+import threading
 import collections
 
 
@@ -427,35 +428,140 @@ class MultiSet(object):
         return elt in self.d
 
 
-class CacheDict(collections.MutableMapping):
-    __slots__ = ('d', 'max')
-    def __init__(self, max, **kwargs):
-        self.d = dict(**kwargs)
+class LRUCacheDict(collections.MutableMapping):
+    """A dictionary holding at most max keys; when it is full, setting a new
+    key drops the least recently used one.  max may be a callable, such as a
+    registry value.  onEvict, if given, is called with the key and the value
+    of every dropped item.  hits, misses and evictions count the lookups
+    that found their key, the ones that did not, and the dropped items.
+
+    As even reading a key reorders the items, all the operations hold a
+    lock, so the dictionary can be shared by threads."""
+    __slots__ = ('d', 'max', 'root', 'onEvict', 'hits', 'misses',
+                 'evictions', 'lock')
+    _marker = object()
+    # A circular doubly linked list of [prev, next, key, value] links, from
+    # the least to the most recently used.  root is its sentinel link.
+    def __init__(self, max, onEvict=None):
+        self.d = {}
         self.max = max
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+        self.onEvict = onEvict
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Reentrant, in case onEvict uses the dictionary.
+        self.lock = threading.RLock()
+
+    def _unlink(self, link):
+        (prev, next_) = link[0:2]
+        prev[1] = next_
+        next_[0] = prev
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = self.root[0] = link
 
     def __getitem__(self, key):
-        return self.d[key]
+        with self.lock:
+            try:
+                link = self.d[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
     def __setitem__(self, key, value):
-        if len(self.d) >= self.max:
-            self.d.clear()
-        self.d[key] = value
+        with self.lock:
+            link = self.d.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[3] = value
+            else:
+                size = self.max
+                if callable(size):
+                    size = size()
+                # It may have been shrunk since the last item was set.
+                while self.d and len(self.d) >= size:
+                    oldest = self.root[1]
+                    self._unlink(oldest)
+                    del self.d[oldest[2]]
+                    self.evictions += 1
+                    if self.onEvict is not None:
+                        self.onEvict(oldest[2], oldest[3])
+                link = [None, None, key, value]
+                self.d[key] = link
+            self._append(link)
 
     def __delitem__(self, key):
-        del self.d[key]
+        with self.lock:
+            link = self.d.pop(key)
+            self._unlink(link)
+
+    def pop(self, key, default=_marker):
+        with self.lock:
+            link = self.d.pop(key, None)
+            if link is None:
+                if default is self._marker:
+                    raise KeyError(key)
+                return default
+            self._unlink(link)
+            return link[3]
+
+    def __contains__(self, key):
+        return key in self.d
+
+    def clear(self):
+        with self.lock:
+            self.d.clear()
+            self.root[:] = [self.root, self.root, None, None]
+
+    def _links(self):
+        # From the least to the most recently used.
+        with self.lock:
+            links = []
+            link = self.root[1]
+            while link is not self.root:
+                links.append(link)
+                link = link[1]
+            return links
+
+    def __iter__(self):
+        return iter(self.keys())
 
+    # These do not count as uses of the items.
     def keys(self):
-        return self.d.keys()
-    
-    def items(self):
-        return self.d.items()
+        return [link[2] for link in self._links()]
 
-    def __iter__(self):
-        return iter(self.d)
+    def values(self):
+        return [link[3] for link in self._links()]
+
+    def items(self):
+        return [(link[2], link[3]) for link in self._links()]
 
     def __len__(self):
         return len(self.d)
 
+class CacheDict(LRUCacheDict):
+    """An LRUCacheDict which can be given its initial items as keyword
+    arguments."""
+    __slots__ = ()
+    def __init__(self, max, **kwargs):
+        super(CacheDict, self).__init__(max)
+        self.update(kwargs)
+
 class TruncatableSet(collections.MutableSet):
     """A set that keeps track of the order of inserted elements so
     the oldest can be removed."""
@@ -28,9 +28,16 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import os
 import re
+import json
+import time
 import base64
 import socket
+import hashlib
+import threading
+import email.message
+import email.utils
 
 sockerrors = (socket.error,)
 try:
@@ -39,6 +46,8 @@ except AttributeError:
     pass
 
 from .str import normalizeWhitespace
+from .file import AtomicFile
+from .structures import LRUCacheDict
 from . import minisix
 
 if minisix.PY2:
@@ -57,6 +66,8 @@ if minisix.PY2:
         return urllib.urlencode(*args, **kwargs).encode()
     from urllib2 import HTTPError, URLError
     from urllib import splithost, splituser
+    from urllib2 import HTTPHandler, HTTPSHandler, ProxyHandler, build_opener
+    from httplib import HTTPConnection, HTTPSConnection, BadStatusLine
 else:
     from http.client import InvalidURL
     from urllib.parse import urlsplit, urlunsplit, urlparse
@@ -72,6 +83,9 @@ else:
         return urllib.parse.urlencode(*args, **kwargs)
     from urllib.error import HTTPError, URLError
     from urllib.parse import splithost, splituser
+    from urllib.request import HTTPHandler, HTTPSHandler, ProxyHandler, \
+            build_opener
+    from http.client import HTTPConnection, HTTPSConnection, BadStatusLine
 
 class Error(Exception):
     pass
@@ -121,6 +135,509 @@ defaultHeaders = {
 # application-specific function.  Feel free to use a callable here.
 proxy = None
 
+# Statistics about the requests made by getUrlFd.  Latencies are the time it
+# took servers to send the headers of their responses, in seconds.
+stats = {'requests': 0, 'cacheHits': 0, 'revalidated': 0,
+         'serverResponses': 0, 'connections': 0, 'reusedConnections': 0,
+         'totalLatency': 0.0, 'maxLatency': 0.0}
+_statsLock = threading.Lock()
+
+def _count(key):
+    with _statsLock:
+        stats[key] += 1
+
+def _recordLatency(latency):
+    with _statsLock:
+        stats['serverResponses'] += 1
+        stats['totalLatency'] += latency
+        stats['maxLatency'] = max(stats['maxLatency'], latency)
+
+class HttpConnectionPool(object):
+    """Keeps the connections to HTTP servers that are still open once a
+    response was read entirely, so the next request to the same server can
+    be sent on them instead of opening a new connection."""
+    def __init__(self, maxIdle=4, idleTimeout=60):
+        self.maxIdle = maxIdle
+        self.idleTimeout = idleTimeout
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    def get(self, key):
+        """Returns an idle connection to the server key refers to, or None if
+        there is none."""
+        now = time.time()
+        with self.lock:
+            connections = self.idle.get(key, [])
+            while connections:
+                (conn, lastUsed) = connections.pop()
+                if now - lastUsed < self.idleTimeout:
+                    return conn
+                conn.close()
+            self.idle.pop(key, None)
+        return None
+
+    def put(self, key, conn):
+        with self.lock:
+            connections = self.idle.setdefault(key, [])
+            if len(connections) < self.maxIdle:
+                connections.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self):
+        with self.lock:
+            (idle, self.idle) = (self.idle, {})
+        for connections in idle.values():
+            for (conn, lastUsed) in connections:
+                conn.close()
+
+def _parseCacheControl(value):
+    directives = {}
+    for directive in value.split(','):
+        (name, sep, argument) = directive.strip().partition('=')
+        directives[name.lower()] = argument.strip('"')
+    return directives
+
+def _parseHttpDate(value):
+    t = email.utils.parsedate_tz(value) if value else None
+    if t is None:
+        return None
+    return email.utils.mktime_tz(t)
+
+def _expires(headers, now):
+    """Returns the time when a response with the given headers becomes stale,
+    or None if it must not be stored at all."""
+    cacheControl = _parseCacheControl(headers.get('Cache-Control', ''))
+    if 'no-store' in cacheControl or headers.get('Vary', '').strip() == '*':
+        return None
+    if 'no-cache' in cacheControl:
+        lifetime = 0
+    elif 'max-age' in cacheControl:
+        try:
+            lifetime = int(cacheControl['max-age'])
+        except ValueError:
+            lifetime = 0
+    else:
+        expires = _parseHttpDate(headers.get('Expires'))
+        date = _parseHttpDate(headers.get('Date')) or now
+        lifetime = expires - date if expires is not None else 0
+    try:
+        age = int(headers.get('Age', 0))
+    except ValueError:
+        age = 0
+    return now + lifetime - age
+
+class HttpCacheEntry(object):
+    """A response stored in an HttpCache.  headers is a list of (name, value)
+    pairs, and vary maps the (lowercase) names of the request headers the
+    response depends on to their values in the request."""
+    __slots__ = ('url', 'headers', 'vary', 'expires', 'body')
+    def __init__(self, url, headers, vary, expires, body=None):
+        self.url = url
+        self.headers = headers
+        self.vary = vary
+        self.expires = expires
+        self.body = body
+
+    @classmethod
+    def fromResponse(cls, url, req, headers, now):
+        """Returns an entry for the response to req with the given headers,
+        or None if it cannot be cached."""
+        expires = _expires(headers, now)
+        if expires is None:
+            return None
+        vary = {}
+        for name in headers.get('Vary', '').split(','):
+            name = name.strip().lower()
+            if name:
+                vary[name] = req.get_header(name.capitalize())
+        entry = cls(url, list(headers.items()), vary, expires)
+        if expires <= now and not entry.validators():
+            return None
+        return entry
+
+    def isFresh(self):
+        return time.time() < self.expires
+
+    def matches(self, req):
+        for (name, value) in self.vary.items():
+            if req.get_header(name.capitalize()) != value:
+                return False
+        return True
+
+    def getHeader(self, name):
+        name = name.lower()
+        for (key, value) in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def message(self):
+        headers = email.message.Message()
+        for (name, value) in self.headers:
+            headers[name] = value
+        return headers
+
+    def validators(self):
+        """Returns the headers of a conditional request for this response."""
+        headers = {}
+        etag = self.getHeader('ETag')
+        if etag:
+            headers['If-None-Match'] = etag
+        lastModified = self.getHeader('Last-Modified')
+        if lastModified:
+            headers['If-Modified-Since'] = lastModified
+        return headers
+
+    def update(self, headers, now):
+        """Updates the entry with the headers of a 304 (Not Modified)
+        response.  Returns whether it can still be stored."""
+        names = set(name.lower() for name in headers.keys())
+        self.headers = [(name, value) for (name, value) in self.headers
+                        if name.lower() not in names]
+        self.headers.extend(headers.items())
+        expires = _expires(self.message(), now)
+        if expires is None:
+            return False
+        self.expires = expires
+        return True
+
+class HttpCache(object):
+    """Stores the responses to GET requests, so they can be reused as long as
+    their Cache-Control or Expires headers allow it, and revalidated
+    afterwards if they have an ETag or a Last-Modified header.  Responses are
+    kept in memory, and in directory if it is set and diskSize is not 0.
+    Sizes are numbers of responses, and any of these attributes may be a
+    callable."""
+    def __init__(self, memorySize=100, diskSize=0, directory=None,
+                 maximumBodySize=1048576):
+        self.memorySize = memorySize
+        self.diskSize = diskSize
+        self.directory = directory
+        self.maximumBodySize = maximumBodySize
+        self.lock = threading.Lock()
+        self.memory = LRUCacheDict(1)
+        self.diskFiles = None
+
+    def _filename(self, url):
+        if force(self.diskSize) <= 0:
+            return None
+        directory = force(self.directory)
+        if not directory:
+            return None
+        if not isinstance(url, bytes):
+            url = url.encode('utf8')
+        return os.path.join(directory, hashlib.sha1(url).hexdigest())
+
+    def get(self, url, req):
+        """Returns the entry for url if it was stored and if it applies to
+        req, fresh or not; None otherwise."""
+        with self.lock:
+            entry = self.memory.get(url)
+        if entry is None:
+            entry = self._load(url)
+            if entry is not None:
+                with self.lock:
+                    self._remember(entry)
+        if entry is None or not entry.matches(req):
+            return None
+        return entry
+
+    def store(self, entry):
+        with self.lock:
+            self._remember(entry)
+        self._save(entry)
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.diskFiles = None
+        if force(self.diskSize) <= 0:
+            return
+        directory = force(self.directory)
+        if directory and os.path.isdir(directory):
+            for name in os.listdir(directory):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def _remember(self, entry):
+        # Called with self.lock held.
+        size = force(self.memorySize)
+        if size <= 0:
+            return
+        self.memory.max = size
+        while len(self.memory) > size:
+            del self.memory[next(iter(self.memory))]
+        self.memory[entry.url] = entry
+
+    def _load(self, url):
+        filename = self._filename(url)
+        if filename is None:
+            return None
+        try:
+            with open(filename, 'rb') as fd:
+                metadata = json.loads(fd.readline().decode('utf8'))
+                body = fd.read()
+        except (IOError, OSError, ValueError):
+            return None
+        if metadata.get('url') != url:
+            return None
+        headers = [tuple(header) for header in metadata['headers']]
+        return HttpCacheEntry(url, headers, metadata['vary'],
+                              metadata['expires'], body)
+
+    def _save(self, entry):
+        filename = self._filename(entry.url)
+        if filename is None:
+            return
+        metadata = {'url': entry.url, 'headers': entry.headers,
+                    'vary': entry.vary, 'expires': entry.expires}
+        existed = os.path.exists(filename)
+        try:
+            fd = AtomicFile(filename, 'wb', makeBackupIfSmaller=False)
+            fd.write(json.dumps(metadata).encode('utf8') + b'\n')
+            fd.write(entry.body)
+            fd.close()
+        except (IOError, OSError):
+            return
+        if not existed:
+            self._prune()
+
+    def _prune(self):
+        directory = force(self.directory)
+        size = force(self.diskSize)
+        with self.lock:
+            if self.diskFiles is None:
+                self.diskFiles = len(os.listdir(directory))
+            else:
+                self.diskFiles += 1
+            if self.diskFiles <= size:
+                return
+            files = []
+            for name in os.listdir(directory):
+                filename = os.path.join(directory, name)
+                try:
+                    files.append((os.path.getmtime(filename), filename))
+                except OSError:
+                    pass
+            files.sort()
+            # Remove a tenth more files than needed, so the directory is not
+            # listed again on the next response.
+            removed = len(files) - size + size // 10
+            for (mtime, filename) in files[:removed]:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+            self.diskFiles = max(0, len(files) - removed)
+
+class HttpResponse(object):
+    """The file-like object returned by getUrlFd for HTTP(S) URLs.  Once its
+    body was read entirely, its connection is given back to the pool, and
+    entry (if any) is stored in the cache with that body."""
+    def __init__(self, url, code, reason, headers, fd,
+                 client=None, key=None, conn=None, entry=None):
+        self.url = url
+        self.code = self.status = code
+        self.msg = self.reason = reason
+        self.headers = headers
+        self.fd = fd
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._entry = entry
+        self._chunks = []
+        self._size = 0
+
+    @classmethod
+    def fromCache(cls, entry):
+        return cls(entry.url, 200, 'OK', entry.message(),
+                   minisix.io.BytesIO(entry.body))
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.code
+
+    def info(self):
+        return self.headers
+
+    def read(self, amt=None):
+        if amt is None:
+            data = self.fd.read()
+        else:
+            data = self.fd.read(amt)
+        if self._entry is not None:
+            self._size += len(data)
+            if self._size > force(self._client.cache.maximumBodySize):
+                self._entry = None
+            else:
+                self._chunks.append(data)
+        if self._conn is not None and self.fd.isclosed():
+            self._finish()
+        return data
+
+    def _finish(self):
+        (conn, self._conn) = (self._conn, None)
+        self._client.release(self._key, conn, self.fd)
+        if self._entry is not None:
+            self._entry.body = b''.join(self._chunks)
+            self._client.cache.store(self._entry)
+            self._entry = None
+        self._chunks = []
+
+    def close(self):
+        self.fd.close()
+        if self._conn is not None:
+            # The body was not read entirely; the connection cannot be
+            # reused.
+            (conn, self._conn) = (self._conn, None)
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class HttpClient(object):
+    """Sends the HTTP(S) requests of getUrlFd, on the connections of an
+    HttpConnectionPool, unless a response in an HttpCache can be used
+    instead."""
+    def __init__(self, pool=None, cache=None):
+        self.pool = pool or HttpConnectionPool()
+        self.cache = cache or HttpCache()
+
+    def open(self, req, connectionClass, **connectionArgs):
+        url = req.get_full_url()
+        _count('requests')
+        entry = None
+        cacheable = req.get_method() == 'GET' and \
+                not any(map(req.has_header, ('Authorization', 'Range',
+                                             'If-none-match',
+                                             'If-modified-since')))
+        if cacheable:
+            entry = self.cache.get(url, req)
+            if entry is not None:
+                if entry.isFresh():
+                    _count('cacheHits')
+                    return HttpResponse.fromCache(entry)
+                for (name, value) in entry.validators().items():
+                    req.add_unredirected_header(name, value)
+        start = time.time()
+        (key, conn, response) = self._request(req, connectionClass,
+                                              connectionArgs)
+        now = time.time()
+        _recordLatency(now - start)
+        if entry is not None and response.status == 304:
+            _count('revalidated')
+            response.read()
+            self.release(key, conn, response)
+            if entry.update(response.msg, now):
+                self.cache.store(entry)
+            return HttpResponse.fromCache(entry)
+        if cacheable and response.status == 200:
+            entry = HttpCacheEntry.fromResponse(url, req, response.msg, now)
+        else:
+            entry = None
+        return HttpResponse(url, response.status, response.reason,
+                            response.msg, response, self, key, conn, entry)
+
+    def release(self, key, conn, response):
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(key, conn)
+
+    def _request(self, req, connectionClass, connectionArgs):
+        if minisix.PY2:
+            (host, selector) = (req.get_host(), req.get_selector())
+            data = req.get_data()
+        else:
+            (host, selector, data) = (req.host, req.selector, req.data)
+        if not host:
+            raise URLError('no host given')
+        key = (connectionClass, host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update((name, value) for (name, value) in req.headers.items()
+                       if name not in headers)
+        headers = dict((name.title(), value)
+                       for (name, value) in headers.items())
+        method = req.get_method()
+        while True:
+            conn = self.pool.get(key)
+            reused = conn is not None
+            if reused:
+                conn.timeout = req.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(req.timeout)
+            else:
+                conn = connectionClass(host, timeout=req.timeout,
+                                       **connectionArgs)
+            sent = False
+            try:
+                conn.request(method, selector, data, headers)
+                sent = True
+                response = conn.getresponse()
+            except socket.timeout as e:
+                conn.close()
+                raise URLError(e)
+            except (socket.error, BadStatusLine) as e:
+                conn.close()
+                if reused and (not sent or method in ('GET', 'HEAD')):
+                    # The server closed the connection while it was idle;
+                    # try again on a new one.  Only idempotent requests are
+                    # sent again once written, as the server may have
+                    # handled them before the connection was lost.
+                    continue
+                elif isinstance(e, BadStatusLine):
+                    raise
+                else:
+                    raise URLError(e)
+            _count('reusedConnections' if reused else 'connections')
+            return (key, conn, response)
+
+class PooledHTTPHandler(HTTPHandler):
+    def __init__(self, client, *args, **kwargs):
+        HTTPHandler.__init__(self, *args, **kwargs)
+        self.client = client
+
+    def http_open(self, req):
+        return self.client.open(req, HTTPConnection)
+
+class PooledHTTPSHandler(HTTPSHandler):
+    def __init__(self, client, *args, **kwargs):
+        HTTPSHandler.__init__(self, *args, **kwargs)
+        self.client = client
+
+    def https_open(self, req):
+        if getattr(req, '_tunnel_host', None):
+            # Connections tunneled through a proxy are not pooled.
+            return HTTPSHandler.https_open(self, req)
+        kwargs = {}
+        context = getattr(self, '_context', None)
+        if context is not None:
+            kwargs['context'] = context
+        return self.client.open(req, HTTPSConnection, **kwargs)
+
+client = HttpClient()
+_openers = {}
+
+def _getOpener():
+    proxies = force(proxy) or ''
+    opener = _openers.get(proxies)
+    if opener is None:
+        handlers = [PooledHTTPHandler(client), PooledHTTPSHandler(client)]
+        if proxies:
+            handlers.append(ProxyHandler({'http': proxies,
+                                          'https': proxies}))
+        opener = build_opener(*handlers)
+        _openers[proxies] = opener
+    return opener
+
 def getUrlFd(url, headers=None, data=None, timeout=None):
     """getUrlFd(url, headers=None, data=None, timeout=None)
 
@@ -143,7 +660,7 @@ def getUrlFd(url, headers=None, data=None, timeout=None):
         else:
             request = url
             request.add_data(data)
-        fd = urlopen(request, timeout=timeout)
+        fd = _getOpener().open(request, timeout=timeout)
         return fd
     except socket.timeout as e:
         raise Error(TIMED_OUT)
@@ -171,7 +688,14 @@ def getUrlTargetAndContent(url, size=None, headers=None, data=None, timeout=None
         if size is None:
             text = fd.read()
         else:
-            text = fd.read(size)
+            # fd.read(size) may return fewer bytes before the end of the
+            # body, so read chunks until there are size bytes.
+            text = fd.read(min(size, 8192))
+            while text and len(text) < size:
+                chunk = fd.read(min(size - len(text), 8192))
+                if not chunk:
+                    break
+                text += chunk
     except socket.timeout:
         raise Error(TIMED_OUT)
     target = fd.geturl()
@@ -112,6 +112,12 @@ def _flushUserData():
 
 flushers = [_flushUserData] # A periodic function will flush all these.
 
+# LRUCacheDicts whose statistics are logged by upkeep, by name.
+caches = {
+    'hostmask patterns': ircutils._patternCache,
+    'hostmask matches': ircutils._hostmaskPatternEqualCache,
+}
+
 registryFilename = None
 
 def flush():
@@ -176,9 +182,10 @@ def upkeep():
     if not dying:
         if minisix.PY2:
             log.debug('Regexp cache size: %s', len(re._cache))
-        log.debug('Pattern cache size: %s', len(ircutils._patternCache))
-        log.debug('HostmaskPatternEqual cache size: %s',
-                  len(ircutils._hostmaskPatternEqualCache))
+        for (name, cache) in sorted(caches.items()):
+            log.debug('Cache of %s: %s items, %s hits, %s misses, '
+                      '%s evictions.', name, len(cache), cache.hits,
+                      cache.misses, cache.evictions)
         #timestamp = log.timestamp()
         if doFlush:
             log.info('Flushers flushed and garbage collected.')
@@ -30,7 +30,11 @@
 
 from supybot.test import *
 
+import time
+import threading
+
 import supybot.conf as conf
+import supybot.world as world
 import supybot.utils as utils
 import supybot.ircmsgs as ircmsgs
 import supybot.utils.minisix as minisix
@@ -680,6 +684,111 @@ class WithPrivateNoticeTestCase(ChannelPluginTestCase):
         finally:
             conf.supybot.reply.withNoticeWhenPrivate.setValue(original)
 
+class CommandIndexTestCase(PluginTestCase):
+    plugins = ()
+    class First(callbacks.Plugin):
+        def foo(self, irc, msg, args):
+            irc.reply('first')
+    class Second(callbacks.Plugin):
+        dynamicCommands = True
+        def bar(self, irc, msg, args):
+            irc.reply('bar')
+    class Opaque(callbacks.Plugin):
+        def getCommand(self, args, stripOwnName=True):
+            return []
+
+    def testCandidates(self):
+        index = callbacks.CommandIndex()
+        first = self.First(self.irc)
+        second = self.Second(self.irc)
+        opaque = self.Opaque(self.irc)
+        cbs = [first, second, opaque]
+        self.assertEqual(index.candidates(cbs, ['foo']), set([first, opaque]))
+        self.assertEqual(index.candidates(cbs, ['first', 'foo']),
+                         set([first, opaque]))
+        self.assertEqual(index.candidates(cbs, ['bar']),
+                         set([second, opaque]))
+        self.assertEqual(index.candidates(cbs, ['baz', 'qux']),
+                         set([opaque]))
+        index.add(second, 'baz qux')
+        self.assertEqual(index.candidates(cbs, ['baz', 'qux', 'quux']),
+                         set([second, opaque]))
+        self.assertEqual(index.candidates(cbs, ['baz']), set([opaque]))
+        index.remove(second, ['baz', 'qux'])
+        self.assertEqual(index.candidates(cbs, ['baz', 'qux']),
+                         set([opaque]))
+        index.forget(first)
+        self.assertEqual(index.candidates([second], ['foo']), set([opaque]))
+        self.assertEqual(index.root[1].get('first'), None)
+
+    def testRemovePlugin(self):
+        self.irc.addCallback(self.First(self.irc))
+        self.assertResponse('foo', 'first')
+        self.irc.removeCallback('First')
+        self.assertError('foo')
+
+
+class CommandPoolTestCase(SupyTestCase):
+    def testPerPluginLimit(self):
+        pool = callbacks.CommandPool(lambda: 3, lambda: 1)
+        release = threading.Event()
+        started = []
+        def f(name):
+            started.append(name)
+            release.wait()
+        pool.submit('A', f, ('a1',))
+        pool.submit('A', f, ('a2',))
+        pool.submit('B', f, ('b1',))
+        timeExpended = 0
+        while len(started) < 2 and timeExpended < 5:
+            time.sleep(0.01)
+            timeExpended += 0.01
+        self.assertEqual(sorted(started), ['a1', 'b1'])
+        metrics = pool.metrics()
+        self.assertEqual(metrics['running'], 2)
+        self.assertEqual(metrics['queued'], 1)
+        self.assertEqual(metrics['submitted'], 3)
+        release.set()
+        while pool.metrics()['completed'] < 3 and timeExpended < 5:
+            time.sleep(0.01)
+            timeExpended += 0.01
+        self.assertEqual(sorted(started), ['a1', 'a2', 'b1'])
+        self.assertEqual(pool.metrics()['queued'], 0)
+        self.failUnless(pool.metrics()['maxQueued'] >= 1)
+        self.assertEqual(pool.admitted, {})
+
+class ThreadedCommandsTestCase(PluginTestCase):
+    plugins = ('Utilities',)
+    class Threaded(callbacks.Plugin):
+        threaded = True
+        def threads(self, irc, msg, args):
+            irc.reply(world.isMainThread())
+        def techo(self, irc, msg, args):
+            irc.replies(args, joiner=' ')
+        def treply(self, irc, msg, args):
+            m = irc.reply('foo')
+            irc.queueMsg(ircmsgs.privmsg(msg.nick, m.args[1] + 'bar'))
+
+    def testNested(self):
+        self.irc.addCallback(self.Threaded(self.irc))
+        self.assertResponse('threads', 'False')
+        self.assertResponse('techo foo bar', 'foo bar')
+        self.assertResponse('echo [techo foo] [techo bar] [techo baz]',
+                            'foo bar baz')
+        self.assertResponse('techo [echo foo] [techo [techo bar]]',
+                            'foo bar')
+
+    def testReplyReturnsMessage(self):
+        self.irc.addCallback(self.Threaded(self.irc))
+        self.assertResponse('treply', 'foo')
+        m = None
+        timeout = time.time() + 5
+        while m is None and time.time() < timeout:
+            drivers.run()
+            m = self.irc.takeMsg()
+        self.assertEqual(m.args[1], 'foobar')
+
+
 class ProxyTestCase(SupyTestCase):
     def testHashing(self):
         msg = ircmsgs.ping('0')
@@ -28,8 +28,11 @@
 # POSSIBILITY OF SUCH DAMAGE.
 ###
 
+import re
 import sys
+import time
 import getopt
+import threading
 
 from supybot.test import *
 
@@ -38,6 +41,7 @@ import supybot.conf as conf
 import supybot.irclib as irclib
 import supybot.ircmsgs as ircmsgs
 import supybot.utils.minisix as minisix
+import supybot.commands as commands
 import supybot.callbacks as callbacks
 
 
@@ -202,6 +206,90 @@ class FirstTestCase(CommandsTestCase):
         spec = [first('regexpMatcher', 'regexpReplacer'), 'text']
         self.assertStateErrored(spec, ['s/foo/bar/', 'x' * 512], errored=False)
 
+def _sleep(t):
+    time.sleep(t)
+    return t
+
+def _raise(s):
+    raise ValueError(s)
+
+class ProcessTestCase(SupyTestCase):
+    def testReturnValue(self):
+        self.assertEqual(process(sorted, [3, 1, 2]), [1, 2, 3])
+        self.assertEqual(process(_sleep, 0, timeout=10), 0)
+
+    def testException(self):
+        self.assertRaises(ValueError, process, _raise, 'foo')
+
+    def testUnpicklable(self):
+        # Lambdas cannot be sent to the workers of the pool.
+        self.assertEqual(process(lambda x: x*2, 21, timeout=10), 42)
+
+    if not world.disableMultiprocessing:
+        # Without subprocesses, functions run inline and can't be stopped.
+        def testTimeout(self):
+            self.assertRaises(commands.ProcessTimeoutError,
+                              process, _sleep, 10, timeout=0.1)
+            # The worker was replaced.
+            self.assertEqual(process(_sleep, 0, timeout=10), 0)
+
+    def testRegexpWrapper(self):
+        self.failUnless(regexp_wrapper('foobar', re.compile('o+b'), 10,
+                                       'Test', 'test'))
+        self.failIf(regexp_wrapper('foobar', re.compile('^b'), 10,
+                                   'Test', 'test'))
+
+    def runUntil(self, event, timeout=10):
+        # Callbacks are called from the main loop.
+        deadline = time.time() + timeout
+        while not event.is_set() and time.time() < deadline:
+            drivers.run()
+            event.wait(0.01)
+
+    def testProcessAsync(self):
+        done = threading.Event()
+        results = []
+        def callback(v):
+            self.failUnless(world.isMainThread())
+            results.append(v)
+            done.set()
+        def errback(e):
+            results.append(e)
+            done.set()
+        processAsync(sorted, [2, 1], callback=callback, errback=errback,
+                     timeout=10)
+        self.runUntil(done)
+        self.assertEqual(results, [[1, 2]])
+        done.clear()
+        processAsync(_raise, 'foo', callback=callback, errback=errback,
+                     timeout=10)
+        self.runUntil(done)
+        self.failUnless(isinstance(results[1], ValueError))
+        if not world.disableMultiprocessing:
+            done.clear()
+            processAsync(_sleep, 10, callback=callback, errback=errback,
+                         timeout=0.1)
+            self.runUntil(done)
+            self.failUnless(isinstance(results[2],
+                                       commands.ProcessTimeoutError))
+
+    def testRegexpFilterAsync(self):
+        done = threading.Event()
+        results = []
+        def callback(v):
+            results.append(v)
+            done.set()
+        items = ['foo %s' % i for i in range(100)]
+        regexp_filter_async(items, [re.compile('1'), re.compile('3')], 10,
+                            'Test', 'test', callback, callback)
+        self.runUntil(done)
+        self.assertEqual(results, [['foo 13', 'foo 31']])
+        done.clear()
+        regexp_filter_async(items, [re.compile('^foo 9')], 10,
+                            'Test', 'test', callback, callback, limit=2)
+        self.runUntil(done)
+        self.assertEqual(results[1], ['foo 9', 'foo 90'])
+
 class GetoptTestCase(PluginTestCase):
     plugins = ('Misc',) # We put something so it does not complain
     class Foo(callbacks.Plugin):
@@ -0,0 +1,338 @@
+###
+# Copyright (c) 2026, The Limnoria contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import sys
+import time
+import socket
+import threading
+
+import supybot.conf as conf
+import supybot.irclib as irclib
+import supybot.drivers as drivers
+import supybot.schedule as schedule
+
+try:
+    import selectors
+except ImportError:
+    selectors = None
+
+class DriverTestCase(object):
+    """Connects a driver to a fake server listening on localhost."""
+    driverModule = None
+
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        # Run our drivers in a loop of their own, so that the drivers other
+        # tests left behind are not started (nor killed) by drivers.run().
+        self.oldDrivers = (drivers._drivers, drivers._newDrivers,
+                           drivers._deadDrivers)
+        (drivers._drivers, drivers._newDrivers, drivers._deadDrivers) = \
+                ({}, [], set())
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        port = self.listener.getsockname()[1]
+        network = conf.registerNetwork('drivertest', ssl=False)
+        network.servers.setValue(['127.0.0.1:%s' % port])
+        self.irc = irclib.Irc('drivertest')
+        self.fed = []
+        feedMsg = self.irc.feedMsg
+        def newFeedMsg(msg):
+            self.fed.append(msg)
+            feedMsg(msg)
+        self.irc.feedMsg = newFeedMsg
+        self.driver = drivers.newDriver(self.irc, self.driverModule)
+        self.listener.settimeout(0)
+        deadline = time.time() + 5
+        while True:
+            try:
+                (self.server, _) = self.listener.accept()
+            except socket.error:
+                # Some drivers only connect from their loop.
+                self.failUnless(time.time() < deadline)
+                drivers.run()
+            else:
+                break
+        self.server.settimeout(0)
+        self.received = b''
+
+    def tearDown(self):
+        self.driver.die()
+        self.driver._reallyDie()
+        self.irc._reallyDie()
+        drivers.run()
+        (drivers._drivers, drivers._newDrivers, drivers._deadDrivers) = \
+                self.oldDrivers
+        self.server.close()
+        self.listener.close()
+        SupyTestCase.tearDown(self)
+
+    def runUntilReceived(self, s, timeout=5):
+        deadline = time.time() + timeout
+        while s not in self.received and time.time() < deadline:
+            drivers.run()
+            try:
+                self.received += self.server.recv(4096)
+            except socket.error:
+                pass
+        return s in self.received
+
+    def runUntilFed(self, command, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            drivers.run()
+            if self.fed and self.fed[-1].command == command:
+                return self.fed[-1]
+        return None
+
+    def checkScheduledEventWakesDriver(self):
+        self.failUnless(self.runUntilReceived(b'\r\nUSER '))
+        drivers.run()
+        def addEvent():
+            self.events.append(schedule.addEvent(lambda: None, time.time()))
+        self.events = []
+        timer = threading.Timer(0.1, addEvent)
+        timer.start()
+        try:
+            start = time.time()
+            drivers.run()
+            self.failUnless(time.time() - start <
+                            conf.supybot.drivers.poll() / 2)
+        finally:
+            timer.join()
+            for name in self.events:
+                schedule.removeEvent(name)
+
+    def testConnects(self):
+        self.failUnless(self.runUntilReceived(b'\r\nUSER '))
+        self.failUnless(b'NICK ' in self.received)
+
+    def testPingPong(self):
+        self.server.sendall(b':irc.example.net PING :foobar\r\n')
+        self.failUnless(self.runUntilReceived(b'PONG :foobar\r\n'))
+
+    def testSplitLines(self):
+        self.server.sendall(b':irc.example.net NOTICE * :fo')
+        self.runUntilFed('NOTICE', timeout=0.5)
+        self.server.sendall(b'obar\r\n:irc.example.net PING :baz\r\n')
+        msg = self.runUntilFed('PING')
+        self.failUnless(msg is not None)
+        self.assertEqual(self.fed[-2].args[1], 'foobar')
+
+    def testReceiveCounters(self):
+        self.server.sendall(b':irc.example.net PING :foo\r\n' * 3)
+        self.failUnless(self.runUntilReceived(b'PONG :foo\r\n'))
+        self.assertEqual(self.driver.inbuffer.lines.total, 3)
+        self.assertEqual(self.driver.inbuffer.bytes.total, 84)
+        self.assertEqual(self.driver.inbuffer.bytes.rate(), 84 / 60.)
+
+    def testSendCounters(self):
+        self.server.sendall(b':irc.example.net PING :foo\r\n')
+        self.failUnless(self.runUntilReceived(b'PONG :foo\r\n'))
+        outbuffer = getattr(self.driver, 'outbuffer', None)
+        if isinstance(outbuffer, drivers.SendBuffer):
+            self.assertEqual(outbuffer.sent.total, len(self.received))
+            self.assertEqual(outbuffer.queued.total, len(self.received))
+            self.assertEqual(len(outbuffer), 0)
+
+class SendBufferTestCase(SupyTestCase):
+    class FakeSocket(object):
+        def __init__(self, maxSent):
+            self.maxSent = maxSent
+            self.data = b''
+            self.calls = 0
+
+        def send(self, data):
+            self.calls += 1
+            data = data[:self.maxSent]
+            if not isinstance(data, bytes):
+                data = data.tobytes()
+            self.data += data
+            return len(data)
+
+    class FakeSslSocket(FakeSocket):
+        def sendmsg(self, buffers):
+            raise NotImplementedError
+
+    def testPartialSends(self):
+        buffer = drivers.SendBuffer()
+        buffer.append([ircmsgs.ping('foo'), ircmsgs.ping('bar')])
+        self.assertEqual(len(buffer), 22)
+        sock = self.FakeSocket(7)
+        self.assertEqual(buffer.sendTo(sock), 7)
+        self.assertEqual(len(buffer), 15)
+        buffer.append([ircmsgs.ping('baz')])
+        while buffer:
+            buffer.sendTo(sock)
+        self.assertEqual(sock.data,
+                         b'PING :foo\r\nPING :bar\r\nPING :baz\r\n')
+        self.assertEqual(buffer.sent.total, 33)
+        self.assertEqual(buffer.queued.total, 33)
+        self.assertEqual(buffer.sendTo(sock), 0)
+
+    def testWithoutMemoryview(self):
+        # Like on Python 2.6
+        drivers.memoryview = None
+        try:
+            self.testPartialSends()
+        finally:
+            del drivers.memoryview
+
+    def testChunksAreJoined(self):
+        buffer = drivers.SendBuffer()
+        buffer.append([ircmsgs.ping('foo')] * 10)
+        sock = self.FakeSslSocket(1000)
+        self.assertEqual(buffer.sendTo(sock), 110)
+        self.assertEqual(sock.calls, 1)
+        self.failIf(buffer.useSendmsg)
+        buffer.clear()
+        self.failUnless(buffer.useSendmsg)
+
+    if hasattr(socket.socket, 'sendmsg'):
+        def testSendmsg(self):
+            (a, b) = socket.socketpair()
+            try:
+                buffer = drivers.SendBuffer()
+                buffer.append([ircmsgs.ping('foo'), ircmsgs.ping('bar')])
+                buffer._consume(3)
+                self.assertEqual(buffer.sendTo(a), 19)
+                self.assertEqual(b.recv(100), b'G :foo\r\nPING :bar\r\n')
+                self.failIf(buffer.chunks)
+            finally:
+                a.close()
+                b.close()
+
+class LineBufferTestCase(SupyTestCase):
+    def testLines(self):
+        buffer = drivers.LineBuffer(16)
+        buffer.feed(b'foo\r\nba')
+        self.assertEqual(buffer.readLines(), ['foo\r'])
+        self.assertEqual(buffer.readLines(), [])
+        buffer.feed(b'r\nbaz\n')
+        self.assertEqual(buffer.readLines(), ['bar', 'baz'])
+        self.assertEqual((buffer.start, buffer.end), (0, 0))
+
+    def testLongLines(self):
+        buffer = drivers.LineBuffer(16)
+        buffer.feed(b'0123456789')
+        buffer.feed(b'0123456789\n01')
+        self.assertEqual(buffer.readLines(), ['01234567890123456789'])
+        buffer.feed(b'2345678901234\n')
+        self.assertEqual(buffer.readLines(), ['012345678901234'])
+        self.assertEqual(len(buffer.buffer), 32)
+
+    if minisix.PY3:
+        def testInvalidUtf8(self):
+            buffer = drivers.LineBuffer(16)
+            buffer.feed(b'caf\xc3\xa9\ncaf\xe9\n')
+            self.assertEqual(buffer.readLines()[0], 'caf\xe9')
+
+    def testRecvInto(self):
+        (a, b) = socket.socketpair()
+        try:
+            buffer = drivers.LineBuffer(16)
+            a.sendall(b'foo\nbar')
+            self.assertEqual(buffer.recvInto(b), 7)
+            self.assertEqual(buffer.readLines(), ['foo'])
+        finally:
+            a.close()
+            b.close()
+
+class SocketDriverTestCase(DriverTestCase, SupyTestCase):
+    driverModule = 'Socket'
+
+    def testScheduledEventWakesDriver(self):
+        self.checkScheduledEventWakesDriver()
+
+if selectors is not None:
+    class SelectorsDriverTestCase(DriverTestCase, SupyTestCase):
+        driverModule = 'Selectors'
+
+        def testScheduledEventWakesDriver(self):
+            self.checkScheduledEventWakesDriver()
+
+        def testTimeoutUntilScheduledEvent(self):
+            from supybot.drivers import Selectors
+            name = schedule.addEvent(lambda: None, time.time() + 0.2)
+            try:
+                self.failUnless(Selectors.SelectorsDriver._getTimeout() <= 0.2)
+            finally:
+                schedule.removeEvent(name)
+
+        def testConnectionInProgress(self):
+            from supybot.drivers import Selectors
+            self.failUnless(self.runUntilReceived(b'\r\nUSER '))
+            instances = len(Selectors.SelectorsDriver._instances)
+            # Like after a connect() which did not complete at once.
+            self.driver._unregister()
+            self.driver._checkAndWriteOrReconnect()
+            self.failUnless(self.driver._registeredConn is self.driver.conn)
+            self.assertEqual(len(Selectors.SelectorsDriver._instances),
+                             instances)
+            self.server.sendall(b':irc.example.net PING :foobar\r\n')
+            self.failUnless(self.runUntilReceived(b'PONG :foobar\r\n'))
+
+        def testRunnerDiesWithLastDriver(self):
+            from supybot.drivers import Selectors
+            drivers.run()
+            self.failUnless(Selectors.SelectorsDriver._runner is not None)
+            self.failUnless(schedule.schedule.wakeup is not None)
+            self.driver.die()
+            self.driver._reallyDie()
+            self.failUnless(Selectors.SelectorsDriver._runner is None)
+            self.failUnless(schedule.schedule.wakeup is None)
+
+if minisix.PY3 and sys.version_info >= (3, 5):
+    class AsyncioDriverTestCase(DriverTestCase, SupyTestCase):
+        driverModule = 'Asyncio'
+
+        def testScheduledEventRunsInLoop(self):
+            from supybot.drivers import Asyncio
+            ran = []
+            start = time.time()
+            schedule.addEvent(lambda: ran.append(time.time()), start + 0.1)
+            Asyncio.AsyncioDriver._runner.run()
+            self.assertEqual(len(ran), 1)
+            self.failUnless(ran[0] - start < conf.supybot.drivers.poll())
+
+        def testRunnerDiesWithLastDriver(self):
+            from supybot.drivers import Asyncio
+            drivers.run()
+            self.failUnless(Asyncio.AsyncioDriver._runner is not None)
+            self.failUnless(schedule.schedule.wakeup is not None)
+            self.driver.die()
+            self.driver._reallyDie()
+            self.failUnless(Asyncio.AsyncioDriver._runner is None)
+            self.failUnless(schedule.schedule.wakeup is None)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -0,0 +1,182 @@
+###
+# Copyright (c) 2026, The Limnoria contributors
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#   * Redistributions of source code must retain the above copyright notice,
+#     this list of conditions, and the following disclaimer.
+#   * Redistributions in binary form must reproduce the above copyright notice,
+#     this list of conditions, and the following disclaimer in the
+#     documentation and/or other materials provided with the distribution.
+#   * Neither the name of the author of this software nor the name of
+#     contributors to this software may be used to endorse or promote products
+#     derived from this software without specific prior written consent.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+###
+
+
+from supybot.test import *
+
+import gzip
+import time
+import socket
+import threading
+
+import supybot.conf as conf
+import supybot.httpserver as httpserver
+
+if minisix.PY2:
+    from httplib import HTTPConnection
+else:
+    from http.client import HTTPConnection
+
+class EchoCallback(httpserver.SupyHTTPServerCallback):
+    name = 'echo'
+    def doGet(self, handler, path):
+        if path == '/slow':
+            time.sleep(0.5)
+        # No Content-Length, like most plugins.
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; charset=utf-8')
+        self.end_headers()
+        self.write(path * 100)
+
+class HTTPServerTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = httpserver.RealSupyHTTPServer(('127.0.0.1', 0), 4,
+                httpserver.SupyHTTPRequestHandler)
+        self.server.hook('echo', EchoCallback())
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.start()
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        SupyTestCase.tearDown(self)
+
+    def request(self, connection, path, headers={}):
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        return (response, response.read())
+
+    def testKeepAlive(self):
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        (response, body) = self.request(connection, '/echo/foo')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, b'/foo' * 100)
+        self.assertEqual(response.getheader('Content-Length'), '400')
+        sock = connection.sock
+        (response, body) = self.request(connection, '/echo/bar')
+        self.assertEqual(body, b'/bar' * 100)
+        self.failUnless(connection.sock is sock)
+        (response, body) = self.request(connection, '/nonexistent')
+        self.assertEqual(response.status, 404)
+        self.assertEqual(int(response.getheader('Content-Length')),
+                         len(body))
+        connection.close()
+
+    def testGzip(self):
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        (response, body) = self.request(connection, '/echo/foo',
+                                        {'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(int(response.getheader('Content-Length')),
+                         len(body))
+        fd = gzip.GzipFile(fileobj=minisix.io.BytesIO(body))
+        self.assertEqual(fd.read(), b'/foo' * 100)
+        with conf.supybot.servers.http.gzip.context(False):
+            (response, body) = self.request(connection, '/echo/foo',
+                                            {'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.getheader('Content-Encoding'), None)
+        (response, body) = self.request(connection, '/echo/foo',
+                                        {'Accept-Encoding': 'gzip;q=0'})
+        self.assertEqual(response.getheader('Content-Encoding'), None)
+        self.assertEqual(body, b'/foo' * 100)
+        connection.close()
+
+    def testSlowClients(self):
+        # A client which does not send its request, and one whose request is
+        # slow to handle, do not block the others.
+        idle = socket.create_connection(('127.0.0.1', self.port))
+        idle.send(b'GET /echo/foo HTTP/1.1\r\n')
+        slow = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        slow.request('GET', '/echo/slow')
+        start = time.time()
+        connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+        (response, body) = self.request(connection, '/echo/foo')
+        self.assertEqual(body, b'/foo' * 100)
+        self.failUnless(time.time() - start < 0.4)
+        self.assertEqual(slow.getresponse().read(), b'/slow' * 100)
+        idle.close()
+        slow.close()
+        connection.close()
+
+    def testMaximumWorkers(self):
+        with conf.supybot.servers.http.maximumWorkers.context(1):
+            slow = HTTPConnection('127.0.0.1', self.port, timeout=5)
+            slow.request('GET', '/echo/slow')
+            time.sleep(0.1)
+            connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+            start = time.time()
+            (response, body) = self.request(connection, '/echo/foo')
+            self.failUnless(time.time() - start > 0.2)
+            response = slow.getresponse()
+            # Another connection was waiting for the only worker.
+            self.assertEqual(response.getheader('Connection'), 'close')
+            self.assertEqual(response.read(), b'/slow' * 100)
+            self.assertEqual(len(self.server.workers), 1)
+            slow.close()
+            connection.close()
+
+    def testIdleConnectionsAreClosed(self):
+        with conf.supybot.servers.http.maximumWorkers.context(1):
+            idle = HTTPConnection('127.0.0.1', self.port, timeout=5)
+            (response, body) = self.request(idle, '/echo/foo')
+            self.assertEqual(response.getheader('Connection'), None)
+            # The only worker now waits for the next request of idle, but
+            # gives up as soon as another connection needs it.
+            connection = HTTPConnection('127.0.0.1', self.port, timeout=5)
+            start = time.time()
+            (response, body) = self.request(connection, '/echo/bar')
+            self.assertEqual(body, b'/bar' * 100)
+            self.failUnless(time.time() - start < 1)
+            connection.close()
+            idle.sock.settimeout(5)
+            self.assertEqual(idle.sock.recv(100), b'')
+            idle.close()
+
+    def testPipelinedRequests(self):
+        sock = socket.create_connection(('127.0.0.1', self.port))
+        sock.settimeout(5)
+        sock.sendall(b'GET /echo/foo HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                     b'GET /echo/bar HTTP/1.1\r\nHost: localhost\r\n'
+                     b'Connection: close\r\n\r\n')
+        data = b''
+        while True:
+            s = sock.recv(4096)
+            if not s:
+                break
+            data += s
+        sock.close()
+        self.failUnless(b'/foo' * 100 in data)
+        self.failUnless(b'/bar' * 100 in data)
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -31,6 +31,7 @@ from supybot.test import *
 
 import os
 import unittest
+import threading
 
 import supybot.conf as conf
 import supybot.world as world
@@ -400,6 +401,43 @@ class UsersDictionaryTestCase(IrcdbTestCase):
         u2.addHostmask('*!xyzzy@baz.domain.c?m')
         self.assertRaises(ValueError, self.users.setUser, u2)
 
+    def testHostmaskIndex(self):
+        patterns = ['*!*@*.domain.com', 'bar!baz@*', 'qux!*@ho?t',
+                    'exact!user@host.net', '*!ident@*', '*!\xe9t\xe9@*']
+        for (i, pattern) in enumerate(patterns):
+            u = self.users.newUser()
+            u.name = 'user%s' % i
+            u.addHostmask(pattern)
+            self.users.setUser(u)
+        self.assertEqual(self.users.getUserId('a!b@c.domain.com'), 1)
+        self.assertEqual(self.users.getUserId('a!b@C.DOMAIN.COM'), 1)
+        self.assertEqual(self.users.getUserId('bar!baz@elsewhere'), 2)
+        self.assertEqual(self.users.getUserId('QUX!x@host'), 3)
+        self.assertEqual(self.users.getUserId('exact!user@host.net'), 4)
+        self.assertEqual(self.users.getUserId('a!ident@b'), 5)
+        self.assertEqual(self.users.getUserId('a!\xe9t\xe9@b'), 6)
+
+    def testHostmaskCacheInvalidation(self):
+        u = self.users.newUser()
+        u.name = 'foo'
+        u.addHostmask('foo!bar@baz')
+        self.users.setUser(u)
+        self.assertEqual(self.users.getUserId('foo!bar@baz'), 1)
+        self.assertRaises(KeyError, self.users.getUserId, 'qux!bar@baz')
+        # IrcUser.addHostmask indexes the hostmask in the global database.
+        (users, ircdb.users) = (ircdb.users, self.users)
+        try:
+            u.addHostmask('qux!*@baz')
+        finally:
+            ircdb.users = users
+        self.assertEqual(self.users.getUserId('qux!bar@baz'), 1)
+        u.removeHostmask('foo!bar@baz')
+        self.users.setUser(u)
+        self.assertRaises(KeyError, self.users.getUserId, 'foo!bar@baz')
+        self.users.delUser(1)
+        self.assertRaises(KeyError, self.users.getUserId, 'qux!bar@baz')
+        self.assertEqual(len(self.users._hostmaskCache), 0)
+
 
 class CheckCapabilityTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
@@ -562,6 +600,86 @@ class CheckCapabilityTestCase(IrcdbTestCase):
         finally:
             conf.supybot.capabilities.default.set(str(originalConfDefaultAllow))
 
+    def testDecisionCache(self):
+        cache = ircdb.capabilityCache
+        self.failUnless(self.checkCapability(self.nothing, 'bar'))
+        hits = cache.hits
+        self.failUnless(self.checkCapability(self.nothing, 'bar'))
+        self.assertEqual(cache.hits, hits + 1)
+        u = self.users.getUser(self.nothing)
+        u.addCapability('-bar')
+        self.failIf(self.checkCapability(self.nothing, 'bar'))
+        u.removeHostmask(self.nothing)
+        self.users.setUser(u)
+        self.failUnless(self.checkCapability(self.nothing, 'bar'))
+        u.addHostmask(self.nothing)
+        self.users.setUser(u)
+        self.failIf(self.checkCapability(self.nothing, 'bar'))
+        conf.supybot.capabilities().add('-bar')
+        try:
+            self.failIf(self.checkCapability(self.justfoo, 'bar'))
+        finally:
+            conf.supybot.capabilities().remove('-bar')
+        self.failUnless(self.checkCapability(self.justfoo, 'bar'))
+
+    def testDecisionCacheAuthTimeout(self):
+        hostmask = 'other!other@other'
+        u = self.users.getUser(self.antifoo)
+        u.addAuth(hostmask)
+        u.auth = [(when - 0.5, mask) for (when, mask) in u.auth]
+        self.users.setUser(u)
+        cache = ircdb.capabilityCache
+        with conf.supybot.databases.users.timeoutIdentification.context(1):
+            self.failIf(self.checkCapability(hostmask, self.cap))
+            misses = cache.misses
+            self.failIf(self.checkCapability(hostmask, self.cap))
+            self.assertEqual(cache.misses, misses)
+            time.sleep(0.6)
+            self.checkCapability(hostmask, self.cap)
+            self.assertEqual(cache.misses, misses + 1)
+
+    def testCheckCapabilities(self):
+        self.failUnless(ircdb.checkCapabilities(self.justfoo,
+            ['bar', self.cap], requireAll=True,
+            users=self.users, channels=self.channels))
+        self.failIf(ircdb.checkCapabilities(self.antifoo, ['admin', self.cap],
+            users=self.users, channels=self.channels))
+
+class CapabilityCacheTestCase(SupyTestCase):
+    def testStaleDecisionsAreNotStored(self):
+        cache = ircdb.CapabilityCache()
+        generations = cache.getGenerations()
+        cache.set('foo', True, generations)
+        self.assertEqual(cache.get('foo'), True)
+        generations = cache.getGenerations()
+        cache.bump(cache.USERS)
+        cache.set('bar', True, generations)
+        self.assertRaises(KeyError, cache.get, 'bar')
+        self.assertRaises(KeyError, cache.get, 'foo')
+
+    def testThreads(self):
+        cache = ircdb.CapabilityCache(50)
+        errors = []
+        def f(n):
+            try:
+                for i in range(5000):
+                    key = (i * n) % 100
+                    try:
+                        cache.get(key)
+                    except KeyError:
+                        cache.set(key, True, cache.getGenerations())
+                    if i % 50 == 0:
+                        cache.bump(cache.CHANNELS)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=f, args=(n,))
+                   for n in (1, 3, 7, 11)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
 class PersistanceTestCase(IrcdbTestCase):
     filename = os.path.join(conf.supybot.directories.conf(),
                             'PersistanceTestCase.conf')
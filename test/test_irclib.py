@@ -181,6 +181,58 @@ class IrcMsgQueueTestCase(SupyTestCase):
         self.assertEqual(self.mode, q.dequeue())
         self.assertEqual(self.msg, q.dequeue())
 
+    def testTargetsTakeTurns(self):
+        q = irclib.IrcMsgQueue()
+        for msg in self.msgs[:3]:
+            q.enqueue(msg)
+        bar = ircmsgs.privmsg('#BAR', 'baz')
+        q.enqueue(bar)
+        q.enqueue(self.notice)
+        q.enqueue(ircmsgs.privmsg('#bar', 'qux'))
+        self.assertEqual(len(q), 6)
+        self.assertEqual([q.dequeue() for i in range(6)],
+                         [self.msgs[0], bar, self.notice, self.msgs[1],
+                          ircmsgs.privmsg('#bar', 'qux'), self.msgs[2]])
+        self.failIf(q)
+        self.failIf(bar in q)
+
+    def testHeldBackJoins(self):
+        q = irclib.IrcMsgQueue()
+        with conf.supybot.protocols.irc.queuing.rateLimit.join.context(10):
+            q.enqueue(self.join)
+            q.enqueue(ircmsgs.join('#bar'))
+            now = time.time()
+            self.assertEqual(q.nextTime(now), now)
+            self.assertEqual(q.dequeue(), self.join)
+            self.assertEqual(q.dequeue(), None)
+            self.failUnless(q.nextTime(now) >= q.lastJoin + 10)
+            who = ircmsgs.who('#baz')
+            q.enqueue(who)
+            self.assertEqual(q.nextTime(now), now)
+            self.assertEqual(q.dequeue(), None)
+            self.assertEqual(q.dequeue(), who)
+            self.failUnless(q.nextTime(now) >= q.lastJoin + 10)
+            q.enqueue(self.msg)
+            self.assertEqual(q.nextTime(now), now)
+
+
+class TokenBucketTestCase(SupyTestCase):
+    def testBurst(self):
+        bucket = irclib.TokenBucket(2, 3)
+        self.failUnless(bucket.take(100))
+        self.failUnless(bucket.take(100))
+        self.failUnless(bucket.take(100))
+        self.failIf(bucket.take(100))
+        self.assertEqual(bucket.nextTime(100), 102)
+        self.failIf(bucket.take(101))
+        self.failUnless(bucket.take(102))
+        self.failIf(bucket.take(103))
+        self.assertEqual(bucket.nextTime(110), 110)
+        self.failUnless(bucket.take(110))
+        self.failUnless(bucket.take(110))
+        self.failUnless(bucket.take(110))
+        self.failIf(bucket.take(110))
+
 
 class ChannelStateTestCase(SupyTestCase):
     def testPickleCopy(self):
@@ -336,6 +388,49 @@ class IrcStateTestCase(SupyTestCase):
         self.failIf('foo' in st.channels['#foo'].users)
         self.failUnless('foo' in st2.channels['#foo'].users)
 
+    def testNicksToChannels(self):
+        st = irclib.IrcState()
+        index = st.channels.nicksToChannels
+        st.addMsg(self.irc, ircmsgs.join('#foo', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix=self.irc.prefix))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':host 353 nick = #foo :nick @foo +bar'))
+        st.addMsg(self.irc, ircmsgs.join('#bar', prefix='foo!bar@baz'))
+        st.addMsg(self.irc, ircmsgs.IrcMsg(
+            ':host 352 nick #bar ~baz host server baz H :0 baz'))
+        self.assertEqual(index['FOO'], ircutils.IrcSet(['#foo', '#bar']))
+        self.assertEqual(index['bar'], ircutils.IrcSet(['#foo']))
+        self.assertEqual(index['baz'], ircutils.IrcSet(['#bar']))
+        self.assertEqual(st, pickle.loads(pickle.dumps(st)))
+        self.assertEqual(pickle.loads(pickle.dumps(st)).channels
+                         .nicksToChannels, index)
+        self.assertEqual(st.copy().channels.nicksToChannels, index)
+
+        st.addMsg(self.irc, ircmsgs.IrcMsg(':foo!bar@baz NICK qux'))
+        self.failIf('foo' in index)
+        self.assertEqual(index['qux'], ircutils.IrcSet(['#foo', '#bar']))
+        self.failUnless(st.channels['#foo'].isOp('qux'))
+        st.addMsg(self.irc, ircmsgs.part('#foo', prefix='qux!bar@baz'))
+        self.assertEqual(index['qux'], ircutils.IrcSet(['#bar']))
+        st.addMsg(self.irc, ircmsgs.kick('#foo', 'bar',
+                                         prefix=self.irc.prefix))
+        self.failIf('bar' in index)
+        m = ircmsgs.quit(prefix='qux!bar@baz')
+        st.addMsg(self.irc, m)
+        self.assertEqual(m.tagged('channels'), ircutils.IrcSet(['#bar']))
+        self.failIf('qux' in st.channels['#bar'].users)
+        self.failIf('qux' in index)
+
+        st.addMsg(self.irc, ircmsgs.part('#bar', prefix=self.irc.prefix))
+        self.failIf('baz' in index)
+        self.assertEqual(index['nick'], ircutils.IrcSet(['#foo']))
+        st.channels['#foo'] = irclib.ChannelState()
+        self.failIf('nick' in index)
+        st.channels['#foo'].addUser('nick')
+        self.assertEqual(index['nick'], ircutils.IrcSet(['#foo']))
+        st.reset()
+        self.failIf(index)
+
 
     def testEq(self):
         state1 = irclib.IrcState()
@@ -431,6 +526,15 @@ class IrcTestCase(SupyTestCase):
         msg = self.irc.takeMsg()
         self.failUnless(msg.command == 'NICK' and msg.args[0] != self.irc.nick)
 
+    def testNextTakeTimeWithHeldBackJoin(self):
+        with conf.supybot.protocols.irc.queuing.rateLimit.join.context(10):
+            self.irc.queueMsg(ircmsgs.join('#foo'))
+            self.irc.queueMsg(ircmsgs.join('#bar'))
+            self.assertEqual(self.irc.takeMsg().args[0], '#foo')
+            self.assertEqual(self.irc.takeMsg(), None)
+            # Drivers wait until then, instead of calling takeMsg in a loop.
+            self.failUnless(self.irc.nextTakeTime() > time.time() + 5)
+
     def testSendBeforeQueue(self):
         while self.irc.takeMsg() is not None:
             self.irc.takeMsg()
@@ -157,6 +157,28 @@ class IrcMsgTestCase(SupyTestCase):
                              ':Angel!angel@example.org PRIVMSG Wiz :Hello')
         self.assertEqual(msg.time, 1319042451.62)
 
+    def testLazyFields(self):
+        msg = ircmsgs.IrcMsg('@time=2011-10-19T16:40:51.620Z;foo '
+                             ':Angel!angel@example.org PRIVMSG Wiz :Hello')
+        self.assertEqual(msg.args, ('Wiz', 'Hello'))
+        self.assertIs(msg._server_tags, None)
+        self.assertIs(msg._nick, None)
+        copy = ircmsgs.IrcMsg(args=('Angel', 'Hi'), msg=msg)
+        self.assertEqual(copy.time, 1319042451.62)
+        self.assertEqual(copy.server_tags['foo'], None)
+        self.assertIs(msg._server_tags, None)
+        self.assertEqual((msg.nick, msg.user, msg.host),
+                         ('Angel', 'angel', 'example.org'))
+        self.assertEqual(msg.server_tags,
+                         {'time': '2011-10-19T16:40:51.620Z', 'foo': None})
+        msg.time = 42
+        self.assertEqual(msg.time, 42)
+
+        # A time tag that cannot be parsed is ignored.
+        before = time.time()
+        msg = ircmsgs.IrcMsg('@time=yesterday PING :foo')
+        self.assertTrue(before <= msg.time <= time.time())
+
 class FunctionsTestCase(SupyTestCase):
     def testIsAction(self):
         L = [':jemfinch!~jfincher@ts26-2.homenet.ohio-state.edu PRIVMSG'
@@ -30,5 +30,126 @@
 
 from supybot.test import *
 
+import os
+
 import supybot.irclib as irclib
 import supybot.plugins as plugins
+
+class ListDB(plugins.ChannelUserDB):
+    def serialize(self, v):
+        return v
+
+    def deserialize(self, channel, id, L):
+        return L
+
+class ChannelUserDBTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.filename = conf.supybot.directories.data.dirize('ListDB.db')
+        self.journal = conf.supybot.databases.plugins.journal()
+        conf.supybot.databases.plugins.journal.setValue(True)
+        self.removeFiles()
+
+    def tearDown(self):
+        conf.supybot.databases.plugins.journal.setValue(self.journal)
+        self.removeFiles()
+        SupyTestCase.tearDown(self)
+
+    def removeFiles(self):
+        for suffix in ('', '.journal', '.journal.compacting'):
+            if os.path.exists(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+    def testJournal(self):
+        db = ListDB(self.filename)
+        db['#foo', 1] = ['bar']
+        db['#foo', 'baz'] = ['qux', 'quux']
+        db.flush()
+        self.failIf(os.path.exists(self.filename))
+        self.failUnless(os.path.exists(self.filename + '.journal'))
+        db = ListDB(self.filename)
+        self.assertEqual(db['#foo', 1], ['bar'])
+        self.assertEqual(db['#foo', 'baz'], ['qux', 'quux'])
+        del db['#foo', 1]
+        db.flush()
+        db = ListDB(self.filename)
+        self.failIf(('#foo', 1) in db)
+        self.assertEqual(db['#foo', 'baz'], ['qux', 'quux'])
+
+    def testOnlyDirtyRecordsAreWritten(self):
+        db = ListDB(self.filename)
+        db['#foo', 1] = ['bar']
+        db['#foo', 2] = ['baz']
+        db.flush()
+        size = os.path.getsize(self.filename + '.journal')
+        db.flush()
+        self.assertEqual(os.path.getsize(self.filename + '.journal'), size)
+        db['#foo', 1].append('qux') # Updated in place
+        db.flush()
+        db = ListDB(self.filename)
+        self.assertEqual(db['#foo', 1], ['bar', 'qux'])
+        self.assertEqual(db['#foo', 2], ['baz'])
+
+    def testCompaction(self):
+        db = ListDB(self.filename)
+        for i in range(2000):
+            db['#foo', i] = ['x' * 50]
+        db.flush()
+        db.close()
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        self.failIf(os.path.exists(self.filename + '.journal.compacting'))
+        db = ListDB(self.filename)
+        self.assertEqual(len(list(db.items())), 2000)
+        self.assertEqual(db['#foo', 1999], ['x' * 50])
+
+    def testInterruptedCompaction(self):
+        db = ListDB(self.filename)
+        db['#foo', 1] = ['bar']
+        db.flush()
+        os.rename(self.filename + '.journal',
+                  self.filename + '.journal.compacting')
+        db['#foo', 1] = ['baz']
+        db.flush()
+        db = ListDB(self.filename)
+        self.assertEqual(db['#foo', 1], ['baz'])
+        self.failUnless(os.path.exists(self.filename))
+        self.failIf(os.path.exists(self.filename + '.journal.compacting'))
+
+    def testFailedCompactions(self):
+        db = ListDB(self.filename)
+        def _writeAll(items):
+            raise IOError('No space left on device')
+        db._writeAll = _writeAll
+        for i in range(2000):
+            db['#foo', i] = ['x' * 50]
+        db.flush()
+        db.compactingThread.join()
+        self.failUnless(os.path.exists(self.filename + '.journal.compacting'))
+        for i in range(2000):
+            db['#bar', i] = ['y' * 50]
+        del db['#foo', 0]
+        db.flush()
+        db.compactingThread.join()
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        db = ListDB(self.filename)
+        self.assertEqual(len(list(db.items())), 3999)
+        self.assertEqual(db['#foo', 1999], ['x' * 50])
+        self.assertEqual(db['#bar', 1999], ['y' * 50])
+        self.failIf(('#foo', 0) in db)
+        self.failIf(os.path.exists(self.filename + '.journal.compacting'))
+
+    def testDisablingJournal(self):
+        db = ListDB(self.filename)
+        db['#foo', 1] = ['bar']
+        db.flush()
+        conf.supybot.databases.plugins.journal.setValue(False)
+        db = ListDB(self.filename)
+        self.assertEqual(db['#foo', 1], ['bar'])
+        db.flush()
+        self.failUnless(os.path.exists(self.filename))
+        self.failIf(os.path.exists(self.filename + '.journal'))
+        db = ListDB(self.filename)
+        self.assertEqual(db['#foo', 1], ['bar'])
+
+
+# vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
@@ -224,4 +224,30 @@ class SecurityTestCase(SupyTestCase):
         self.assertFalse(g._private)
         self.assertTrue(g.val._private)
 
+class AccessorTestCase(SupyTestCase):
+    def testGet(self):
+        g = registry.Group()
+        g.setName('accessorTest')
+        g.register('sub')
+        v = registry.String('foo', 'help', supplyDefault=True)
+        g.sub.register('val', v)
+        accessor = registry.Accessor(g, ['sub', 'val'])
+        self.assertTrue(accessor.get() is v)
+        self.assertEqual(accessor.get('#chan')(), 'foo')
+        g.sub.val.get('#other').setValue('bar')
+        self.assertEqual(accessor.get('#other')(), 'bar')
+        v.setValue('baz')
+        self.assertEqual(accessor.get('#chan')(), 'baz')
+        self.assertEqual(accessor.get('#other')(), 'bar')
+
+    def testUnregister(self):
+        g = registry.Group()
+        g.setName('accessorTest')
+        g.register('val', registry.String('foo', 'help'))
+        accessor = registry.Accessor(g, ['val'])
+        self.assertEqual(accessor.get()(), 'foo')
+        g.unregister('val')
+        g.register('val', registry.String('bar', 'help'))
+        self.assertEqual(accessor.get()(), 'bar')
+
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
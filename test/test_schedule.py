@@ -31,9 +31,24 @@ from supybot.test import *
 
 import time
 
+import supybot.drivers as drivers
 import supybot.schedule as schedule
 
 class TestSchedule(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        # Our schedules are drivers named like the global one; keep them from
+        # replacing it in the driver loop.
+        self.oldDrivers = (drivers._drivers, drivers._newDrivers,
+                           drivers._deadDrivers)
+        (drivers._drivers, drivers._newDrivers, drivers._deadDrivers) = \
+                ({}, [], set())
+
+    def tearDown(self):
+        (drivers._drivers, drivers._newDrivers, drivers._deadDrivers) = \
+                self.oldDrivers
+        SupyTestCase.tearDown(self)
+
     def testSchedule(self):
         sched = schedule.Schedule()
         i = [0]
@@ -118,6 +133,45 @@ class TestSchedule(SupyTestCase):
         sched.run() # 3.4
         self.assertEqual(i[0], 3)
 
+    def testRemoveMany(self):
+        sched = schedule.Schedule()
+        ran = []
+        now = time.time()
+        for i in range(1000):
+            sched.addEvent(ran.append, now - 1000 + i, name=i, args=[i])
+        for i in range(0, 1000, 3):
+            sched.removeEvent(i)
+        # Removed entries do not pile up in the heap.
+        self.failUnless(len(sched.schedule) <= 2 * len(sched.events) + 1)
+        sched.run()
+        self.assertEqual(ran, [i for i in range(1000) if i % 3])
+        self.assertEqual(sched.events, {})
+        self.assertEqual(sched.nextEventTime(), None)
+
+    def testRemoveThenAddSameName(self):
+        sched = schedule.Schedule()
+        i = [0]
+        def inc():
+            i[0] += 1
+        sched.addEvent(inc, time.time() - 1, 'test')
+        sched.removeEvent('test')
+        sched.addEvent(inc, time.time() + 3, 'test')
+        sched.run()
+        self.assertEqual(i[0], 0)
+        self.failUnless(sched.nextEventTime() > time.time())
+        sched.rescheduleEvent('test', time.time() - 1)
+        sched.run()
+        self.assertEqual(i[0], 1)
+        self.assertRaises(KeyError, sched.removeEvent, 'test')
+
+    def testLagStats(self):
+        sched = schedule.Schedule()
+        sched.addEvent(lambda: None, time.time() - 2)
+        sched.run()
+        self.assertEqual(sched.stats['ran'], 1)
+        self.failUnless(sched.stats['maxLag'] >= 2)
+        self.failUnless(sched.stats['totalLag'] >= 2)
+
 
 # vim:set shiftwidth=4 softtabstop=4 expandtab textwidth=79:
 
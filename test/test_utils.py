@@ -33,6 +33,7 @@ from supybot.test import *
 import sys
 import time
 import pickle
+import threading
 import supybot.utils as utils
 from supybot.utils.structures import *
 import supybot.utils.minisix as minisix
@@ -40,6 +41,13 @@ import supybot.utils.minisix as minisix
 if sys.version_info[0] >= 0:
     xrange = range
 
+if minisix.PY2:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+else:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
 class UtilsTest(SupyTestCase):
     def testReversed(self):
         L = list(range(10))
@@ -533,6 +541,144 @@ class WebTest(SupyTestCase):
             url = 'http://slashdot.org/'
             self.failUnless(len(utils.web.getUrl(url, 1024)) == 1024)
 
+class FakeHttpServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    def handle_error(self, request, client_address):
+        # Clients may close connections before reading whole responses.
+        pass
+
+class FakeHttpHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.client_address))
+        headers = {}
+        body = b'body of ' + self.path.encode()
+        if self.path == '/fresh':
+            headers['Cache-Control'] = 'max-age=60'
+        elif self.path == '/etag':
+            headers['Cache-Control'] = 'no-cache'
+            headers['ETag'] = '"v1"'
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                for (name, value) in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
+        elif self.path == '/big':
+            body = b'x' * 100000
+        else:
+            headers['Cache-Control'] = 'no-store'
+        self.send_response(200)
+        headers['Content-Length'] = str(len(body))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path == '/close':
+            # Like a server closing an idle kept-alive connection.
+            self.close_connection = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, self.client_address))
+        if self.path == '/crash':
+            # Handled, but the connection is lost before the response.
+            self.close_connection = True
+            return
+        body = b'posted to ' + self.path.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class HttpClientTestCase(SupyTestCase):
+    def setUp(self):
+        SupyTestCase.setUp(self)
+        self.server = FakeHttpServer(('127.0.0.1', 0), FakeHttpHandler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        utils.web.client.cache.clear()
+
+    def tearDown(self):
+        utils.web.client.pool.clear()
+        utils.web.client.cache.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        SupyTestCase.tearDown(self)
+
+    def testKeepAlive(self):
+        reused = utils.web.stats['reusedConnections']
+        self.assertEqual(utils.web.getUrl(self.url + '/nostore'),
+                         b'body of /nostore')
+        self.assertEqual(utils.web.getUrl(self.url + '/nostore'),
+                         b'body of /nostore')
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0][1],
+                         self.server.requests[1][1])
+        self.assertEqual(utils.web.stats['reusedConnections'], reused + 1)
+
+    def testClosedConnections(self):
+        utils.web.getUrl(self.url + '/close')
+        time.sleep(0.1)
+        # Sent again on a new connection.
+        self.assertEqual(utils.web.getUrl(self.url + '/nostore'),
+                         b'body of /nostore')
+        self.assertEqual(utils.web.getUrl(self.url + '/post', data=b'foo'),
+                         b'posted to /post')
+        # Not sent again, as it was handled.
+        self.assertRaises((utils.web.Error, utils.web.BadStatusLine),
+                          utils.web.getUrl, self.url + '/crash', data=b'foo')
+        self.assertEqual([path for (path, address) in self.server.requests],
+                         ['/close', '/nostore', '/post', '/crash'])
+
+    def testCache(self):
+        hits = utils.web.stats['cacheHits']
+        revalidated = utils.web.stats['revalidated']
+        for i in range(2):
+            self.assertEqual(utils.web.getUrl(self.url + '/fresh'),
+                             b'body of /fresh')
+            self.assertEqual(utils.web.getUrl(self.url + '/etag'),
+                             b'body of /etag')
+        self.assertEqual([path for (path, address) in self.server.requests],
+                         ['/fresh', '/etag', '/etag'])
+        self.assertEqual(utils.web.stats['cacheHits'], hits + 1)
+        self.assertEqual(utils.web.stats['revalidated'], revalidated + 1)
+
+        # The disk cache is off by default.
+        utils.web.client.cache.memory.clear()
+        self.assertEqual(utils.web.getUrl(self.url + '/fresh'),
+                         b'body of /fresh')
+        self.assertEqual(len(self.server.requests), 4)
+
+    def testDiskCache(self):
+        with conf.supybot.protocols.http.cache.diskSize.context(10):
+            utils.web.client.cache.clear()
+            self.assertEqual(utils.web.getUrl(self.url + '/fresh'),
+                             b'body of /fresh')
+            utils.web.client.cache.memory.clear()
+            fd = utils.web.getUrlFd(self.url + '/fresh')
+            self.assertEqual(fd.read(), b'body of /fresh')
+            self.assertEqual(fd.headers['Cache-Control'], 'max-age=60')
+            self.assertEqual(len(self.server.requests), 1)
+            utils.web.client.cache.clear()
+
+    def testSize(self):
+        (target, text) = utils.web.getUrlTargetAndContent(self.url + '/big',
+                                                          size=10000)
+        self.assertEqual(target, self.url + '/big')
+        self.assertEqual(text, b'x' * 10000)
+        # The rest of the body was not read, so that connection was closed
+        # instead of being reused.
+        self.assertEqual(utils.web.getUrl(self.url + '/big'), b'x' * 100000)
+        self.assertNotEqual(self.server.requests[0][1],
+                            self.server.requests[1][1])
+
 class FormatTestCase(SupyTestCase):
     def testNormal(self):
         format = utils.str.format
@@ -1147,6 +1293,81 @@ class TestCacheDict(SupyTestCase):
             self.failUnless(i in d)
             self.failUnless(d[i] == i)
 
+    def testLeastRecentlyUsedIsEvicted(self):
+        d = CacheDict(2, a=1)
+        d['b'] = 2
+        d['a']
+        d['c'] = 3
+        self.assertEqual(sorted(d), ['a', 'c'])
+
+class TestLRUCacheDict(SupyTestCase):
+    def testMaxNeverExceeded(self):
+        max = 10
+        d = LRUCacheDict(10)
+        for i in xrange(max**2):
+            d[i] = i
+            self.failUnless(len(d) <= max)
+            self.failUnless(i in d)
+            self.failUnless(d[i] == i)
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        evicted = []
+        d = LRUCacheDict(3, onEvict=lambda k, v: evicted.append((k, v)))
+        d['a'] = 1
+        d['b'] = 2
+        d['c'] = 3
+        d['a']
+        d['d'] = 4
+        self.assertEqual(evicted, [('b', 2)])
+        self.assertEqual(list(d), ['c', 'a', 'd'])
+        d['c'] = 5
+        d['e'] = 6
+        self.assertEqual(evicted, [('b', 2), ('a', 1)])
+        self.assertEqual(list(d.items()), [('d', 4), ('c', 5), ('e', 6)])
+        del d['c']
+        self.failIf('c' in d)
+        self.assertEqual(len(d), 2)
+        d.clear()
+        self.assertEqual(list(d), [])
+
+    def testStatistics(self):
+        size = [2]
+        d = LRUCacheDict(lambda: size[0])
+        d['a'] = 1
+        d['b'] = 2
+        d['a']
+        self.assertEqual(d.get('c'), None)
+        d['c'] = 3
+        self.assertEqual(list(d), ['a', 'c'])
+        self.assertEqual((d.hits, d.misses, d.evictions), (1, 1, 1))
+        size[0] = 1
+        d['d'] = 4
+        self.assertEqual(list(d), ['d'])
+        self.assertEqual(d.evictions, 3)
+
+    def testThreads(self):
+        d = LRUCacheDict(50)
+        errors = []
+        def f(n):
+            try:
+                for i in range(20000):
+                    key = (i * n) % 200
+                    if d.get(key) is None:
+                        d[key] = i
+                    if i % 100 == 0:
+                        d.pop(key, None)
+            except Exception as e:
+                errors.append(e)
+        threads = [threading.Thread(target=f, args=(n,))
+                   for n in (1, 3, 7, 11)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.failUnless(len(d) <= 50)
+        self.assertEqual(sorted(d.keys()), sorted(d.d))
+
 class TestTruncatableSet(SupyTestCase):
     def testBasics(self):
         s = TruncatableSet(['foo', 'bar', 'baz', 'qux'])